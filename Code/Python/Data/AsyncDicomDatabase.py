@@ -0,0 +1,510 @@
+import asyncio
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import date
+from typing import Iterable, AsyncIterator, Any, Callable
+from Data.BasicDicomDatabase import BasicDicomDatabase
+from Data.IDicomDatabase import DeletionCounts, StudySummary, StudyFilter, SeriesFilter
+from Taxons.Patient import Patient, Study
+from Taxons.Series import Series, Instance
+
+
+class AsyncDicomDatabase:
+    """
+    asyncio facade of a DICOM-oriented database, offering the methods of IDicomDatabase as coroutines.
+    The blocking sqlite work never runs on the event loop:
+    - all writes run on a single writer thread, owning the only read-write connection;
+    - all reads run on a pool of reader threads, each call borrowing one of a pool of read-only connections.
+    The readers only run concurrently with the writer because the connections use the WAL journal
+    (see SqliteConnectionManager); under a rollback journal every write would block all readers.
+    Cancelling a read interrupts its running statement. Cancelling a write only withdraws it if it has not started yet;
+    a running write is completed, since every write method is a single atomic transaction.
+    """
+
+    # region Construction
+    def __init__(self, number_of_readers: int = 4, cached_statements: int = 128, name_index: bool = True,
+                 profile: str = "durable"):
+        """
+        Creates an instance of AsyncDicomDatabase.
+        :param number_of_readers: The number of reader threads and read-only connections.
+        :param cached_statements: Size of the sqlite3 statement cache of every connection.
+        :param name_index: If True, patient name searches use the FTS5 trigram index (see BasicDicomDatabase).
+        :param profile: The name of the connection profile: "durable" or "throughput" (see SqliteConnectionManager).
+        """
+        self._number_of_readers = number_of_readers
+        self._cached_statements = cached_statements
+        self._name_index = name_index
+        self._profile = profile
+
+        self._writer: BasicDicomDatabase = None
+        self._readers: asyncio.Queue = None
+        self._writer_executor: ThreadPoolExecutor = None
+        self._reader_executor: ThreadPoolExecutor = None
+    # endregion
+
+    # region General Management
+    async def open(self, database_file_name: str):
+        """
+        Opens the database: first the writer connection (creating the tables, if necessary), then the readers.
+        :param database_file_name: The path to the database file
+        :return None:
+        """
+        loop = asyncio.get_running_loop()
+
+        self._writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pykkami-writer")
+        self._reader_executor = ThreadPoolExecutor(max_workers=self._number_of_readers,
+                                                   thread_name_prefix="pykkami-reader")
+
+        self._writer = BasicDicomDatabase(self._cached_statements, self._name_index, profile=self._profile)
+        await loop.run_in_executor(self._writer_executor, self._writer.open, database_file_name)
+
+        self._readers = asyncio.Queue()
+
+        for i in range(self._number_of_readers):
+            reader = BasicDicomDatabase(self._cached_statements, self._name_index, read_only=True,
+                                        per_thread_connections=False, profile=self._profile)
+            await loop.run_in_executor(self._reader_executor, reader.open, database_file_name)
+            self._readers.put_nowait(reader)
+
+    async def close(self):
+        """
+        Closes the database. Waits until all readers are returned to the pool, closes them, then closes the writer.
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+
+        for i in range(self._number_of_readers):
+            reader = await self._readers.get()
+            await loop.run_in_executor(self._reader_executor, reader.close)
+
+        await loop.run_in_executor(self._writer_executor, self._writer.close)
+
+        self._reader_executor.shutdown()
+        self._writer_executor.shutdown()
+
+    async def reset(self):
+        """
+        Removes all data from the database on the writer thread (see IDicomDatabase.reset).
+        """
+        return await self._write("reset")
+
+    async def vacuum(self):
+        """
+        Rebuilds the database file on the writer thread (see BasicDicomDatabase.vacuum).
+        """
+        return await self._write("vacuum")
+    # endregion
+
+    # region Patient Management
+    async def insert_patient(self, patient: Patient):
+        """
+        Tries to insert a patient (see IDicomDatabase.insert_patient).
+        """
+        return await self._write("insert_patient", patient)
+
+    async def insert_patients(self, patients: Iterable[Patient]) -> list[str]:
+        """
+        Tries to insert a number of patients within one transaction (see IDicomDatabase.insert_patients).
+        """
+        return await self._write("insert_patients", list(patients))
+
+    async def update_patient(self, patient: Patient):
+        """
+        Tries to update a patient (see IDicomDatabase.update_patient).
+        """
+        return await self._write("update_patient", patient)
+
+    async def upsert_patients(self, patients: Iterable[Patient]) -> list[str]:
+        """
+        Inserts or updates a number of patients within one transaction (see IDicomDatabase.upsert_patients).
+        """
+        return await self._write("upsert_patients", list(patients))
+
+    async def delete_patient(self, patient_id: str) -> DeletionCounts:
+        """
+        Tries to delete a patient (see IDicomDatabase.delete_patient).
+        """
+        return await self._write("delete_patient", patient_id)
+
+    async def select_patient(self, patient_id: str) -> Patient:
+        """
+        Selects a patient by PatientID (see IDicomDatabase.select_patient).
+        """
+        return await self._read("select_patient", patient_id)
+
+    async def select_patients_by_name_pattern(self, name_pattern: str) -> list[Patient]:
+        """
+        Selects a set of patients by name pattern (see IDicomDatabase.select_patients_by_name_pattern).
+        """
+        return await self._read("select_patients_by_name_pattern", name_pattern)
+
+    async def select_patients_by_date_of_birth(self, dob_from: date, dob_to: date) -> list[Patient]:
+        """
+        Selects a set of patients by date of birth (see IDicomDatabase.select_patients_by_date_of_birth).
+        """
+        return await self._read("select_patients_by_date_of_birth", dob_from, dob_to)
+
+    async def select_all_patients(self) -> list[Patient]:
+        """
+        Selects all patients (see IDicomDatabase.select_all_patients).
+        """
+        return await self._read("select_all_patients")
+
+    async def select_patients_by_limit(self, limit: int) -> list[Patient]:
+        """
+        Selects a limited number of patients (see IDicomDatabase.select_patients_by_limit).
+        """
+        return await self._read("select_patients_by_limit", limit)
+
+    async def iter_patients_by_name_pattern(self, name_pattern: str, batch_size: int = 256) -> AsyncIterator[Patient]:
+        """
+        Iterates lazily over the patients with the names fulfilling a pattern.
+        """
+        async for item in self._iterate("iter_patients_by_name_pattern", batch_size, name_pattern):
+            yield item
+
+    async def iter_patients_by_date_of_birth(self, dob_from: date, dob_to: date,
+                                             batch_size: int = 256) -> AsyncIterator[Patient]:
+        """
+        Iterates lazily over the patients with the dates of birth within an interval.
+        """
+        async for item in self._iterate("iter_patients_by_date_of_birth", batch_size, dob_from, dob_to):
+            yield item
+
+    async def iter_all_patients(self, batch_size: int = 256) -> AsyncIterator[Patient]:
+        """
+        Iterates lazily over all patients.
+        """
+        async for item in self._iterate("iter_all_patients", batch_size):
+            yield item
+
+    async def select_patients_page(self, after_key: str = None, page_size: int = 50,
+                                   order_by: str = "patient_id") -> tuple[list[Patient], str]:
+        """
+        Selects a page of patients using keyset pagination (see IDicomDatabase.select_patients_page).
+        """
+        return await self._read("select_patients_page", after_key, page_size, order_by)
+    # endregion
+
+    # region Study Management
+    async def insert_study(self, study: Study):
+        """
+        Tries to insert a study (see IDicomDatabase.insert_study).
+        """
+        return await self._write("insert_study", study)
+
+    async def insert_studies(self, studies: Iterable[Study]) -> list[str]:
+        """
+        Tries to insert a number of studies within one transaction (see IDicomDatabase.insert_studies).
+        """
+        return await self._write("insert_studies", list(studies))
+
+    async def update_study(self, study: Study):
+        """
+        Tries to update a study (see IDicomDatabase.update_study).
+        """
+        return await self._write("update_study", study)
+
+    async def upsert_studies(self, studies: Iterable[Study]) -> list[str]:
+        """
+        Inserts or updates a number of studies within one transaction (see IDicomDatabase.upsert_studies).
+        """
+        return await self._write("upsert_studies", list(studies))
+
+    async def delete_study(self, study_uid: str) -> DeletionCounts:
+        """
+        Tries to delete a study (see IDicomDatabase.delete_study).
+        """
+        return await self._write("delete_study", study_uid)
+
+    async def select_study(self, study_uid: str) -> Study:
+        """
+        Selects a study by StudyUID (see IDicomDatabase.select_study).
+        """
+        return await self._read("select_study", study_uid)
+
+    async def select_studies_to_patient(self, patient_id: str) -> list[Study]:
+        """
+        Selects the studies of a patient (see IDicomDatabase.select_studies_to_patient).
+        """
+        return await self._read("select_studies_to_patient", patient_id)
+
+    async def iter_studies_to_patient(self, patient_id: str, batch_size: int = 256) -> AsyncIterator[Study]:
+        """
+        Iterates lazily over the studies of a patient.
+        """
+        async for item in self._iterate("iter_studies_to_patient", batch_size, patient_id):
+            yield item
+
+    async def select_studies(self, study_filter: StudyFilter, limit: int = None) -> list[Study]:
+        """
+        Selects the studies meeting a filter (see IDicomDatabase.select_studies).
+        """
+        return await self._read("select_studies", study_filter, limit)
+
+    async def select_studies_page(self, after_key: str = None, page_size: int = 50,
+                                  order_by: str = "study_uid") -> tuple[list[Study], str]:
+        """
+        Selects a page of studies using keyset pagination (see IDicomDatabase.select_studies_page).
+        """
+        return await self._read("select_studies_page", after_key, page_size, order_by)
+    # endregion
+
+    # region Series Management
+    async def insert_series(self, series: Series):
+        """
+        Tries to insert a series (see IDicomDatabase.insert_series).
+        """
+        return await self._write("insert_series", series)
+
+    async def insert_series_many(self, seriez: Iterable[Series]) -> list[str]:
+        """
+        Tries to insert a number of series within one transaction (see IDicomDatabase.insert_series_many).
+        """
+        return await self._write("insert_series_many", list(seriez))
+
+    async def update_series(self, series: Series):
+        """
+        Tries to update a series (see IDicomDatabase.update_series).
+        """
+        return await self._write("update_series", series)
+
+    async def upsert_series_many(self, seriez: Iterable[Series]) -> list[str]:
+        """
+        Inserts or updates a number of series within one transaction (see IDicomDatabase.upsert_series_many).
+        """
+        return await self._write("upsert_series_many", list(seriez))
+
+    async def delete_series(self, series_uid: str) -> DeletionCounts:
+        """
+        Tries to delete a series (see IDicomDatabase.delete_series).
+        """
+        return await self._write("delete_series", series_uid)
+
+    async def select_series(self, series_uid: str) -> Series:
+        """
+        Selects a series by SeriesUID (see IDicomDatabase.select_series).
+        """
+        return await self._read("select_series", series_uid)
+
+    async def select_series_to_study(self, study_uid: str) -> list[Series]:
+        """
+        Selects the series of a study (see IDicomDatabase.select_series_to_study).
+        """
+        return await self._read("select_series_to_study", study_uid)
+
+    async def iter_series_to_study(self, study_uid: str, batch_size: int = 256) -> AsyncIterator[Series]:
+        """
+        Iterates lazily over the series of a study.
+        """
+        async for item in self._iterate("iter_series_to_study", batch_size, study_uid):
+            yield item
+
+    async def select_series_by_filter(self, series_filter: SeriesFilter, limit: int = None) -> list[Series]:
+        """
+        Selects the series meeting a filter (see IDicomDatabase.select_series_by_filter).
+        """
+        return await self._read("select_series_by_filter", series_filter, limit)
+
+    async def select_series_page(self, after_key: str = None, page_size: int = 50,
+                                 order_by: str = "series_uid") -> tuple[list[Series], str]:
+        """
+        Selects a page of series using keyset pagination (see IDicomDatabase.select_series_page).
+        """
+        return await self._read("select_series_page", after_key, page_size, order_by)
+    # endregion
+
+    # region Instance Management
+    async def insert_instance(self, instance: Instance):
+        """
+        Tries to insert an instance (see IDicomDatabase.insert_instance).
+        """
+        return await self._write("insert_instance", instance)
+
+    async def insert_instances(self, instances: Iterable[Instance]) -> list[str]:
+        """
+        Tries to insert a number of instances within one transaction (see IDicomDatabase.insert_instances).
+        """
+        return await self._write("insert_instances", list(instances))
+
+    async def update_instance(self, instance: Instance):
+        """
+        Tries to update an instance (see IDicomDatabase.update_instance).
+        """
+        return await self._write("update_instance", instance)
+
+    async def upsert_instances(self, instances: Iterable[Instance]) -> list[str]:
+        """
+        Inserts or updates a number of instances within one transaction (see IDicomDatabase.upsert_instances).
+        """
+        return await self._write("upsert_instances", list(instances))
+
+    async def update_instance_file_names(self, file_names: dict[str, str]) -> list[str]:
+        """
+        Records the files of a number of instances within one transaction
+        (see IDicomDatabase.update_instance_file_names).
+        """
+        return await self._write("update_instance_file_names", dict(file_names))
+
+    async def delete_instance(self, instance_uid: str):
+        """
+        Tries to delete an instance (see IDicomDatabase.delete_instance).
+        """
+        return await self._write("delete_instance", instance_uid)
+
+    async def delete_instances_of_series(self, series_uid: str):
+        """
+        Deletes all instances of a series (see IDicomDatabase.delete_instances_of_series).
+        """
+        return await self._write("delete_instances_of_series", series_uid)
+
+    async def select_instance(self, instance_uid: str) -> Instance:
+        """
+        Selects an instance by InstanceUID (see IDicomDatabase.select_instance).
+        """
+        return await self._read("select_instance", instance_uid)
+
+    async def select_instances_to_series(self, series_uid: str) -> list[Instance]:
+        """
+        Selects the instances of a series (see IDicomDatabase.select_instances_to_series).
+        """
+        return await self._read("select_instances_to_series", series_uid)
+
+    async def iter_instances_to_series(self, series_uid: str, batch_size: int = 256) -> AsyncIterator[Instance]:
+        """
+        Iterates lazily over the instances of a series.
+        """
+        async for item in self._iterate("iter_instances_to_series", batch_size, series_uid):
+            yield item
+    # endregion
+
+    # region Hierarchy Selection
+    async def select_patient_tree(self, patient_id: str) -> Patient:
+        """
+        Selects a patient with all its studies, series and instances (see IDicomDatabase.select_patient_tree).
+        """
+        return await self._read("select_patient_tree", patient_id)
+
+    async def select_study_tree(self, study_uid: str) -> Study:
+        """
+        Selects a study with its patient, series and instances (see IDicomDatabase.select_study_tree).
+        """
+        return await self._read("select_study_tree", study_uid)
+    # endregion
+
+    # region Aggregation
+    async def count_studies_to_patient(self, patient_id: str) -> int:
+        """
+        Counts the studies of a patient (see IDicomDatabase.count_studies_to_patient).
+        """
+        return await self._read("count_studies_to_patient", patient_id)
+
+    async def count_series_to_study(self, study_uid: str) -> int:
+        """
+        Counts the series of a study (see IDicomDatabase.count_series_to_study).
+        """
+        return await self._read("count_series_to_study", study_uid)
+
+    async def count_instances_to_series(self, series_uid: str) -> int:
+        """
+        Counts the instances of a series (see IDicomDatabase.count_instances_to_series).
+        """
+        return await self._read("count_instances_to_series", series_uid)
+
+    async def study_summary(self, study_uid: str) -> StudySummary:
+        """
+        Summarizes the series and instances of a study (see IDicomDatabase.study_summary).
+        """
+        return await self._read("study_summary", study_uid)
+    # endregion
+
+    # region Protected Auxiliary
+    async def _write(self, method: str, *args) -> Any:
+        """
+        Runs a method of the writer on the writer thread.
+        :param method: The name of the method of BasicDicomDatabase.
+        :param args: The arguments of the method.
+        :return: The result of the method.
+        """
+        loop = asyncio.get_running_loop()
+        function = functools.partial(getattr(self._writer, method), *args)
+
+        return await loop.run_in_executor(self._writer_executor, function)
+
+    async def _read(self, method: str, *args) -> Any:
+        """
+        Runs a method of a pooled reader on a reader thread.
+        :param method: The name of the method of BasicDicomDatabase.
+        :param args: The arguments of the method.
+        :return: The result of the method.
+        """
+        reader = await self._readers.get()
+        future = self._reader_executor.submit(getattr(reader, method), *args)
+        self._release_when_done(reader, future)
+
+        return await self._await_reader(reader, future)
+
+    async def _iterate(self, method: str, batch_size: int, *args) -> AsyncIterator[Any]:
+        """
+        Iterates over an iter_* method of a pooled reader, fetching one batch per call on a reader thread.
+        The reader is kept for the lifetime of the iteration.
+        :param method: The name of the iter_* method of BasicDicomDatabase.
+        :param batch_size: The number of rows fetched at once.
+        :param args: The arguments of the method (except the batch size).
+        :return: An asynchronous iterator over the objects.
+        """
+        reader = await self._readers.get()
+        iterator = getattr(reader, method)(*args, batch_size=batch_size)
+        future = None
+
+        try:
+            while True:
+                future = self._reader_executor.submit(self._next_batch, iterator, batch_size)
+                batch = await self._await_reader(reader, future)
+
+                if len(batch) == 0:
+                    break
+
+                for item in batch:
+                    yield item
+        finally:
+            if future is None:
+                self._readers.put_nowait(reader)
+            else:
+                self._release_when_done(reader, future, iterator.close)
+
+    @staticmethod
+    async def _await_reader(reader: BasicDicomDatabase, future: Future) -> Any:
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if not future.cancel():
+                reader.interrupt()
+            raise
+
+    def _release_when_done(self, reader: BasicDicomDatabase, future: Future, finalize: Callable[[], None] = None):
+        """
+        Returns a reader to the pool as soon as the work submitted to it is done (also if it was cancelled).
+        :param reader: The reader to return.
+        :param future: The future of the work submitted to the reader.
+        :param finalize: Optional function to call before the reader is returned.
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+
+        def release(done: Future):
+            if finalize is not None:
+                finalize()
+
+            try:
+                loop.call_soon_threadsafe(self._readers.put_nowait, reader)
+            except RuntimeError:
+                pass    # the event loop is already closed
+
+        future.add_done_callback(release)
+
+    @staticmethod
+    def _next_batch(iterator, batch_size: int) -> list:
+        return list(itertools.islice(iterator, batch_size))
+    # endregion
@@ -1,11 +1,197 @@
-from Data.IDicomDatabase import IDicomDatabase
+from Data.IDicomDatabase import IDicomDatabase, DeletionCounts, StudySummary, StudyFilter, SeriesFilter
+import base64
+import json
 import sqlite3
+import threading
+from contextlib import contextmanager
 from sqlite3 import Error
-from datetime import date, datetime
+from Data.SqliteConnectionManager import SqliteConnectionManager
+from datetime import date, datetime, timedelta, timezone
+from enum import Enum
+from typing import Iterable, Iterator, Callable, Any, NamedTuple
 from Taxons import Patient, Study, Series, Instance
-from enumerations import Gender, AnatomicRegion, Modality
+from enumerations import Gender, AnatomicRegion, Modality, ChangeOperation
 import DataTypes
 
+# Entry of the change log: sequence number, kind of change, taxon type ('patient', 'study', 'series' or 'instance')
+# and key of the changed object
+Change = NamedTuple('Change', [('seq', int), ('operation', ChangeOperation), ('taxon_type', str), ('key', str)])
+
+
+def _upsert_statement(table: str, key: str, columns: list[str]) -> str:
+    """
+    Builds a parameterized single-statement UPSERT for a table.
+    The existing row is only rewritten if at least one of its values differs from the new ones.
+    :param table: The name of the table.
+    :param key: The primary key column.
+    :param columns: All columns of the table in the order of the VALUES clause (including the key).
+    :return: The SQL text of the statement.
+    """
+    values = ", ".join("?" for column in columns)
+    updated = [column for column in columns if column != key]
+    assignments = ", ".join(f"`{column}` = excluded.`{column}`" for column in updated)
+    old_values = ", ".join(f"`{table}`.`{column}`" for column in updated)
+    new_values = ", ".join(f"excluded.`{column}`" for column in updated)
+
+    return f"INSERT INTO `{table}` VALUES ({values}) " \
+           f"ON CONFLICT(`{key}`) DO UPDATE SET {assignments} " \
+           f"WHERE ({old_values}) IS NOT ({new_values})"
+
+
+def _change_log_triggers(table: str, key: str, taxon_code: int) -> list[str]:
+    """
+    Builds the triggers recording the inserts, updates and deletes of a table in the change log.
+    An UPSERT fires the insert or the update trigger, depending on what it did; one that leaves a row unchanged
+    fires none. The deletes cascading from a parent fire the delete trigger of every removed row.
+    :param table: The name of the table.
+    :param key: The primary key column.
+    :param taxon_code: The code of the taxon type of the table in the change log.
+    :return: The SQL texts of the CREATE TRIGGER statements.
+    """
+    codes = _enum_codes(ChangeOperation)
+    insert, update, delete = codes[ChangeOperation.Insert], codes[ChangeOperation.Update], codes[ChangeOperation.Delete]
+    log = "INSERT INTO `change_log` (`operation`, `taxon`, `key`) VALUES"
+
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS `change_log_{table}_insert` AFTER INSERT ON `{table}` BEGIN "
+        f"{log} ({insert}, {taxon_code}, new.`{key}`); END",
+        f"CREATE TRIGGER IF NOT EXISTS `change_log_{table}_update` AFTER UPDATE ON `{table}` BEGIN "
+        f"{log} ({update}, {taxon_code}, new.`{key}`); END",
+        f"CREATE TRIGGER IF NOT EXISTS `change_log_{table}_delete` AFTER DELETE ON `{table}` BEGIN "
+        f"{log} ({delete}, {taxon_code}, old.`{key}`); END",
+    ]
+
+
+# Origin of the integer encoding of dates (days) and datetimes (microseconds)
+_epoch = datetime(1970, 1, 1)
+_epoch_ordinal = _epoch.toordinal()
+_microsecond = timedelta(microseconds=1)
+
+
+def _encode_date(value: date) -> int:
+    return None if value is None else value.toordinal() - _epoch_ordinal
+
+
+def _decode_date(days: int) -> date:
+    return None if days is None else date.fromordinal(_epoch_ordinal + days)
+
+
+def _encode_datetime(value: datetime) -> int:
+    if value is None:
+        return None
+
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return (value - _epoch) // _microsecond
+
+
+def _decode_datetime(microseconds: int) -> datetime:
+    return None if microseconds is None else _epoch + timedelta(microseconds=microseconds)
+
+
+def _enum_codes(enumeration: type[Enum]) -> dict[Enum, int]:
+    """
+    Maps the members of an enumeration to their integer codes, i.e. the numbers the members are defined with.
+    :param enumeration: The enumeration.
+    :return: Dictionary of the codes. Key: the member; Value: its code.
+    """
+    return {member: member.value[0] if isinstance(member.value, tuple) else member.value for member in enumeration}
+
+
+def _rebuild_table_statements(table: str, sql_creation: str, columns: list[str],
+                              conversions: dict[str, str]) -> list[str]:
+    """
+    Builds the statements re-creating a table with a new definition and copying its rows, e.g. to change the types
+    of columns or to add constraints. The rowids are kept. The indexes of the table are dropped and must be
+    re-created. The statements must run with foreign key enforcement switched off (see _migrate).
+    :param table: The name of the table.
+    :param sql_creation: The CREATE TABLE statement of the new definition.
+    :param columns: The columns to copy.
+    :param conversions: SQL expressions converting the old values of columns. Key: column; Value: the expression.
+    :return: The list of statements.
+    """
+    new_table = f"{table}_rebuild"
+    names = ", ".join(f"`{column}`" for column in columns)
+    values = ", ".join(conversions.get(column, f"`{column}`") for column in columns)
+
+    return [
+        f"DROP TABLE IF EXISTS `{new_table}`",
+        sql_creation.replace(f"`{table}`", f"`{new_table}`", 1),
+        f"INSERT INTO `{new_table}` (rowid, {names}) SELECT rowid, {values} FROM `{table}`",
+        f"DROP TABLE `{table}`",
+        f"ALTER TABLE `{new_table}` RENAME TO `{table}`",
+    ]
+
+
+def _enum_conversion(column: str, enumeration: type[Enum]) -> str:
+    """
+    Builds the SQL expression converting the legacy text encoding of an enumeration ('Gender.Male') into its code.
+    """
+    cases = " ".join(f"WHEN '{member}' THEN {code}" for member, code in _enum_codes(enumeration).items())
+    return _text_conversion(column, f"CASE `{column}` {cases} END")
+
+
+def _date_conversion(column: str) -> str:
+    """
+    Builds the SQL expression converting the legacy text encoding of a date ('1970-12-05') into days since the epoch.
+    """
+    return _text_conversion(column, f"CAST(julianday(`{column}`) - 2440587.5 AS INTEGER)")
+
+
+def _datetime_conversion(column: str) -> str:
+    """
+    Builds the SQL expression converting the legacy text encoding of a datetime ('1970-12-05 10:30:00.250000')
+    into microseconds since the epoch.
+    """
+    return _text_conversion(column, f"CAST(strftime('%s', `{column}`) AS INTEGER) * 1000000 "
+                                    f"+ CASE WHEN substr(`{column}`, 20, 1) = '.' "
+                                    f"THEN CAST(substr(`{column}`, 21, 6) AS INTEGER) ELSE 0 END")
+
+
+def _text_conversion(column: str, conversion: str) -> str:
+    """
+    Applies a conversion to text values only, so that values already encoded survive a repeated migration
+    (a database without version is migrated from the start).
+    """
+    return f"CASE WHEN typeof(`{column}`) = 'text' THEN {conversion} ELSE `{column}` END"
+
+
+def _page_statements(table: str, key: str, orderings: list[str]) -> dict[str, str]:
+    """
+    Builds the parameterized keyset pagination statements of a table.
+    For each ordering, there is a statement for the first page and one for the pages following a given row.
+    Rows are ordered by the ordering column and then by the primary key, so that the order is total.
+    A row value comparison never matches a NULL, so the pages following a row with a NULL ordering value are
+    selected in two steps: the remaining rows of the NULL group (sqlite sorts NULL first), then the non-NULL rows.
+    :param table: The name of the table.
+    :param key: The primary key column.
+    :param orderings: The columns the table can be paged by.
+    :return: Dictionary of the statements. Key: name of the statement; Value: the SQL text.
+    """
+    statements = {}
+
+    for order_by in orderings:
+        if order_by == key:
+            order = f"`{key}`"
+            after = f"`{key}` > ?"
+        else:
+            order = f"`{order_by}`, `{key}`"
+            after = f"(`{order_by}`, `{key}`) > (?, ?)"
+
+        statements[f"select_{table}_page_by_{order_by}"] = \
+            f"SELECT * FROM `{table}` ORDER BY {order} LIMIT ?"
+        statements[f"select_{table}_page_by_{order_by}_after"] = \
+            f"SELECT * FROM `{table}` WHERE {after} ORDER BY {order} LIMIT ?"
+
+        if order_by != key:
+            statements[f"select_{table}_page_by_{order_by}_after_null"] = \
+                f"SELECT * FROM `{table}` WHERE `{order_by}` IS NULL AND `{key}` > ? ORDER BY {order} LIMIT ?"
+            statements[f"select_{table}_page_by_{order_by}_not_null"] = \
+                f"SELECT * FROM `{table}` WHERE `{order_by}` IS NOT NULL ORDER BY {order} LIMIT ?"
+
+    return statements
+
 
 class BasicDicomDatabase(IDicomDatabase):
     # region Protected Data
@@ -13,14 +199,17 @@ class BasicDicomDatabase(IDicomDatabase):
     _table_study = "study"
     _table_series = "series"
     _table_instance = "instance"
+    _table_patient_name_index = "patient_name_index"
+    _table_change_log = "change_log"
+    _table_change_log_compaction = "change_log_compaction"
 
     _sql_create_table_patient = \
         """
         CREATE TABLE IF NOT EXISTS `patient` ( 
         `patient_id`                            VARCHAR(64),
         `patient_name`                          VARCHAR(128),
-        `patient_date_of_birth`                 TIME,
-        `patient_gender`                        VARCHAR(16),
+        `patient_date_of_birth`                 INTEGER,        -- days since 1970-01-01
+        `patient_gender`                        INTEGER,        -- code of Gender
         PRIMARY KEY(patient_id)
         );
         """
@@ -30,14 +219,15 @@ class BasicDicomDatabase(IDicomDatabase):
         CREATE TABLE IF NOT EXISTS `study` (
         `study_uid`						        VARCHAR(64),
         `patient_id`					        VARCHAR(64),
-        `study_datetime`				        TIME,
+        `study_datetime`				        INTEGER,        -- microseconds since 1970-01-01
         `referring_physician_name`		        VARCHAR(128),
         `institution_name`                      VARCHAR(128),
         `accession_number`				        VARCHAR(32),
         `study_id`						        VARCHAR(64),
         `study_description`				        TEXT,
-        `anatomic_region`                       VARCHAR(16),
-        PRIMARY KEY(study_uid)
+        `anatomic_region`                       INTEGER,        -- code of AnatomicRegion
+        PRIMARY KEY(study_uid),
+        FOREIGN KEY(patient_id) REFERENCES `patient`(patient_id) ON DELETE CASCADE
         );
         """
 
@@ -49,8 +239,8 @@ class BasicDicomDatabase(IDicomDatabase):
         `sop_class_uid`                         VARCHAR(64),
         `transfer_syntax`                       VARCHAR(64),
         `specific_character_set`                VARCHAR(128),
-        `series_datetime`				        TIME,
-        `modality`						        VARCHAR(16),
+        `series_datetime`				        INTEGER,        -- microseconds since 1970-01-01
+        `modality`						        INTEGER,        -- code of Modality
         `series_number`					        INTEGER,
         `series_description`			        VARCHAR(128),
         `sequence_name`                         VARCHAR(64),
@@ -64,7 +254,8 @@ class BasicDicomDatabase(IDicomDatabase):
         `image_orientation_patient_columns_x`   FLOAT,
         `image_orientation_patient_columns_y`   FLOAT,
         `image_orientation_patient_columns_z`   FLOAT,
-        PRIMARY KEY(series_uid)
+        PRIMARY KEY(series_uid),
+        FOREIGN KEY(study_uid) REFERENCES `study`(study_uid) ON DELETE CASCADE
         );
         """
 
@@ -78,39 +269,588 @@ class BasicDicomDatabase(IDicomDatabase):
         `image_position_patient_y`      FLOAT,
         `image_position_patient_z`      FLOAT,
         `file_name`						VARCHAR(256),
-        PRIMARY KEY(instance_uid)
+        PRIMARY KEY(instance_uid),
+        FOREIGN KEY(series_uid) REFERENCES `series`(series_uid) ON DELETE CASCADE
         );
         """
+
+    _columns_patient = ["patient_id", "patient_name", "patient_date_of_birth", "patient_gender"]
+
+    _columns_study = ["study_uid", "patient_id", "study_datetime", "referring_physician_name", "institution_name",
+                      "accession_number", "study_id", "study_description", "anatomic_region"]
+
+    _columns_series = ["series_uid", "study_uid", "sop_class_uid", "transfer_syntax", "specific_character_set",
+                       "series_datetime", "modality", "series_number", "series_description", "sequence_name",
+                       "protocol_name", "spacing_between_slices", "pixel_spacing_x", "pixel_spacing_y",
+                       "image_orientation_patient_rows_x", "image_orientation_patient_rows_y",
+                       "image_orientation_patient_rows_z", "image_orientation_patient_columns_x",
+                       "image_orientation_patient_columns_y", "image_orientation_patient_columns_z"]
+
+    _columns_instance = ["instance_uid", "series_uid", "instance_number", "image_position_patient_x",
+                         "image_position_patient_y", "image_position_patient_z", "file_name"]
+
+    # Secondary indexes backing the hierarchy lookups and the keyset pagination;
+    # idx_patient_page_date_of_birth also serves the date-of-birth range query
+    _sql_create_indexes = [
+        "CREATE INDEX IF NOT EXISTS `idx_study_patient_id` ON `study` (`patient_id`)",
+        "CREATE INDEX IF NOT EXISTS `idx_series_study_uid` ON `series` (`study_uid`)",
+        "CREATE INDEX IF NOT EXISTS `idx_instance_series_uid` ON `instance` (`series_uid`)",
+        # keyset pagination
+        "CREATE INDEX IF NOT EXISTS `idx_patient_page_name` ON `patient` (`patient_name`, `patient_id`)",
+        "CREATE INDEX IF NOT EXISTS `idx_patient_page_date_of_birth` "
+        "ON `patient` (`patient_date_of_birth`, `patient_id`)",
+        "CREATE INDEX IF NOT EXISTS `idx_study_page_datetime` ON `study` (`study_datetime`, `study_uid`)",
+        "CREATE INDEX IF NOT EXISTS `idx_series_page_datetime` ON `series` (`series_datetime`, `series_uid`)",
+    ]
+
+    # Indexes of the filter queries: an equality criterion followed by the ordering, so that a worklist query
+    # reads only the matching range of one index and needs no sorting
+    _sql_create_filter_indexes = [
+        "CREATE INDEX IF NOT EXISTS `idx_study_filter_institution` "
+        "ON `study` (`institution_name`, `study_datetime`, `study_uid`)",
+        "CREATE INDEX IF NOT EXISTS `idx_study_filter_region` "
+        "ON `study` (`anatomic_region`, `study_datetime`, `study_uid`)",
+        "CREATE INDEX IF NOT EXISTS `idx_study_filter_accession_number` ON `study` (`accession_number`)",
+        "CREATE INDEX IF NOT EXISTS `idx_series_filter_modality` "
+        "ON `series` (`modality`, `series_datetime`, `series_uid`)",
+    ]
+
+    # Codes of the taxon types in the change log
+    _change_taxon_codes = {"patient": 1, "study": 2, "series": 3, "instance": 4}
+
+    # Append-only log of the changes of the four tables, filled by triggers, so that mirrors and search indexes can
+    # follow the database incrementally (see iter_changes). AUTOINCREMENT keeps the sequence numbers increasing,
+    # even after the newest entries were compacted away. The compaction table holds the highest sequence number
+    # removed by compact_changes. Tables re-created by a later migration lose their triggers, which must then be
+    # created again.
+    _sql_create_change_log = [
+        """
+        CREATE TABLE IF NOT EXISTS `change_log` (
+        `seq`                                   INTEGER PRIMARY KEY AUTOINCREMENT,
+        `operation`                             INTEGER,        -- code of ChangeOperation
+        `taxon`                                 INTEGER,        -- code of the taxon type
+        `key`                                   VARCHAR(64)
+        );
+        """,
+        "CREATE TABLE IF NOT EXISTS `change_log_compaction` (`compacted_seq` INTEGER NOT NULL)",
+        "INSERT INTO `change_log_compaction` SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM `change_log_compaction`)",
+        *_change_log_triggers("patient", "patient_id", _change_taxon_codes["patient"]),
+        *_change_log_triggers("study", "study_uid", _change_taxon_codes["study"]),
+        *_change_log_triggers("series", "series_uid", _change_taxon_codes["series"]),
+        *_change_log_triggers("instance", "instance_uid", _change_taxon_codes["instance"]),
+    ]
+
+    # Forward migrations of the schema; the version stored in PRAGMA user_version is the number of applied ones.
+    # Each migration is applied in one transaction together with the version update. The schema must only ever be
+    # changed by appending a migration, since existing databases are never re-created.
+    _schema_migrations: list[list[str]] = [
+        # 1: tables and indexes (IF NOT EXISTS, so that databases created before the versioning are adopted)
+        [_sql_create_table_patient, _sql_create_table_study, _sql_create_table_series, _sql_create_table_instance,
+         *_sql_create_indexes],
+        # 2: enumerations as integer codes, dates and datetimes as integers since the epoch (were text).
+        # The patient name index is dropped with its triggers and rebuilt by open().
+        ["DROP TRIGGER IF EXISTS `patient_name_index_insert`",
+         "DROP TRIGGER IF EXISTS `patient_name_index_delete`",
+         "DROP TRIGGER IF EXISTS `patient_name_index_update`",
+         "DROP TABLE IF EXISTS `patient_name_index`",
+         *_rebuild_table_statements("patient", _sql_create_table_patient, _columns_patient, {
+             "patient_date_of_birth": _date_conversion("patient_date_of_birth"),
+             "patient_gender": _enum_conversion("patient_gender", Gender)}),
+         *_rebuild_table_statements("study", _sql_create_table_study, _columns_study, {
+             "study_datetime": _datetime_conversion("study_datetime"),
+             "anatomic_region": _enum_conversion("anatomic_region", AnatomicRegion)}),
+         *_rebuild_table_statements("series", _sql_create_table_series, _columns_series, {
+             "series_datetime": _datetime_conversion("series_datetime"),
+             "modality": _enum_conversion("modality", Modality)}),
+         *_sql_create_indexes],
+        # 3: foreign keys deleting the subtree of a deleted patient, study or series.
+        # Rows whose parent does not exist (left behind by deletions before) make the migration fail;
+        # they are never removed silently.
+        [*_rebuild_table_statements("study", _sql_create_table_study, _columns_study, {}),
+         *_rebuild_table_statements("series", _sql_create_table_series, _columns_series, {}),
+         *_rebuild_table_statements("instance", _sql_create_table_instance, _columns_instance, {}),
+         *_sql_create_indexes],
+        # 4: indexes of the filter queries
+        [*_sql_create_filter_indexes],
+        # 5: change log; the rows present before are not logged
+        [*_sql_create_change_log],
+        # 6: incremental auto-vacuum, so that the space of deleted rows can be reclaimed in small steps.
+        # The mode of an existing file only changes when it is rebuilt; open() vacuums it after the migration.
+        ["PRAGMA auto_vacuum = INCREMENTAL"],
+    ]
+
+    # The schema version from which the database file uses incremental auto-vacuum
+    _incremental_vacuum_version = 6
+
+    # Integer codes of the enumerations stored in the tables, and the lookup tables decoding them
+    _gender_codes = _enum_codes(Gender)
+    _genders = {code: gender for gender, code in _gender_codes.items()}
+    _anatomic_region_codes = _enum_codes(AnatomicRegion)
+    _anatomic_regions = {code: region for region, code in _anatomic_region_codes.items()}
+    _modality_codes = _enum_codes(Modality)
+    _modalities = {code: modality for modality, code in _modality_codes.items()}
+    _enum_filter_codes = {**_gender_codes, **_anatomic_region_codes, **_modality_codes}
+    _change_operations = {code: operation for operation, code in _enum_codes(ChangeOperation).items()}
+    _change_taxa = {code: taxon_type for taxon_type, code in _change_taxon_codes.items()}
+
+    # Optional FTS5 trigram index on the patient names, kept in sync with the patient table by triggers.
+    # The trigram tokenizer lets LIKE '%pattern%' be answered from the index for patterns of 3 or more characters.
+    # The index refers to the implicit rowids of the patient table, which has no INTEGER PRIMARY KEY; VACUUM may
+    # renumber them, so the database must only be vacuumed through vacuum(), which rebuilds the index afterwards.
+    _sql_create_patient_name_index = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS `patient_name_index` "
+        "USING fts5(`patient_name`, content='patient', content_rowid='rowid', tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS `patient_name_index_insert` AFTER INSERT ON `patient` BEGIN "
+        "INSERT INTO `patient_name_index` (rowid, `patient_name`) VALUES (new.rowid, new.`patient_name`); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS `patient_name_index_delete` AFTER DELETE ON `patient` BEGIN "
+        "INSERT INTO `patient_name_index` (`patient_name_index`, rowid, `patient_name`) "
+        "VALUES ('delete', old.rowid, old.`patient_name`); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS `patient_name_index_update` AFTER UPDATE OF `patient_name` ON `patient` BEGIN "
+        "INSERT INTO `patient_name_index` (`patient_name_index`, rowid, `patient_name`) "
+        "VALUES ('delete', old.rowid, old.`patient_name`); "
+        "INSERT INTO `patient_name_index` (rowid, `patient_name`) VALUES (new.rowid, new.`patient_name`); "
+        "END",
+    ]
+
+    _sql_rebuild_patient_name_index = "INSERT INTO `patient_name_index` (`patient_name_index`) VALUES ('rebuild')"
+
+    # Columns the listings can be paged by; each one is backed by the primary key or an index above
+    _page_orderings = {
+        "patient": ("patient_id", ["patient_id", "patient_name", "patient_date_of_birth"]),
+        "study": ("study_uid", ["study_uid", "study_datetime"]),
+        "series": ("series_uid", ["series_uid", "series_datetime"]),
+    }
+
+    # Conditions of the criteria of the filter queries (each with one parameter), and the orderings of their results.
+    # The statement texts depend on the given criteria only, so sqlite3 serves recurring queries from its cache.
+    _filter_conditions = {
+        "study": {
+            "patient_id": "`patient_id` = ?",
+            "datetime_from": "`study_datetime` >= ?",
+            "datetime_to": "`study_datetime` <= ?",
+            "anatomic_region": "`anatomic_region` = ?",
+            "institution_name": "`institution_name` = ?",
+            "accession_number": "`accession_number` = ?",
+            "modality": "`study_uid` IN (SELECT `study_uid` FROM `series` WHERE `modality` = ?)",
+        },
+        "series": {
+            "study_uid": "`study_uid` = ?",
+            "datetime_from": "`series_datetime` >= ?",
+            "datetime_to": "`series_datetime` <= ?",
+            "modality": "`modality` = ?",
+        },
+    }
+    _filter_orderings = {
+        "study": "`study_datetime`, `study_uid`",
+        "series": "`series_datetime`, `series_uid`",
+    }
+
+    # Registry of all parameterized statements used by the CRUD methods.
+    # The statement texts never change between calls, so sqlite3 can serve them from its statement cache.
+    _statements: dict[str, str] = {
+        # patient
+        "insert_patient": "INSERT INTO `patient` VALUES (?, ?, ?, ?)",
+        "upsert_patient": _upsert_statement("patient", "patient_id", _columns_patient),
+        "delete_patient": "DELETE FROM `patient` WHERE `patient_id` = ?",
+        "select_patient": "SELECT * FROM `patient` WHERE `patient_id` = ?",
+        "select_patients_by_name_pattern": "SELECT * FROM `patient` WHERE `patient_name` LIKE ?",
+        "select_patients_by_name_pattern_indexed":
+            "SELECT * FROM `patient` WHERE rowid IN "
+            "(SELECT rowid FROM `patient_name_index` WHERE `patient_name` LIKE ?)",
+        "select_patients_by_date_of_birth":
+            "SELECT * FROM `patient` WHERE `patient_date_of_birth` >= ? AND `patient_date_of_birth` <= ?",
+        "select_all_patients": "SELECT * FROM `patient`",
+        "select_patients_by_limit": "SELECT * FROM `patient` LIMIT ?",
+        # study
+        "insert_study": "INSERT INTO `study` VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        "upsert_study": _upsert_statement("study", "study_uid", _columns_study),
+        "delete_study": "DELETE FROM `study` WHERE `study_uid` = ?",
+        "select_study": "SELECT * FROM `study` WHERE `study_uid` = ?",
+        "select_studies_to_patient": "SELECT * FROM `study` WHERE `patient_id` = ?",
+        # series
+        "insert_series": "INSERT INTO `series` VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        "upsert_series": _upsert_statement("series", "series_uid", _columns_series),
+        "delete_series": "DELETE FROM `series` WHERE `series_uid` = ?",
+        "select_series": "SELECT * FROM `series` WHERE `series_uid` = ?",
+        "select_series_to_study": "SELECT * FROM `series` WHERE `study_uid` = ?",
+        # instance
+        "insert_instance": "INSERT INTO `instance` VALUES (?, ?, ?, ?, ?, ?, ?)",
+        "upsert_instance": _upsert_statement("instance", "instance_uid", _columns_instance),
+        "delete_instance": "DELETE FROM `instance` WHERE `instance_uid` = ?",
+        "delete_instances_of_series": "DELETE FROM `instance` WHERE `series_uid` = ?",
+        "select_instance": "SELECT * FROM `instance` WHERE `instance_uid` = ?",
+        "select_instances_to_series": "SELECT * FROM `instance` WHERE `series_uid` = ?",
+        "update_instance_file_name":
+            "UPDATE `instance` SET `file_name` = ?1 WHERE `instance_uid` = ?2 AND `file_name` IS NOT ?1",
+        # hierarchy
+        "select_series_to_patient":
+            "SELECT `series`.* FROM `series` "
+            "INNER JOIN `study` ON `study`.`study_uid` = `series`.`study_uid` "
+            "WHERE `study`.`patient_id` = ?",
+        "select_instances_to_patient":
+            "SELECT `instance`.* FROM `instance` "
+            "INNER JOIN `series` ON `series`.`series_uid` = `instance`.`series_uid` "
+            "INNER JOIN `study` ON `study`.`study_uid` = `series`.`study_uid` "
+            "WHERE `study`.`patient_id` = ?",
+        # sizes of the subtrees removed by the cascading deletes: patients, studies, series, instances
+        "count_subtree_of_patient":
+            "SELECT (SELECT COUNT(*) FROM `patient` WHERE `patient_id` = ?1), "
+            "(SELECT COUNT(*) FROM `study` WHERE `patient_id` = ?1), "
+            "(SELECT COUNT(*) FROM `series` INNER JOIN `study` ON `study`.`study_uid` = `series`.`study_uid` "
+            "WHERE `study`.`patient_id` = ?1), "
+            "(SELECT COUNT(*) FROM `instance` INNER JOIN `series` ON `series`.`series_uid` = `instance`.`series_uid` "
+            "INNER JOIN `study` ON `study`.`study_uid` = `series`.`study_uid` WHERE `study`.`patient_id` = ?1)",
+        "count_subtree_of_study":
+            "SELECT 0, (SELECT COUNT(*) FROM `study` WHERE `study_uid` = ?1), "
+            "(SELECT COUNT(*) FROM `series` WHERE `study_uid` = ?1), "
+            "(SELECT COUNT(*) FROM `instance` INNER JOIN `series` ON `series`.`series_uid` = `instance`.`series_uid` "
+            "WHERE `series`.`study_uid` = ?1)",
+        "count_subtree_of_series":
+            "SELECT 0, 0, (SELECT COUNT(*) FROM `series` WHERE `series_uid` = ?1), "
+            "(SELECT COUNT(*) FROM `instance` WHERE `series_uid` = ?1)",
+        "select_instances_to_study":
+            "SELECT `instance`.* FROM `instance` "
+            "INNER JOIN `series` ON `series`.`series_uid` = `instance`.`series_uid` "
+            "WHERE `series`.`study_uid` = ?",
+        # aggregation; the counts are answered from the indexes on the parent keys
+        "count_studies_to_patient": "SELECT COUNT(*) FROM `study` WHERE `patient_id` = ?",
+        "count_series_to_study": "SELECT COUNT(*) FROM `series` WHERE `study_uid` = ?",
+        "count_instances_to_series": "SELECT COUNT(*) FROM `instance` WHERE `series_uid` = ?",
+        "summarize_study":
+            "SELECT EXISTS (SELECT 1 FROM `study` WHERE `study_uid` = ?1), COUNT(*), "
+            "(SELECT COUNT(*) FROM `instance` INNER JOIN `series` ON `series`.`series_uid` = `instance`.`series_uid` "
+            "WHERE `series`.`study_uid` = ?1), "
+            "group_concat(DISTINCT `modality`), MIN(`series_datetime`), MAX(`series_datetime`) "
+            "FROM `series` WHERE `study_uid` = ?1",
+        # change log
+        "select_changes": "SELECT * FROM `change_log` WHERE `seq` > ? ORDER BY `seq`",
+        "select_last_change_seq":
+            "SELECT COALESCE((SELECT `seq` FROM `sqlite_sequence` WHERE `name` = 'change_log'), 0)",
+        "select_compacted_change_seq": "SELECT `compacted_seq` FROM `change_log_compaction`",
+        "compact_changes": "DELETE FROM `change_log` WHERE `seq` <= ?",
+        "update_compacted_change_seq": "UPDATE `change_log_compaction` SET `compacted_seq` = max(`compacted_seq`, ?)",
+        # keyset pagination
+        **_page_statements("patient", *_page_orderings["patient"]),
+        **_page_statements("study", *_page_orderings["study"]),
+        **_page_statements("series", *_page_orderings["series"]),
+    }
+
+    # Number of rows fetched per round trip by the iter_* methods
+    _default_batch_size = 256
+    # Number of parameters bound to one statement at most (the limit of older sqlite versions is 999)
+    _max_parameters = 500
     # endregion
 
     # region  Construction
-    def __init__(self):
-        self._connection = None
+    def __init__(self, cached_statements: int = 128, name_index: bool = True,
+                 read_only: bool = False, per_thread_connections: bool = True, profile: str = "durable"):
+        """
+        Creates an instance of BasicDicomDatabase.
+        :param cached_statements: Size of the sqlite3 statement cache of every connection.
+                                  Should be at least the number of statements in the registry.
+        :param name_index: If True, patient name searches use an FTS5 trigram index
+                           (provided the sqlite library supports it); otherwise they scan the patient table.
+        :param read_only: If True, the database file is opened read-only and must already have the current schema.
+        :param per_thread_connections: If True (default), every calling thread uses its own connection, so that
+                                       the database can be used from several threads at once. If False, one
+                                       connection is shared by all threads and the caller must serialize the calls.
+        :param profile: The name of the connection profile: "durable" or "throughput" (see SqliteConnectionManager).
+        """
+        self._connections: SqliteConnectionManager = None
+        self._cached_statements = cached_statements
+        self._name_index = name_index
+        self._name_index_available = False
+        self._read_only = read_only
+        self._per_thread_connections = per_thread_connections
+        self._profile = profile
+        self._transactions = threading.local()     # depth of the transactions of the calling thread
+        self._traces = threading.local()           # statements traced for the calling thread, if any
     # endregion
 
     # region General Management
     def open(self, database_file_name: str):
         """
-        Opens the database
+        Opens the database. A new database file is created with the current schema, an existing one is migrated
+        to it; if the schema is current, opening only costs the version check.
         :param database_file_name: The path to the database file
         :return None:
+        :exception: UserWarning, if the schema is newer than this version supports, or a database opened read-only
+                    does not have the current schema.
         """
         try:
-            self._connection = sqlite3.connect(database_file_name)
-            result = self.create_tables()
+            self._connections = SqliteConnectionManager(database_file_name,
+                                                        profile=self._profile,
+                                                        per_thread=self._per_thread_connections,
+                                                        read_only=self._read_only,
+                                                        cached_statements=self._cached_statements,
+                                                        foreign_keys="ON")
+
+            version = self.schema_version
 
-            if not result:
-                raise UserWarning("Tables could not be created")
+            if version > len(self._schema_migrations):
+                raise UserWarning(f"schema version {version} of the database is not supported")
+
+            if self._read_only:
+                if version < len(self._schema_migrations):
+                    raise UserWarning(f"schema version {version} of the read-only database is outdated")
+
+                self._name_index_available = self._name_index and self._has_patient_name_index()
+                return
+
+            if version < len(self._schema_migrations):
+                self._migrate()
+
+            if self._name_index:
+                self._name_index_available = self._create_patient_name_index()
+
+            if version < self._incremental_vacuum_version and not self._has_incremental_vacuum():
+                self.vacuum()
         except Error as e:
             raise e
 
     def close(self):
         """
-        Closes the database.
-        TODO: implement me!
+        Closes the database. The data are kept; use reset() to remove them.
+        :return: None
+        """
+        self._connections.close()
+
+    def reset(self):
+        """
+        Removes all data: the tables are dropped and re-created empty.
         :return: None
+        :exception: UserWarning, if the database was opened read-only.
         """
+        if self._read_only:
+            raise UserWarning("a database opened read-only cannot be reset")
+
         self.drop_tables()
+        self._connection.execute("PRAGMA user_version = 0")
+        self._migrate()
+
+        if self._name_index:
+            self._name_index_available = self._create_patient_name_index()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups the writes of the calling thread into one transaction:
+            with database.transaction():
+                database.insert_study(study)
+                database.insert_series_many(seriez)
+        Within the block, the write methods do not commit; the transaction is committed once when the block is left,
+        or rolled back if it is left by an exception. Nested blocks are savepoints: an exception leaving a nested
+        block only rolls back the writes of that block.
+        :return: Context manager of the transaction.
+        """
+        connection = self._connection
+        depth = self._transaction_depth
+
+        if depth == 0:
+            # take the write lock up front, instead of failing with SQLITE_BUSY when a read lock is upgraded
+            connection.execute("BEGIN IMMEDIATE")
+        else:
+            connection.execute(f"SAVEPOINT transaction_{depth}")
+
+        self._transactions.depth = depth + 1
+
+        try:
+            yield self
+        except BaseException:
+            if depth == 0:
+                connection.rollback()
+            else:
+                connection.execute(f"ROLLBACK TO transaction_{depth}")
+                connection.execute(f"RELEASE transaction_{depth}")
+            raise
+        else:
+            if depth == 0:
+                connection.commit()
+            else:
+                connection.execute(f"RELEASE transaction_{depth}")
+        finally:
+            self._transactions.depth = depth
+
+    @contextmanager
+    def trace_statements(self):
+        """
+        Collects the statements the calling thread executes within the block, e.g. for instrumentation:
+            with database.trace_statements() as statements:
+                database.select_study_tree(study_uid)
+        Blocks may be nested; each block collects the statements executed within it.
+        :return: Context manager of the list of (SQL text, parameters) pairs of the executed statements.
+        """
+        outer = getattr(self._traces, "statements", None)
+        statements = []
+        self._traces.statements = statements
+
+        try:
+            yield statements
+        finally:
+            self._traces.statements = outer
+
+            if outer is not None:
+                outer.extend(statements)
+
+    def explain_query_plan(self, sql: str, parameters: tuple = ()) -> str:
+        """
+        Gets the query plan sqlite chooses for a statement.
+        :param sql: The SQL text of the statement.
+        :param parameters: The parameters of the statement.
+        :return: The lines of the output of EXPLAIN QUERY PLAN.
+        """
+        rows = self._connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+        return "\n".join(row["detail"] for row in rows)
+
+    def vacuum(self):
+        """
+        Rebuilds the database file, reclaiming the space of deleted rows; a file still without incremental
+        auto-vacuum is switched to it. This blocks all writers while the whole file is copied; prefer
+        incremental_vacuum for regular maintenance.
+        VACUUM may renumber the rowids the patient name index refers to, so the index is rebuilt afterwards.
+        :return: None
+        """
+        self._connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._connection.execute("VACUUM")
+
+        if self._name_index_available:
+            self._connection.execute(self._sql_rebuild_patient_name_index)
+            self._connection.commit()
+
+    def incremental_vacuum(self, max_pages: int = 0) -> int:
+        """
+        Returns free pages to the file system, moving pages from the end of the file into the free ones. Unlike
+        VACUUM, the rowids are kept (the patient name index stays valid) and the write lock is only held for the
+        pages moved, so that it can run in small steps between the writes.
+        Has no effect on a file without incremental auto-vacuum (see vacuum).
+        :param max_pages: The maximum number of pages to free; 0 frees all.
+        :return: The number of pages freed.
+        :exception: UserWarning, if the calling thread has a transaction open.
+        """
+        if self._transaction_depth > 0:
+            raise UserWarning("the database cannot be vacuumed within a transaction")
+
+        connection = self._connection
+        free_pages = connection.execute("PRAGMA freelist_count").fetchone()[0]
+        # the pragma frees one page per step; executescript steps it to the end, where execute only steps once
+        connection.executescript(f"PRAGMA incremental_vacuum({max_pages})")
+
+        return free_pages - connection.execute("PRAGMA freelist_count").fetchone()[0]
+
+    def optimize(self, analysis_limit: int = 1000):
+        """
+        Updates the statistics of the query planner (ANALYZE) for the tables and indexes whose statistics are
+        missing or outdated, so that the query plans follow the growth of the tables.
+        :param analysis_limit: The approximate number of rows examined per index; 0 examines all rows.
+        :return: None
+        """
+        connection = self._connection
+        connection.execute(f"PRAGMA analysis_limit = {analysis_limit}")
+        # 0x10000: all tables, not only those queried by this connection; 0x02: run ANALYZE where useful
+        connection.execute("PRAGMA optimize(0x10002)").fetchall()
+        connection.commit()
+
+    def checkpoint(self) -> tuple[int, int]:
+        """
+        Copies the pages of the WAL file back into the database file, as far as no reader still needs them
+        (PASSIVE checkpoint: neither readers nor writers are blocked). This keeps the WAL file, and with it the
+        cost of every read, small after write bursts.
+        :return: The number of pages in the WAL file and the number of them that are now copied; (0, 0) without WAL.
+        """
+        busy, log_pages, checkpointed_pages = self._connection.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        return max(log_pages, 0), max(checkpointed_pages, 0)
+
+    def backup(self, target_path: str, pages_per_step: int = 1024, sleep: float = 0.01,
+               progress: Callable[[int, int], None] = None):
+        """
+        Copies the database into another file while it stays in use (online backup), a number of pages per step.
+        The copy is read through a connection of its own that holds one read transaction over all steps: under WAL,
+        the writers continue meanwhile, and the copy is the state of the database when the backup started.
+        (Without the read transaction, every write of another connection would restart the copy.)
+        While the backup runs, the WAL file cannot be checkpointed beyond that state and grows with the writes.
+        :param target_path: The path of the backup file; an existing file is overwritten.
+        :param pages_per_step: The number of pages copied per step; -1 copies all pages in one step.
+        :param sleep: The seconds to sleep between the steps, leaving the disk to the writers.
+        :param progress: Function called after every step with the number of pages copied and the number of pages.
+        :return: None
+        """
+        source = self._connections.create_connection()
+        target = sqlite3.connect(target_path)
+
+        def report(status: int, remaining: int, total: int):
+            progress(total - remaining, total)
+
+        try:
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()     # starts the read transaction
+            source.backup(target, pages=pages_per_step, progress=None if progress is None else report, sleep=sleep)
+            source.rollback()
+        finally:
+            target.close()
+            source.close()
+
+    def open_snapshot(self, target_path: str, pages_per_step: int = 1024, sleep: float = 0.01,
+                      progress: Callable[[int, int], None] = None) -> 'BasicDicomDatabase':
+        """
+        Backs up the database (see backup) and opens the copy read-only, e.g. for reporting jobs: queries on the
+        snapshot neither compete for the locks of the database nor see the writes made after the backup started.
+        The snapshot uses a rollback journal, so that it can also be opened read-only from other processes.
+        :param target_path: The path of the snapshot file; an existing file is overwritten.
+        :param pages_per_step: The number of pages copied per step; -1 copies all pages in one step.
+        :param sleep: The seconds to sleep between the steps.
+        :param progress: Function called after every step with the number of pages copied and the number of pages.
+        :return: The snapshot, opened read-only; the caller must close it.
+        """
+        self.backup(target_path, pages_per_step, sleep, progress)
+
+        target = sqlite3.connect(target_path)
+
+        try:
+            target.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            target.close()
+
+        snapshot = BasicDicomDatabase(cached_statements=self._cached_statements, name_index=self._name_index,
+                                      read_only=True, profile=self._profile)
+        snapshot.open(target_path)
+        return snapshot
+
+    def interrupt(self):
+        """
+        Aborts the statements currently running on the connections, if any (may be called from any thread).
+        The interrupted methods fail or return their 'not found' result.
+        :return: None
+        """
+        if self._connections is not None:
+            self._connections.interrupt()
+    # endregion
+
+    # region Properties
+    @property
+    def schema_version(self) -> int:
+        """
+        Gets the schema version of the database file, i.e. the number of migrations applied to it.
+        :return: The schema version; 0 for a new database file.
+        """
+        return self._connection.execute("PRAGMA user_version").fetchone()[0]
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Gets the connection of the calling thread.
+        :return: The connection.
+        """
+        return self._connections.connection
+
+    @property
+    def _transaction_depth(self) -> int:
+        """
+        Gets the number of open (nested) transactions of the calling thread.
+        :return: The depth; 0, if no transaction is open.
+        """
+        return getattr(self._transactions, "depth", 0)
     # endregion
 
     # region Patient Management
@@ -121,55 +861,48 @@ class BasicDicomDatabase(IDicomDatabase):
         :return: None.
         :exception: KeyError, if the PatientID is already present in the DB.
         """
-        sql = f"INSERT INTO " \
-              f"{self._table_patient} " \
-              f"VALUES (" \
-              f"'{patient.patient_id}', " \
-              f"'{patient.name}', " \
-              f"'{patient.date_of_birth}', " \
-              f"'{patient.gender}'" \
-              ")"
+        self._write("insert_patient", self._patient_row(patient))
 
-        try:
-            cursor = self._connection.cursor()
-            cursor.execute(sql)
-            self._connection.commit()
-        except Error as e:
-            raise e
+    def insert_patients(self, patients: Iterable[Patient]) -> list[str]:
+        """
+        Tries to insert a number of patients within one transaction.
+        :param patients: The patients to insert.
+        :return: List of PatientID's of the patients that could not be inserted.
+                 If this list was empty, the operation completely succeeded.
+        """
+        return self._write_many("insert_patient", patients,
+                                lambda patient: patient.patient_id, self._patient_row)
 
     def update_patient(self, patient: Patient):
         """
         Tries to update a patient.
         :param patient: An instance of the Patient class with the PatientID of the patient to update (and some new data).
+        If the PatientID is not yet present, the patient is inserted. A single UPSERT statement is used,
+        so the row is never observed as missing.
         :return: None.
-        :exception: KeyError, if the PatientID was not present.
         """
-        try:
-            self.delete_patient(patient.patient_id)
-            self.insert_patient(patient)
-        except Error as e:
-            raise e
+        self._write("upsert_patient", self._patient_row(patient))
+
+    def upsert_patients(self, patients: Iterable[Patient]) -> list[str]:
+        """
+        Inserts or updates a number of patients within one transaction.
+        Rows whose stored data equal the new data are left untouched.
+        :param patients: The patients to insert or update.
+        :return: List of PatientID's of the patients that could not be written.
+                 If this list was empty, the operation completely succeeded.
+        """
+        return self._write_many("upsert_patient", patients,
+                                lambda patient: patient.patient_id, self._patient_row)
 
-    def delete_patient(self, patient_id: str):
+    def delete_patient(self, patient_id: str) -> DeletionCounts:
         """
-        Tries to delete a patient.
+        Tries to delete a patient together with its studies, series and instances.
+        The foreign keys cascade the deletion within a single statement.
         :param patient_id: The PatientID of the patient to delete.
-        :return: None.
+        :return: The numbers of rows removed.
         :exception: KeyError, if the PatientID was not present.
         """
-        sql = f"DELETE FROM {self._table_patient} WHERE `patient_id` = '{patient_id}'"
-
-        try:
-            self._connection.row_factory = sqlite3.Row
-            cursor = self._connection.cursor()
-            cursor.execute(sql)
-            self._connection.commit()
-
-            if cursor.lastrowid < 0:
-                raise ValueError("deletion of patient failed")
-
-        except Error as e:
-            raise e
+        return self._delete_subtree("patient", patient_id)
 
     def select_patient(self, patient_id: str) -> Patient:
         """
@@ -177,19 +910,9 @@ class BasicDicomDatabase(IDicomDatabase):
         :param patient_id: The PatientID of the patient to select.
         :return: The patient, if found, otherwise None
         """
-        sql = f"SELECT * FROM {self._table_patient} WHERE `patient_id` = '{patient_id}'"
         try:
-            # assure return data as dictionary:
-            self._connection.row_factory = sqlite3.Row
-            cursor = self._connection.cursor()
-            cursor.execute(sql)
-            self._connection.commit()
-            fetched = cursor.fetchone()
-
-            patient = self._get_patient(fetched)
-
-
-            return patient
+            fetched = self._execute("select_patient", (patient_id,)).fetchone()
+            return self._get_patient(fetched)
         except Error as e:
             return None
 
@@ -199,9 +922,7 @@ class BasicDicomDatabase(IDicomDatabase):
         :param name_pattern: The name pattern to select by.
         :return: A list of patients with the names fulfilling the pattern. An empty list if none were found.
         """
-        sql = f"SELECT * FROM {self._table_patient} WHERE `patient_name` LIKE '%{name_pattern}%'"
-        return self._select_patients(sql)
-
+        return self._select_patients(self._name_pattern_statement(), (f"%{name_pattern}%",))
 
     def select_patients_by_date_of_birth(self, dob_from: date, dob_to: date) -> list[Patient]:
         """
@@ -210,16 +931,14 @@ class BasicDicomDatabase(IDicomDatabase):
         :param dob_to: The finishing date (inclusive).
         :return: A list of patients with the dates of birth within the interval.
         """
-        sql = f"SELECT * FROM {self._table_patient} WHERE `patient_date_of_birth` >= '{dob_from}' AND `patient_date_of_birth` <= '{dob_to}'"
-        return self._select_patients(sql)
+        return self._select_patients("select_patients_by_date_of_birth", (_encode_date(dob_from), _encode_date(dob_to)))
 
     def select_all_patients(self) -> list[Patient]:
         """
         Selects all patients.
         :return: The list of all patients.
         """
-        sql = f"SELECT * FROM {self._table_patient}"
-        return self._select_patients(sql)
+        return self._select_patients("select_all_patients")
 
     def select_patients_by_limit(self, limit: int) -> list[Patient]:
         """
@@ -227,8 +946,51 @@ class BasicDicomDatabase(IDicomDatabase):
         :param limit: The number of patients to select.
         :return: The list of all patients selected.
         """
-        sql = f"SELECT * FROM {self._table_patient} LIMIT {limit}"
-        return self._select_patients(sql)
+        return self._select_patients("select_patients_by_limit", (limit,))
+
+    def iter_patients_by_name_pattern(self, name_pattern: str,
+                                      batch_size: int = _default_batch_size) -> Iterator[Patient]:
+        """
+        Iterates lazily over the patients with the names fulfilling a pattern.
+        :param name_pattern: The name pattern to select by.
+        :param batch_size: The number of rows fetched from the database at once.
+        :return: An iterator over the patients.
+        """
+        return self._iterate(self._name_pattern_statement(), (f"%{name_pattern}%",), self._get_patient, batch_size)
+
+    def iter_patients_by_date_of_birth(self, dob_from: date, dob_to: date,
+                                       batch_size: int = _default_batch_size) -> Iterator[Patient]:
+        """
+        Iterates lazily over the patients with the dates of birth within an interval.
+        :param dob_from:  The starting date (inclusive).
+        :param dob_to: The finishing date (inclusive).
+        :param batch_size: The number of rows fetched from the database at once.
+        :return: An iterator over the patients.
+        """
+        return self._iterate("select_patients_by_date_of_birth", (_encode_date(dob_from), _encode_date(dob_to)),
+                             self._get_patient, batch_size)
+
+    def iter_all_patients(self, batch_size: int = _default_batch_size) -> Iterator[Patient]:
+        """
+        Iterates lazily over all patients.
+        :param batch_size: The number of rows fetched from the database at once.
+        :return: An iterator over the patients.
+        """
+        return self._iterate("select_all_patients", (), self._get_patient, batch_size)
+
+    def select_patients_page(self, after_key: str = None, page_size: int = 50,
+                             order_by: str = "patient_id") -> tuple[list[Patient], str]:
+        """
+        Selects a page of patients using keyset pagination; every page costs the same as the first one.
+        :param after_key: The continuation token returned with the previous page, or None for the first page.
+        :param page_size: The maximal number of patients in the page.
+        :param order_by: The column to order by: 'patient_id', 'patient_name' or 'patient_date_of_birth'.
+        :return: The patients of the page and the continuation token for the next page
+                 (None, if there are no more patients).
+        :exception: ValueError, if the page size is less than 1, the ordering is not supported
+                    or the token does not belong to it.
+        """
+        return self._select_page("patient", after_key, page_size, order_by, self._get_patient)
     # endregion
 
     # region Study Management
@@ -239,60 +1001,48 @@ class BasicDicomDatabase(IDicomDatabase):
         :return: None.
         :exception: KeyError if the studyUID was already present or if the patient is not yet in the DB.
         """
-        sql = f"INSERT INTO " \
-              f"{self._table_study} " \
-              f"VALUES (" \
-              f"'{study.study_uid}', " \
-              f"'{study.patient.patient_id}', " \
-              f"'{study.study_date_time}', " \
-              f"'{study.referring_physician_name}'," \
-              f"'{study.institution_name}',"\
-              f"'{study.accession_number}'," \
-              f"'{study.study_id}'," \
-              f"'{study.study_description}'," \
-              f"'{study.anatomic_region}'" \
-              ")"
+        self._write("insert_study", self._study_row(study))
 
-        try:
-            cursor = self._connection.cursor()
-            cursor.execute(sql)
-            self._connection.commit()
-        except Error as e:
-            raise e
+    def insert_studies(self, studies: Iterable[Study]) -> list[str]:
+        """
+        Tries to insert a number of studies within one transaction.
+        :param studies: The studies to insert. Each must be valid (i.e. have a valid Patient reference).
+        :return: List of StudyUID's of the studies that could not be inserted.
+                 If this list was empty, the operation completely succeeded.
+        """
+        return self._write_many("insert_study", studies,
+                                lambda study: study.study_uid, self._study_row)
 
     def update_study(self, study: Study):
         """
         Tries to update a study.
         :param study: An instance of the Study class with the StudyUID of the study to update (and some new data).
+        If the StudyUID is not yet present, the study is inserted. A single UPSERT statement is used,
+        so the row is never observed as missing.
         :return: None.
-        :exception: KeyError, if the StudyUID was not present.
         """
-        try:
-            self.delete_study(study.study_uid)
-            self.insert_study(study)
-        except Error as e:
-            raise e
+        self._write("upsert_study", self._study_row(study))
+
+    def upsert_studies(self, studies: Iterable[Study]) -> list[str]:
+        """
+        Inserts or updates a number of studies within one transaction.
+        Rows whose stored data equal the new data are left untouched.
+        :param studies: The studies to insert or update.
+        :return: List of StudyUID's of the studies that could not be written.
+                 If this list was empty, the operation completely succeeded.
+        """
+        return self._write_many("upsert_study", studies,
+                                lambda study: study.study_uid, self._study_row)
 
-    def delete_study(self, study_uid: str):
+    def delete_study(self, study_uid: str) -> DeletionCounts:
         """
-        Tries to delete a study.
+        Tries to delete a study together with its series and instances.
+        The foreign keys cascade the deletion within a single statement.
         :param study_uid: Tue UID of the study to delete.
-        :return: None.
+        :return: The numbers of rows removed.
         :exception: KeyError, if the StudyUID was not present.
         """
-        sql = f"DELETE FROM {self._table_study} WHERE `study_uid` = '{study_uid}'"
-
-        try:
-            self._connection.row_factory = sqlite3.Row
-            cursor = self._connection.cursor()
-            cursor.execute(sql)
-            self._connection.commit()
-
-            if cursor.lastrowid < 0:
-                raise ValueError("deletion of study failed")
-
-        except Error as e:
-            raise e
+        return self._delete_subtree("study", study_uid)
 
     def select_study(self, study_uid: str) -> Study:
         """
@@ -300,14 +1050,8 @@ class BasicDicomDatabase(IDicomDatabase):
         :param study_uid: The StudyUID of the study to select.
         :return: The study, if found, otherwise None
         """
-        sql = f"SELECT * FROM {self._table_study} WHERE `study_uid` = '{study_uid}'"
         try:
-            self._connection.row_factory = sqlite3.Row
-            cursor = self._connection.cursor()
-            cursor.execute(sql)
-            self._connection.commit()
-            fetched = cursor.fetchone()
-
+            fetched = self._execute("select_study", (study_uid,)).fetchone()
             return self._get_study(fetched)
         except Error as e:
             return None
@@ -319,23 +1063,41 @@ class BasicDicomDatabase(IDicomDatabase):
         :return: A list of studies of the patient.
         :exception: KeyError, if the PatientID was not present.
         """
-        sql = f"SELECT * FROM {self._table_study} WHERE `patient_id` = '{patient_id}'"
-
-        self._connection.row_factory = sqlite3.Row
-        cursor = self._connection.cursor()
-        cursor.execute(sql)
-        self._connection.commit()
-        fetched = cursor.fetchall()
+        return list(self.iter_studies_to_patient(patient_id))
 
-        result = []
-
-        for fetch in fetched:
-            study = self._get_study(fetch)
+    def iter_studies_to_patient(self, patient_id: str, batch_size: int = _default_batch_size) -> Iterator[Study]:
+        """
+        Iterates lazily over the studies of a patient.
+        :param patient_id: The PatientID of the patient.
+        :param batch_size: The number of rows fetched from the database at once.
+        :return: An iterator over the studies.
+        """
+        return self._iterate("select_studies_to_patient", (patient_id,), self._get_study, batch_size)
 
-            if study is not None:
-                result.append(study)
+    def select_studies(self, study_filter: StudyFilter, limit: int = None) -> list[Study]:
+        """
+        Selects the studies meeting a filter, ordered by StudyDateTime.
+        The criteria are turned into one parameterized statement, backed by the filter indexes.
+        :param study_filter: The criteria of the studies.
+        :param limit: The maximal number of studies to select, or None for all.
+        :return: A list of the studies. An empty list if none were found.
+        """
+        sql, parameters = self._filter_statement("study", study_filter, limit)
+        return [self._get_study(fetched) for fetched in self._execute_sql(sql, parameters)]
 
-        return result
+    def select_studies_page(self, after_key: str = None, page_size: int = 50,
+                            order_by: str = "study_uid") -> tuple[list[Study], str]:
+        """
+        Selects a page of studies using keyset pagination; every page costs the same as the first one.
+        :param after_key: The continuation token returned with the previous page, or None for the first page.
+        :param page_size: The maximal number of studies in the page.
+        :param order_by: The column to order by: 'study_uid' or 'study_datetime'.
+        :return: The studies of the page and the continuation token for the next page
+                 (None, if there are no more studies).
+        :exception: ValueError, if the page size is less than 1, the ordering is not supported
+                    or the token does not belong to it.
+        """
+        return self._select_page("study", after_key, page_size, order_by, self._get_study)
     # endregion
 
     # region Series Management
@@ -346,71 +1108,48 @@ class BasicDicomDatabase(IDicomDatabase):
         :return: None.
         :exception: KeyError if the SeriesUID was already present or if the study is not yet in the DB.
         """
-        charsets = str.join('\\', series.specific_character_set)
-        sql = f"INSERT INTO {self._table_series} " \
-              f"VALUES(" \
-              f"'{series.series_uid}', " \
-              f"'{series.study.study_uid}', " \
-              f"'{series.sop_class}', " \
-              f"'{series.transfer_syntax}'," \
-              f"'{charsets}', " \
-              f"'{series.series_datetime}', " \
-              f"'{series.modality}', " \
-              f"{series.series_number}, " \
-              f"'{series.series_description}', " \
-              f"'{series.sequence_name}', " \
-              f"'{series.protocol_name}', " \
-              f"{series.spacing_between_slices}, " \
-              f"{series.pixel_spacing[0]}, " \
-              f"{series.pixel_spacing[1]}, " \
-              f"{series.image_orientation_patient[0][0]}, " \
-              f"{series.image_orientation_patient[0][1]}, " \
-              f"{series.image_orientation_patient[0][2]}, " \
-              f"{series.image_orientation_patient[1][0]}, " \
-              f"{series.image_orientation_patient[1][1]}, " \
-              f"{series.image_orientation_patient[1][2]} " \
-              f")"
+        self._write("insert_series", self._series_row(series))
 
-        try:
-            cursor = self._connection.cursor()
-            cursor.execute(sql)
-            self._connection.commit()
-        except Error as e:
-            raise e
+    def insert_series_many(self, seriez: Iterable[Series]) -> list[str]:
+        """
+        Tries to insert a number of series within one transaction.
+        :param seriez: The series to insert. Each must be valid (i.e. have a valid Study reference).
+        :return: List of SeriesUID's of the series that could not be inserted.
+                 If this list was empty, the operation completely succeeded.
+        """
+        return self._write_many("insert_series", seriez,
+                                lambda series: series.series_uid, self._series_row)
 
     def update_series(self, series: Series):
         """
         Tries to update a study.
         :param series: An instance of the Series class with the SeriesUID of the series to update (and some new data).
+        If the SeriesUID is not yet present, the series is inserted. A single UPSERT statement is used,
+        so the row is never observed as missing.
         :return: None.
-        :exception: KeyError, if the SeriesUID was not present.
         """
-        try:
-            self.delete_series(series.series_uid)
-            self.insert_series(series)
-        except Error as e:
-            raise e
+        self._write("upsert_series", self._series_row(series))
+
+    def upsert_series_many(self, seriez: Iterable[Series]) -> list[str]:
+        """
+        Inserts or updates a number of series within one transaction.
+        Rows whose stored data equal the new data are left untouched.
+        :param seriez: The series to insert or update.
+        :return: List of SeriesUID's of the series that could not be written.
+                 If this list was empty, the operation completely succeeded.
+        """
+        return self._write_many("upsert_series", seriez,
+                                lambda series: series.series_uid, self._series_row)
 
-    def delete_series(self, series_uid: str):
+    def delete_series(self, series_uid: str) -> DeletionCounts:
         """
-        Tries to delete a series.
+        Tries to delete a series together with its instances.
+        The foreign keys cascade the deletion within a single statement.
         :param series_uid: Tue UID of the series to delete.
-        :return: None.
+        :return: The numbers of rows removed.
         :exception: KeyError, if the SeriesUID was not present.
         """
-        sql = f"DELETE FROM {self._table_series} WHERE `series_uid` = '{series_uid}'"
-
-        try:
-            self._connection.row_factory = sqlite3.Row
-            cursor = self._connection.cursor()
-            cursor.execute(sql)
-            self._connection.commit()
-
-            if cursor.lastrowid < 0:
-                raise ValueError("deletion of study failed")
-
-        except Error as e:
-            raise e
+        return self._delete_subtree("series", series_uid)
 
     def select_series(self, series_uid: str) -> Series:
         """
@@ -418,15 +1157,8 @@ class BasicDicomDatabase(IDicomDatabase):
         :param series_uid: The SeriesUID of the series to select.
         :return: The series, if found, otherwise None.
         """
-        sql = f"SELECT * FROM {self._table_series} WHERE `series_uid` = '{series_uid}'"
-
         try:
-            self._connection.row_factory = sqlite3.Row
-            cursor = self._connection.cursor()
-            cursor.execute(sql)
-            self._connection.commit()
-            fetched = cursor.fetchone()
-
+            fetched = self._execute("select_series", (series_uid,)).fetchone()
             return self._get_series(fetched)
         except Error as e:
             return None
@@ -438,23 +1170,41 @@ class BasicDicomDatabase(IDicomDatabase):
         :return: A list of series of the study.
         :exception: KeyError, if the StudyUID was not present.
         """
-        sql = f"SELECT * FROM {self._table_series} WHERE `study_uid` = '{study_uid}'"
-
-        self._connection.row_factory = sqlite3.Row
-        cursor = self._connection.cursor()
-        cursor.execute(sql)
-        self._connection.commit()
-        fetched = cursor.fetchall()
-
-        result = []
+        return list(self.iter_series_to_study(study_uid))
 
-        for fetch in fetched:
-            series = self._get_series(fetch)
+    def iter_series_to_study(self, study_uid: str, batch_size: int = _default_batch_size) -> Iterator[Series]:
+        """
+        Iterates lazily over the series of a study.
+        :param study_uid: The StudyUID of the study.
+        :param batch_size: The number of rows fetched from the database at once.
+        :return: An iterator over the series.
+        """
+        return self._iterate("select_series_to_study", (study_uid,), self._get_series, batch_size)
 
-            if series is not None:
-                result.append(series)
+    def select_series_by_filter(self, series_filter: SeriesFilter, limit: int = None) -> list[Series]:
+        """
+        Selects the series meeting a filter, ordered by SeriesDateTime.
+        The criteria are turned into one parameterized statement, backed by the filter indexes.
+        :param series_filter: The criteria of the series.
+        :param limit: The maximal number of series to select, or None for all.
+        :return: A list of the series. An empty list if none were found.
+        """
+        sql, parameters = self._filter_statement("series", series_filter, limit)
+        return [self._get_series(fetched) for fetched in self._execute_sql(sql, parameters)]
 
-        return result
+    def select_series_page(self, after_key: str = None, page_size: int = 50,
+                           order_by: str = "series_uid") -> tuple[list[Series], str]:
+        """
+        Selects a page of series using keyset pagination; every page costs the same as the first one.
+        :param after_key: The continuation token returned with the previous page, or None for the first page.
+        :param page_size: The maximal number of series in the page.
+        :param order_by: The column to order by: 'series_uid' or 'series_datetime'.
+        :return: The series of the page and the continuation token for the next page
+                 (None, if there are no more series).
+        :exception: ValueError, if the page size is less than 1, the ordering is not supported
+                    or the token does not belong to it.
+        """
+        return self._select_page("series", after_key, page_size, order_by, self._get_series)
     # endregion
 
     # region Instance Management
@@ -465,36 +1215,69 @@ class BasicDicomDatabase(IDicomDatabase):
         :return: None.
         :exception: KeyError if the InstanceUID was already present or if the series is not yet in the DB.
         """
-        sql = f"INSERT INTO {self._table_instance} " \
-              f"VALUES(" \
-              f"'{instance.instance_uid}', " \
-              f"'{instance.series.series_uid}', " \
-              f"{instance.instance_number}," \
-              f"{instance.instance_position_patient.X}," \
-              f"{instance.instance_position_patient.Y},"\
-              f"{instance.instance_position_patient.Z}," \
-              f"'{instance.file_name}'" \
-              f")"
+        self._write("insert_instance", self._instance_row(instance))
 
-        try:
-            cursor = self._connection.cursor()
-            cursor.execute(sql)
-            self._connection.commit()
-        except Error as e:
-            raise e
+    def insert_instances(self, instances: Iterable[Instance]) -> list[str]:
+        """
+        Tries to insert a number of instances within one transaction.
+        :param instances: The instances to insert. Each must be valid (i.e. have a valid Series reference).
+        :return: List of InstanceUID's of the instances that could not be inserted.
+                 If this list was empty, the operation completely succeeded.
+        """
+        return self._write_many("insert_instance", instances,
+                                lambda instance: instance.instance_uid, self._instance_row)
 
     def update_instance(self, instance: Instance):
         """
         Tries to update an instance.
         :param instance: An instance of the Instance class with the InstanceUID of the instance to update (and some new data).
+        If the InstanceUID is not yet present, the instance is inserted. A single UPSERT statement is used,
+        so the row is never observed as missing.
         :return: None.
-        :exception: KeyError, if the InstanceUID was not present.
         """
-        try:
-            self.delete_instance(instance.instance_uid)
-            self.insert_instance(instance)
-        except Error as e:
-            raise e
+        self._write("upsert_instance", self._instance_row(instance))
+
+    def upsert_instances(self, instances: Iterable[Instance]) -> list[str]:
+        """
+        Inserts or updates a number of instances within one transaction.
+        Rows whose stored data equal the new data are left untouched.
+        :param instances: The instances to insert or update.
+        :return: List of InstanceUID's of the instances that could not be written.
+                 If this list was empty, the operation completely succeeded.
+        """
+        return self._write_many("upsert_instance", instances,
+                                lambda instance: instance.instance_uid, self._instance_row)
+
+    def update_instance_file_names(self, file_names: dict[str, str]) -> list[str]:
+        """
+        Records the files of a number of instances (e.g. after storing their datasets) within one transaction.
+        Rows that already have their file name are left untouched.
+        :param file_names: Key: the InstanceUID; Value: the file name of the instance.
+        :return: List of InstanceUID's of the instances that are not present.
+                 If this list was empty, the operation completely succeeded.
+        """
+        rows = [(file_name, instance_uid) for instance_uid, file_name in file_names.items()]
+        sql = self._statements["update_instance_file_name"]
+        statements = getattr(self._traces, "statements", None)
+
+        if statements is not None and len(rows) > 0:
+            statements.append((sql, rows[0]))
+
+        with self.transaction():
+            if self._connection.executemany(sql, rows).rowcount == len(rows):
+                return []
+
+            # some rows are missing or had their file name already
+            instance_uids = list(file_names)
+            present = set()
+
+            for start in range(0, len(instance_uids), self._max_parameters):
+                chunk = instance_uids[start:start + self._max_parameters]
+                placeholders = ", ".join("?" for instance_uid in chunk)
+                sql = f"SELECT `instance_uid` FROM `instance` WHERE `instance_uid` IN ({placeholders})"
+                present.update(row[0] for row in self._execute_sql(sql, tuple(chunk)))
+
+        return [instance_uid for instance_uid in instance_uids if instance_uid not in present]
 
     def delete_instance(self, instance_uid: str):
         """
@@ -503,19 +1286,10 @@ class BasicDicomDatabase(IDicomDatabase):
         :return: None.
         :exception: KeyError, if the InstanceUID was not present.
         """
-        sql = f"DELETE FROM {self._table_instance} WHERE `instance_uid` = '{instance_uid}'"
-
-        try:
-            self._connection.row_factory = sqlite3.Row
-            cursor = self._connection.cursor()
-            cursor.execute(sql)
-            self._connection.commit()
+        cursor = self._write("delete_instance", (instance_uid,))
 
-            if cursor.lastrowid < 0:
-                raise ValueError("deletion of study failed")
-
-        except Error as e:
-            raise e
+        if cursor.lastrowid < 0:
+            raise ValueError("deletion of instance failed")
 
     def delete_instances_of_series(self, series_uid: str):
         """
@@ -524,19 +1298,10 @@ class BasicDicomDatabase(IDicomDatabase):
         :return: None.
         :exception: KeyError, if the SeriesUID was not present.
         """
-        sql = f"DELETE FROM {self._table_instance} WHERE `series_uid` = '{series_uid}'"
-
-        try:
-            self._connection.row_factory = sqlite3.Row
-            cursor = self._connection.cursor()
-            cursor.execute(sql)
-            self._connection.commit()
+        cursor = self._write("delete_instances_of_series", (series_uid,))
 
-            if cursor.lastrowid < 0:
-                raise ValueError("deletion of study failed")
-
-        except Error as e:
-            raise e
+        if cursor.lastrowid < 0:
+            raise ValueError("deletion of instances failed")
 
     def select_instance(self, instance_uid: str) -> Instance:
         """
@@ -544,15 +1309,8 @@ class BasicDicomDatabase(IDicomDatabase):
         :param instance_uid: The InstanceUID of the instance to select.
         :return: The instance, if found, otherwise None.
         """
-        sql = f"SELECT * FROM {self._table_instance} WHERE `instance_uid` = '{instance_uid}'"
-
         try:
-            self._connection.row_factory = sqlite3.Row
-            cursor = self._connection.cursor()
-            cursor.execute(sql)
-            self._connection.commit()
-            fetched = cursor.fetchone()
-
+            fetched = self._execute("select_instance", (instance_uid,)).fetchone()
             return self._get_instance(fetched)
         except Error as e:
             return None
@@ -564,44 +1322,264 @@ class BasicDicomDatabase(IDicomDatabase):
         :return: A list of instance of the series.
         :exception: KeyError, if the SeriesUID was not present.
         """
-        sql = f"SELECT * FROM {self._table_instance} WHERE `series_uid` = '{series_uid}'"
+        return list(self.iter_instances_to_series(series_uid))
 
-        self._connection.row_factory = sqlite3.Row
-        cursor = self._connection.cursor()
-        cursor.execute(sql)
-        self._connection.commit()
-        fetched = cursor.fetchall()
+    def iter_instances_to_series(self, series_uid: str, batch_size: int = _default_batch_size) -> Iterator[Instance]:
+        """
+        Iterates lazily over the instances of a series.
+        :param series_uid: The SeriesUID of the series.
+        :param batch_size: The number of rows fetched from the database at once.
+        :return: An iterator over the instances.
+        """
+        return self._iterate("select_instances_to_series", (series_uid,), self._get_instance, batch_size)
+    # endregion
 
-        result = []
+    # region Hierarchy Selection
+    def select_patient_tree(self, patient_id: str) -> Patient:
+        """
+        Selects a patient together with all its studies, series and instances.
+        Each level of the hierarchy is fetched with one set-based query, independently of the number of objects.
+        :param patient_id: The PatientID of the patient to select.
+        :return: The patient with its studies, series and instances linked, if found, otherwise None.
+        """
+        try:
+            patient = self._get_patient(self._execute("select_patient", (patient_id,)).fetchone())
 
-        for fetch in fetched:
-            instance = self._get_instance(fetch)
+            if patient is None:
+                return None
 
-            if instance is not None:
-                result.append(instance)
+            study_rows = self._execute("select_studies_to_patient", (patient_id,)).fetchall()
+            series_rows = self._execute("select_series_to_patient", (patient_id,)).fetchall()
+            instance_rows = self._execute("select_instances_to_patient", (patient_id,)).fetchall()
+        except Error as e:
+            return None
 
-        return result
+        for study in self._link_tree(study_rows, series_rows, instance_rows):
+            patient.add_study(study)
+
+        return patient
+
+    def select_study_tree(self, study_uid: str) -> Study:
+        """
+        Selects a study together with its patient and all its series and instances.
+        Each level of the hierarchy is fetched with one set-based query, independently of the number of objects.
+        :param study_uid: The StudyUID of the study to select.
+        :return: The study with its patient, series and instances linked, if found, otherwise None.
+        """
+        try:
+            study_row = self._execute("select_study", (study_uid,)).fetchone()
+
+            if study_row is None:
+                return None
+
+            patient_row = self._execute("select_patient", (study_row["patient_id"],)).fetchone()
+            series_rows = self._execute("select_series_to_study", (study_uid,)).fetchall()
+            instance_rows = self._execute("select_instances_to_study", (study_uid,)).fetchall()
+        except Error as e:
+            return None
+
+        studies = self._link_tree([study_row], series_rows, instance_rows)
+
+        if len(studies) == 0:
+            return None
+
+        study = studies[0]
+        patient = self._get_patient(patient_row)
+
+        if patient is not None:
+            patient.add_study(study)
+
+        return study
+    # endregion
+
+    # region Aggregation
+    def count_studies_to_patient(self, patient_id: str) -> int:
+        """
+        Counts the studies of a patient without selecting them.
+        :param patient_id: The PatientID of the patient.
+        :return: The number of studies of the patient; 0, if the PatientID is not present.
+        """
+        return self._execute("count_studies_to_patient", (patient_id,)).fetchone()[0]
+
+    def count_series_to_study(self, study_uid: str) -> int:
+        """
+        Counts the series of a study without selecting them.
+        :param study_uid: The StudyUID of the study.
+        :return: The number of series of the study; 0, if the StudyUID is not present.
+        """
+        return self._execute("count_series_to_study", (study_uid,)).fetchone()[0]
+
+    def count_instances_to_series(self, series_uid: str) -> int:
+        """
+        Counts the instances of a series without selecting them.
+        :param series_uid: The SeriesUID of the series.
+        :return: The number of instances of the series; 0, if the SeriesUID is not present.
+        """
+        return self._execute("count_instances_to_series", (series_uid,)).fetchone()[0]
+
+    def study_summary(self, study_uid: str) -> StudySummary:
+        """
+        Summarizes the series and instances of a study. All aggregates are computed by one statement;
+        no series or instance is selected.
+        :param study_uid: The StudyUID of the study.
+        :return: The summary of the study, if found, otherwise None.
+        """
+        exists, number_of_series, number_of_instances, modality_codes, first, last = \
+            self._execute("summarize_study", (study_uid,)).fetchone()
+
+        if not exists:
+            return None
+
+        codes = [] if modality_codes is None else [int(code) for code in modality_codes.split(",")]
+        modalities = frozenset(self._modalities[code] for code in codes if code in self._modalities)
+
+        return StudySummary(number_of_series, number_of_instances, modalities,
+                            _decode_datetime(first), _decode_datetime(last))
+    # endregion
+
+    # region Change Log
+    @property
+    def last_change_seq(self) -> int:
+        """
+        Gets the sequence number of the latest change, e.g. to follow the changes after a full synchronization
+        that read the database within the same transaction.
+        :return: The sequence number; 0, if no change was logged yet.
+        """
+        return self._execute("select_last_change_seq").fetchone()[0]
+
+    def iter_changes(self, since_seq: int = 0, batch_size: int = 256) -> Iterator[Change]:
+        """
+        Lazily iterates over the changes logged after a sequence number, in the order they were made.
+        The entries only name the changed objects; a consumer reads their current state, if it needs it.
+        :param since_seq: The sequence number of the last change the consumer has processed; 0 for all changes.
+        :param batch_size: The number of entries fetched per round trip.
+        :return: An iterator over the changes.
+        :exception: UserWarning, if changes after since_seq were removed by compact_changes, so that the consumer
+                    has to synchronize in full.
+        """
+        compacted_seq = self._execute("select_compacted_change_seq").fetchone()[0]
+
+        if since_seq < compacted_seq:
+            raise UserWarning(f"the changes up to {compacted_seq} were compacted; cannot follow from {since_seq}")
+
+        return self._iterate("select_changes", (since_seq,), self._get_change, batch_size)
+
+    def compact_changes(self, up_to_seq: int) -> int:
+        """
+        Removes the oldest entries of the change log, e.g. up to the lowest sequence number all consumers have
+        processed. Consumers behind that number can no longer follow the changes (see iter_changes).
+        :param up_to_seq: The sequence number of the last entry to remove.
+        :return: The number of entries removed.
+        """
+        with self.transaction():
+            up_to_seq = min(up_to_seq, self.last_change_seq)
+            removed = self._execute("compact_changes", (up_to_seq,)).rowcount
+            self._execute("update_compacted_change_seq", (up_to_seq,))
+
+        return removed
     # endregion
 
     # region Protected Auxiliary
     def create_tables(self) -> bool:
-        result = True
-        result &= self._create_table(self._sql_create_table_patient)
-        result &= self._create_table(self._sql_create_table_study)
-        result &= self._create_table(self._sql_create_table_series)
-        result &= self._create_table(self._sql_create_table_instance)
-
-        return result
+        try:
+            self._migrate()
+            return True
+        except Error:
+            return False
 
     def drop_tables(self):
         result = True
+        self._drop_table(self._table_patient_name_index)
         result &= self._drop_table(self._table_patient)
         result &= self._drop_table(self._table_study)
         result &= self._drop_table(self._table_series)
         result &= self._drop_table(self._table_instance)
+        result &= self._drop_table(self._table_change_log)
+        result &= self._drop_table(self._table_change_log_compaction)
 
         return result
 
+    def _migrate(self):
+        """
+        Applies the pending schema migrations, each in its own transaction together with the version update.
+        The version is read again within the transaction, so that concurrent openers apply every migration once.
+        Foreign keys are not enforced while a migration re-creates tables (dropping a parent table would otherwise
+        delete the rows of its children); they are checked before the migration is committed.
+        :return: None
+        """
+        connection = self._connection
+        # has no effect within a transaction, so it is switched before the migrations begin
+        connection.execute("PRAGMA foreign_keys = OFF")
+
+        try:
+            for index, migration in enumerate(self._schema_migrations):
+                connection.execute("BEGIN IMMEDIATE")
+
+                try:
+                    if connection.execute("PRAGMA user_version").fetchone()[0] <= index:
+                        for sql in migration:
+                            connection.execute(sql)
+
+                        self._check_foreign_keys(index + 1)
+
+                        connection.execute(f"PRAGMA user_version = {index + 1}")
+
+                    connection.commit()
+                except Error as e:
+                    connection.rollback()
+                    raise e
+        finally:
+            connection.execute("PRAGMA foreign_keys = ON")
+
+    def _check_foreign_keys(self, version: int):
+        """
+        Checks that every study, series and instance has its parent, before a migration is committed.
+        :param version: The schema version the migration leads to.
+        :return: None
+        :exception: sqlite3.IntegrityError, naming the number of rows without parent per table.
+        """
+        sql = "SELECT `table`, COUNT(*) FROM pragma_foreign_key_check GROUP BY `table` ORDER BY `table`"
+        orphans = self._connection.execute(sql).fetchall()
+
+        if len(orphans) > 0:
+            counts = ", ".join(f"{count} in {table}" for table, count in orphans)
+            raise sqlite3.IntegrityError(f"schema migration {version} failed: rows without parent ({counts}); "
+                                         f"delete them to open the database")
+
+    def _create_patient_name_index(self) -> bool:
+        """
+        Creates the FTS5 patient name index and its triggers, if not yet present.
+        A newly created index is filled from the existing patients.
+        :return: True, if the index is available; False, if the sqlite library does not support FTS5 trigrams.
+        """
+        if self._has_patient_name_index():
+            return True
+
+        try:
+            for sql_creation in self._sql_create_patient_name_index:
+                self._connection.execute(sql_creation)
+
+            self._connection.execute(self._sql_rebuild_patient_name_index)
+
+            self._connection.commit()
+            return True
+        except Error:
+            self._connection.rollback()
+            return False
+
+    def _has_incremental_vacuum(self) -> bool:
+        return self._connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+    def _has_patient_name_index(self) -> bool:
+        sql = "SELECT 1 FROM `sqlite_master` WHERE `type` = 'table' AND `name` = ?"
+        return self._connection.execute(sql, (self._table_patient_name_index,)).fetchone() is not None
+
+    def _name_pattern_statement(self) -> str:
+        if self._name_index_available:
+            return "select_patients_by_name_pattern_indexed"
+
+        return "select_patients_by_name_pattern"
+
     def _create_table(self, sql_creation: str) -> bool:
         try:
             cursor = self._connection.cursor()
@@ -619,38 +1597,226 @@ class BasicDicomDatabase(IDicomDatabase):
         except Error:
             return False
 
-    def _get_patient(self, fetched: dict) -> Patient:
+    def _execute(self, statement: str, parameters: tuple = ()) -> sqlite3.Cursor:
+        """
+        Executes a statement from the registry.
+        :param statement: The name of the statement in the registry.
+        :param parameters: The parameters to bind to the statement.
+        :return: The cursor of the execution.
+        """
+        return self._execute_sql(self._statements[statement], parameters)
+
+    def _execute_sql(self, sql: str, parameters: tuple = ()) -> sqlite3.Cursor:
+        """
+        Executes a statement, adding it to the trace of the calling thread, if one is collected.
+        :param sql: The SQL text of the statement.
+        :param parameters: The parameters to bind to the statement.
+        :return: The cursor of the execution.
+        """
+        statements = getattr(self._traces, "statements", None)
+
+        if statements is not None:
+            statements.append((sql, parameters))
+
+        return self._connection.execute(sql, parameters)
+
+    def _write(self, statement: str, parameters: tuple = ()) -> sqlite3.Cursor:
+        """
+        Executes a modifying statement from the registry and commits it, unless a transaction is open.
+        A failed statement is rolled back, unless a transaction is open, so that the connection does not keep
+        holding the write lock.
+        :param statement: The name of the statement in the registry.
+        :param parameters: The parameters to bind to the statement.
+        :return: The cursor of the execution.
+        """
+        try:
+            cursor = self._execute(statement, parameters)
+
+            if self._transaction_depth == 0:
+                self._connection.commit()
+
+            return cursor
+        except Error as e:
+            if self._transaction_depth == 0:
+                self._connection.rollback()
+            raise e
+
+    def _delete_subtree(self, table: str, key: str) -> DeletionCounts:
+        """
+        Deletes a row together with its subtree, counting the rows removed first within the same transaction.
+        :param table: The table of the row: 'patient', 'study' or 'series'.
+        :param key: The primary key of the row.
+        :return: The numbers of rows removed.
+        """
+        with self.transaction():
+            counts = DeletionCounts(*self._execute(f"count_subtree_of_{table}", (key,)).fetchone())
+            cursor = self._execute(f"delete_{table}", (key,))
+
+        if cursor.lastrowid < 0:
+            raise ValueError(f"deletion of {table} failed")
+
+        return counts
+
+    def _write_many(self, statement: str, items: Iterable[Any],
+                     key_of: Callable[[Any], str], row_of: Callable[[Any], tuple]) -> list[str]:
+        """
+        Writes a number of rows with a single statement and a single commit (none, if a transaction is open).
+        If the batch fails as a whole (e.g. due to a duplicate key), it is rolled back to a savepoint
+        and retried row by row within the same transaction, so that only the offending rows are skipped.
+        :param statement: The name of the INSERT (or UPSERT) statement in the registry.
+        :param items: The taxon objects to write.
+        :param key_of: Function returning the primary key of a taxon object.
+        :param row_of: Function converting a taxon object into a row of statement parameters.
+        :return: List of keys of the objects that could not be written.
+        """
+        sql = self._statements[statement]
+        failures = []
+        keyed_rows = []
+        statements = getattr(self._traces, "statements", None)
+
+        for item in items:
+            try:
+                keyed_rows.append((key_of(item), row_of(item)))
+            except (AttributeError, TypeError, IndexError):
+                failures.append(key_of(item))
+
+        if statements is not None and len(keyed_rows) > 0:
+            statements.append((sql, keyed_rows[0][1]))
+
+        cursor = self._connection.cursor()
+
+        try:
+            cursor.execute("SAVEPOINT write_many")
+
+            try:
+                cursor.executemany(sql, [row for key, row in keyed_rows])
+            except Error:
+                cursor.execute("ROLLBACK TO write_many")
+
+                for key, row in keyed_rows:
+                    try:
+                        cursor.execute(sql, row)
+                    except Error:
+                        failures.append(key)
+
+            cursor.execute("RELEASE write_many")
+
+            if self._transaction_depth == 0:
+                self._connection.commit()
+        except Error as e:
+            if self._transaction_depth == 0:
+                self._connection.rollback()
+            else:
+                # leave the enclosing transaction as it was before the batch
+                cursor.execute("ROLLBACK TO write_many")
+                cursor.execute("RELEASE write_many")
+            raise e
+
+        return failures
+
+    @classmethod
+    def _patient_row(cls, patient: Patient) -> tuple:
+        return (
+            patient.patient_id,
+            patient.name,
+            _encode_date(patient.date_of_birth),
+            cls._gender_codes.get(patient.gender)
+        )
+
+    @classmethod
+    def _study_row(cls, study: Study) -> tuple:
+        return (
+            study.study_uid,
+            study.patient.patient_id,
+            _encode_datetime(study.study_date_time),
+            study.referring_physician_name,
+            study.institution_name,
+            study.accession_number,
+            study.study_id,
+            study.study_description,
+            cls._anatomic_region_codes.get(study.anatomic_region)
+        )
+
+    @classmethod
+    def _series_row(cls, series: Series) -> tuple:
+        return (
+            series.series_uid,
+            series.study.study_uid,
+            series.sop_class,
+            series.transfer_syntax,
+            str.join('\\', series.specific_character_set),
+            _encode_datetime(series.series_datetime),
+            cls._modality_codes.get(series.modality),
+            series.series_number,
+            series.series_description,
+            series.sequence_name,
+            series.protocol_name,
+            series.spacing_between_slices,
+            series.pixel_spacing[0],
+            series.pixel_spacing[1],
+            series.image_orientation_patient[0][0],
+            series.image_orientation_patient[0][1],
+            series.image_orientation_patient[0][2],
+            series.image_orientation_patient[1][0],
+            series.image_orientation_patient[1][1],
+            series.image_orientation_patient[1][2]
+        )
+
+    @staticmethod
+    def _instance_row(instance: Instance) -> tuple:
+        return (
+            instance.instance_uid,
+            instance.series.series_uid,
+            instance.instance_number,
+            instance.instance_position_patient[0],
+            instance.instance_position_patient[1],
+            instance.instance_position_patient[2],
+            instance.file_name
+        )
+
+    @classmethod
+    def _get_change(cls, fetched: dict) -> Change:
+        return Change(fetched["seq"], cls._change_operations[fetched["operation"]], cls._change_taxa[fetched["taxon"]],
+                      fetched["key"])
+
+    @classmethod
+    def _get_patient(cls, fetched: dict) -> Patient:
+        if fetched is None:
+            return None
+
         try:
             patient = Patient.Patient()
             patient.patient_id = fetched["patient_id"]
             patient.name = fetched["patient_name"]
-            patient.date_of_birth = date.fromisoformat(fetched["patient_date_of_birth"])
-            patient.gender = Gender[fetched["patient_gender"].replace("Gender.", "")]
+            patient.date_of_birth = _decode_date(fetched["patient_date_of_birth"])
+            patient.gender = cls._genders.get(fetched["patient_gender"])
 
             return patient
         except Error as e:
             return None
 
-    def _get_study(self, fetched: dict) -> Study:
+    @classmethod
+    def _get_study(cls, fetched: dict) -> Study:
         if fetched is None:
             return None
 
         try:
             study = Study.Study()
             study.study_uid = fetched["study_uid"]
-            study.study_date_time = datetime.fromisoformat(fetched["study_datetime"])
+            study.study_date_time = _decode_datetime(fetched["study_datetime"])
             study.referring_physician_name = fetched["referring_physician_name"]
             study.institution_name = fetched["institution_name"]
             study.accession_number = fetched["accession_number"]
             study.study_id = fetched["study_id"]
             study.study_description = fetched["study_description"]
-            study.anatomic_region = AnatomicRegion[fetched["anatomic_region"].replace("AnatomicRegion.", "")]
+            study.anatomic_region = cls._anatomic_regions.get(fetched["anatomic_region"])
 
             return study
         except Error as e:
             return None
 
-    def _get_series(self, fetched: dict) -> Series:
+    @classmethod
+    def _get_series(cls, fetched: dict) -> Series:
         if fetched is None:
             return None
 
@@ -661,8 +1827,8 @@ class BasicDicomDatabase(IDicomDatabase):
             series.transfer_syntax = fetched["transfer_syntax"]
             charsets = fetched["specific_character_set"]
             series.specific_character_set = charsets.split("\\")
-            series.series_datetime = datetime.fromisoformat(fetched["series_datetime"])
-            series.modality = Modality[fetched["modality"].replace("Modality.", "")]
+            series.series_datetime = _decode_datetime(fetched["series_datetime"])
+            series.modality = cls._modalities.get(fetched["modality"])
             series.series_number = int(fetched["series_number"])
             series.series_description = fetched["series_description"]
             series.sequence_name = fetched["sequence_name"]
@@ -690,7 +1856,11 @@ class BasicDicomDatabase(IDicomDatabase):
         except Error as e:
             return None
 
-    def _get_instance(self, fetched: dict) -> Instance:
+    @classmethod
+    def _get_instance(cls, fetched: dict) -> Instance:
+        if fetched is None:
+            return None
+
         try:
             instance = Instance.Instance()
 
@@ -709,23 +1879,175 @@ class BasicDicomDatabase(IDicomDatabase):
         except Error as e:
             return None
 
-    def _select_patients(self, sql: str):
+    @classmethod
+    def _link_tree(cls, study_rows: list[dict], series_rows: list[dict], instance_rows: list[dict]) -> list[Study]:
+        """
+        Creates studies, series and instances from fetched rows and links them to each other.
+        Series and instances whose parent is not among the fetched rows are skipped.
+        :param study_rows: The fetched study rows.
+        :param series_rows: The fetched series rows.
+        :param instance_rows: The fetched instance rows.
+        :return: The list of linked studies.
+        """
+        studies: dict[str, Study] = {}
+        seriez: dict[str, Series] = {}
+
+        for fetch in study_rows:
+            study = cls._get_study(fetch)
+
+            if study is not None:
+                studies[study.study_uid] = study
+
+        for fetch in series_rows:
+            series = cls._get_series(fetch)
+            study = studies.get(fetch["study_uid"])
+
+            if series is not None and study is not None:
+                study.add_series(series)
+                seriez[series.series_uid] = series
+
+        for fetch in instance_rows:
+            instance = cls._get_instance(fetch)
+            series = seriez.get(fetch["series_uid"])
+
+            if instance is not None and series is not None:
+                series.add_instance(instance)
+
+        return list(studies.values())
+
+    def _iterate(self, statement: str, parameters: tuple, decode: Callable[[Any], Any],
+                 batch_size: int) -> Iterator[Any]:
+        """
+        Executes a statement from the registry and lazily yields the decoded rows.
+        Rows are fetched in batches, so that the memory consumption does not depend on the size of the result.
+        :param statement: The name of the statement in the registry.
+        :param parameters: The parameters to bind to the statement.
+        :param decode: Function creating a taxon object from a fetched row.
+        :param batch_size: The number of rows fetched at once.
+        :return: An iterator over the decoded objects; rows that could not be decoded are skipped.
+        """
+        cursor = self._execute(statement, parameters)
+
         try:
-            self._connection.row_factory = sqlite3.Row
-            cursor = self._connection.cursor()
-            cursor.execute(sql)
-            self._connection.commit()
-            fetched = cursor.fetchall()
+            while True:
+                fetched = cursor.fetchmany(batch_size)
 
-            result = []
+                if len(fetched) == 0:
+                    break
 
-            for fetch in fetched:
-                patient = self._get_patient(fetch)
+                for fetch in fetched:
+                    item = decode(fetch)
 
-                if patient is not None:
-                    result.append(patient)
+                    if item is not None:
+                        yield item
+        finally:
+            cursor.close()
 
-            return result
+    def _filter_statement(self, table: str, criteria: NamedTuple, limit: int) -> tuple[str, tuple]:
+        """
+        Builds the statement of a filter query.
+        :param table: The table to select from.
+        :param criteria: The filter (StudyFilter or SeriesFilter); criteria of None are left out.
+        :param limit: The maximal number of rows, or None for all.
+        :return: The SQL text and its parameters.
+        """
+        conditions = []
+        parameters = []
+
+        for field, value in criteria._asdict().items():
+            if value is None:
+                continue
+
+            if isinstance(value, datetime):
+                value = _encode_datetime(value)
+            elif isinstance(value, Enum):
+                value = self._enum_filter_codes[value]
+
+            conditions.append(self._filter_conditions[table][field])
+            parameters.append(value)
+
+        where = f" WHERE {' AND '.join(conditions)}" if len(conditions) > 0 else ""
+        sql = f"SELECT * FROM `{table}`{where} ORDER BY {self._filter_orderings[table]} LIMIT ?"
+
+        return sql, (*parameters, -1 if limit is None else limit)
+
+    def _select_page(self, table: str, after_key: str, page_size: int, order_by: str,
+                     decode: Callable[[Any], Any]) -> tuple[list[Any], str]:
+        """
+        Selects a page of a table using keyset pagination.
+        One row more than the page size is fetched, to know if a further page exists.
+        :param table: The name of the table.
+        :param after_key: The continuation token of the previous page, or None for the first page.
+        :param page_size: The maximal number of rows in the page.
+        :param order_by: The column to order by.
+        :param decode: Function creating a taxon object from a fetched row.
+        :return: The decoded objects of the page and the continuation token (None, if this was the last page).
+        """
+        key, orderings = self._page_orderings[table]
+
+        if order_by not in orderings:
+            raise ValueError(f"{table} cannot be paged by '{order_by}'")
+
+        if page_size < 1:
+            raise ValueError(f"page size must be at least 1, not {page_size}")
+
+        if after_key is None:
+            statement = f"select_{table}_page_by_{order_by}"
+            parameters = (page_size + 1,)
+        else:
+            token_order_by, last_value, last_key = self._decode_page_token(after_key)
+
+            if token_order_by != order_by:
+                raise ValueError(f"continuation token does not belong to ordering '{order_by}'")
+
+            statement = f"select_{table}_page_by_{order_by}_after"
+
+            if order_by == key:
+                parameters = (last_key, page_size + 1)
+            elif last_value is None:
+                statement += "_null"
+                parameters = (last_key, page_size + 1)
+            else:
+                parameters = (last_value, last_key, page_size + 1)
+
+        fetched = self._execute(statement, parameters).fetchall()
+
+        if statement.endswith("_after_null") and len(fetched) <= page_size:
+            # the NULL group is exhausted; continue with the first non-NULL rows
+            parameters = (page_size + 1 - len(fetched),)
+            fetched += self._execute(f"select_{table}_page_by_{order_by}_not_null", parameters).fetchall()
+        page = fetched[:page_size]
+        token = None
+
+        if len(fetched) > page_size:
+            token = self._encode_page_token(order_by, page[-1][order_by], page[-1][key])
+
+        result = []
+
+        for fetch in page:
+            item = decode(fetch)
+
+            if item is not None:
+                result.append(item)
+
+        return result, token
+
+    @staticmethod
+    def _encode_page_token(order_by: str, last_value: Any, last_key: str) -> str:
+        data = json.dumps([order_by, last_value, last_key]).encode("utf-8")
+        return base64.urlsafe_b64encode(data).decode("ascii")
+
+    @staticmethod
+    def _decode_page_token(token: str) -> tuple[str, Any, str]:
+        try:
+            order_by, last_value, last_key = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+            return order_by, last_value, last_key
+        except (ValueError, TypeError):
+            raise ValueError("invalid continuation token")
+
+    def _select_patients(self, statement: str, parameters: tuple = ()) -> list[Patient]:
+        try:
+            return list(self._iterate(statement, parameters, self._get_patient, self._default_batch_size))
         except ValueError:
             return []
 
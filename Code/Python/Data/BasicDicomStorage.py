@@ -1,6 +1,13 @@
+import io
 import os.path
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from sqlite3 import Error
+from typing import Iterable
 import pydicom as dicom
-from Data.IDicomStorage import IDicomStorage
+from Data.IDicomDatabase import IDicomDatabase
+from Data.IDicomStorage import IDicomStorage, StoreResult
 from Taxons import Series
 from DicomStuff import PyDicomExtensions as PDX
 
@@ -29,8 +36,18 @@ class BasicDicomStorage(IDicomStorage):
 
     """
 
-    def __init__(self):
+    def __init__(self, database: IDicomDatabase = None, max_known_folders: int = 4096):
+        """
+        Creates an instance of BasicDicomStorage.
+        :param database: The database to make the entries of the stored files into; None for no entries.
+        :param max_known_folders: The number of series folders remembered to exist, so that storing into them
+                                  costs no file system lookups; 0 looks the folder up for every dataset.
+        """
         self._root_folder = ""
+        self._database = database
+        self._known_folders: OrderedDict[str, None] = OrderedDict()     # least recently used first
+        self._max_known_folders = max_known_folders
+        self._folders_lock = threading.Lock()
 
     # region Properties
     @property
@@ -41,6 +58,18 @@ class BasicDicomStorage(IDicomStorage):
         """
         return self._root_folder
 
+    @property
+    def database(self) -> IDicomDatabase:
+        """
+        Gets the database the entries of the stored files are made into.
+        :return: The database, or None, if no entries are made.
+        """
+        return self._database
+
+    @database.setter
+    def database(self, value: IDicomDatabase):
+        self._database = value
+
     # endregion
 
     def initialize(self, root_folder_: str):
@@ -49,6 +78,9 @@ class BasicDicomStorage(IDicomStorage):
         :param root_folder_: The name of the root folder to create.
         :return:
         """
+        with self._folders_lock:
+            self._known_folders.clear()
+
         try:
             self._root_folder = root_folder_
             if not os.path.isdir(self._root_folder):
@@ -63,35 +95,50 @@ class BasicDicomStorage(IDicomStorage):
         If the dataset could be stored, makes an entry into the database ('file_name').
         :param dataset: The dataset to store. Must be valid, i.e. contain all the UID's to build the full path name.
         :return: None.
-        :exception: IOError if the dataset could not be stored.
+        :exception: IOError if the dataset could not be stored;
+                    KeyError if the instance of the stored dataset is not in the database.
         """
-        if not PDX.is_dataset_valid(dataset):
-            raise IOError("Dataset not valid")
+        file_name = self._write_dataset(dataset)
+        instance_uid = dataset.data_element("SOPInstanceUID").value
 
-        patient_id = dataset.data_element("PatientID")
-        study_uid = dataset.data_element("StudyInstanceUID")
-        series_uid = dataset.data_element("SeriesInstanceUID")
-        instance_uid = dataset.data_element("SOPInstanceUID")
+        if self._database is not None and len(self._database.update_instance_file_names({instance_uid: file_name})) > 0:
+            raise KeyError(f"instance {instance_uid} is not in the database")
 
-        patient_folder = os.path.join(self._root_folder, patient_id.value)
-        if not os.path.isdir(patient_folder):
-            os.mkdir(patient_folder)
+    def store_datasets(self, datasets: Iterable[dicom.Dataset], workers: int = 4,
+                       max_pending: int = None) -> list[StoreResult]:
+        """
+        Stores a number of DICOM datasets in the file system (see store_dataset), several at the same time: every
+        worker encodes its dataset in memory and writes the file in one call, so that the disk is written while
+        the other workers encode. Datasets are taken from the iterable only as far as at most max_pending of them
+        wait to be stored (backpressure), so that a lazy iterable (e.g. reading from the network) is not drained
+        into memory ahead of the disk.
+        The entries into the database ('file_name') are made with one call once all datasets are stored.
+        :param datasets: The datasets to store. Each must be valid (see store_dataset).
+        :param workers: The number of datasets stored at the same time.
+        :param max_pending: The number of datasets taken from the iterable but not yet stored, at most;
+                            None for twice the number of workers.
+        :return: The results, in the order of the datasets. The error of a result is an IOError, if the dataset
+                 could not be stored, and a KeyError, if its instance is not in the database.
+        :exception: ValueError, if the number of workers is less than 1.
+        """
+        if workers < 1:
+            raise ValueError("at least one worker is required")
 
-        study_folder = os.path.join(patient_folder, study_uid.value)
-        if not os.path.isdir(study_folder):
-            os.mkdir(study_folder)
+        max_pending = 2 * workers if max_pending is None else max(max_pending, 1)
+        pending: deque[tuple[str, Future]] = deque()
+        results = []
 
-        series_folder = os.path.join(study_folder, series_uid.value)
-        if not os.path.isdir(series_folder):
-            os.mkdir(series_folder)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="BasicDicomStorage") as executor:
+            for dataset in datasets:
+                if len(pending) >= max_pending:
+                    results.append(self._result(*pending.popleft()))
 
-        file_name = os.path.join(series_folder, instance_uid.value) + ".dcm"
+                pending.append((dataset.get("SOPInstanceUID"), executor.submit(self._write_dataset, dataset)))
 
-        try:
-            dataset.save_as(file_name)
-            # TODO: add file name to the database
-        except:
-            raise IOError(f"Failed to save dataset at {file_name}")
+            while len(pending) > 0:
+                results.append(self._result(*pending.popleft()))
+
+        return self._record_file_names(results)
 
     def get_dataset(self, file_path: str) -> dicom.dataset:
         """
@@ -127,3 +174,97 @@ class BasicDicomStorage(IDicomStorage):
 
         return errors
 
+    # region Protected Auxiliary
+    def _write_dataset(self, dataset: dicom.dataset) -> str:
+        """
+        Writes a DICOM dataset into its file (see store_dataset); no entry into the database is made.
+        :param dataset: The dataset to write.
+        :return: The full path name of the file.
+        :exception: IOError if the dataset could not be stored.
+        """
+        if not PDX.is_dataset_valid(dataset):
+            raise IOError("Dataset not valid")
+
+        patient_id = dataset.data_element("PatientID")
+        study_uid = dataset.data_element("StudyInstanceUID")
+        series_uid = dataset.data_element("SeriesInstanceUID")
+        instance_uid = dataset.data_element("SOPInstanceUID")
+
+        series_folder = os.path.join(self._root_folder, patient_id.value, study_uid.value, series_uid.value)
+        file_name = os.path.join(series_folder, instance_uid.value) + ".dcm"
+
+        try:
+            buffer = io.BytesIO()
+            dataset.save_as(buffer)
+            self._create_folder(series_folder)
+
+            try:
+                self._write_file(file_name, buffer)
+            except FileNotFoundError:
+                # the folder was removed since it became known
+                self._forget_folder(series_folder)
+                self._create_folder(series_folder)
+                self._write_file(file_name, buffer)
+
+            return file_name
+        except Exception as e:
+            raise IOError(f"Failed to save dataset at {file_name}") from e
+
+    def _create_folder(self, folder: str):
+        """
+        Creates a folder with its missing parents, unless it is known to exist.
+        :param folder: The full path of the folder.
+        :return: None
+        """
+        with self._folders_lock:
+            if folder in self._known_folders:
+                self._known_folders.move_to_end(folder)
+                return
+
+        # several workers may create the same folders at the same time
+        os.makedirs(folder, exist_ok=True)
+
+        if self._max_known_folders > 0:
+            with self._folders_lock:
+                self._known_folders[folder] = None
+                self._known_folders.move_to_end(folder)
+
+                if len(self._known_folders) > self._max_known_folders:
+                    self._known_folders.popitem(last=False)
+
+    def _forget_folder(self, folder: str):
+        with self._folders_lock:
+            self._known_folders.pop(folder, None)
+
+    @staticmethod
+    def _write_file(file_name: str, buffer: io.BytesIO):
+        with open(file_name, "wb") as file:
+            file.write(buffer.getbuffer())
+
+    @staticmethod
+    def _result(instance_uid: str, future: Future) -> StoreResult:
+        try:
+            return StoreResult(instance_uid, future.result(), None)
+        except IOError as e:
+            return StoreResult(instance_uid, None, e)
+
+    def _record_file_names(self, results: list[StoreResult]) -> list[StoreResult]:
+        """
+        Makes the entries of the stored files into the database with one call.
+        :param results: The results of the datasets.
+        :return: The results, with a KeyError for the instances not in the database, or the error of the database
+                 for all stored datasets, if the call failed.
+        """
+        file_names = {result.instance_uid: result.file_name for result in results if result.error is None}
+
+        if self._database is None or len(file_names) == 0:
+            return results
+
+        try:
+            missing = set(self._database.update_instance_file_names(file_names))
+        except Error as e:
+            return [result if result.error is not None else result._replace(error=e) for result in results]
+
+        return [result._replace(error=KeyError(f"instance {result.instance_uid} is not in the database"))
+                if result.error is None and result.instance_uid in missing else result for result in results]
+    # endregion
@@ -0,0 +1,383 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterable, Callable, Any, NamedTuple
+from Data.DicomDatabaseDecorator import DicomDatabaseDecorator
+from Data.IDicomDatabase import IDicomDatabase, DeletionCounts
+from Taxons.Patient import Patient, Study
+from Taxons.Series import Series, Instance
+
+# Counters of one taxon cache
+CacheStatistics = NamedTuple('CacheStatistics', [('hits', int), ('misses', int), ('size', int), ('capacity', int)])
+
+
+class _LruCache:
+    """
+    Size-bounded, thread-safe mapping evicting the least recently used entry.
+    Every invalidation advances a generation counter; an object read from the database is only stored,
+    if no invalidation happened since the read started, so a concurrent write never leaves a stale entry behind.
+    """
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+
+    def get_or_load(self, key: str, load: Callable[[str], Any]) -> Any:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key]
+
+            self._misses += 1
+            generation = self._generation
+
+        value = load(key)
+
+        # objects not found are not cached, so that inserts never have to find negative entries
+        if value is not None and self._capacity > 0:
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[key] = value
+                    self._entries.move_to_end(key)
+
+                    if len(self._entries) > self._capacity:
+                        self._entries.popitem(last=False)
+
+        return value
+
+    def invalidate(self, keys: Iterable[str]):
+        with self._lock:
+            self._generation += 1
+
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    @property
+    def statistics(self) -> CacheStatistics:
+        with self._lock:
+            return CacheStatistics(self._hits, self._misses, len(self._entries), self._capacity)
+
+
+class CachedDicomDatabase(DicomDatabaseDecorator):
+    """
+    Read-through cache in front of another IDicomDatabase.
+    select_patient, select_study, select_series and select_instance are answered from one LRU cache per taxon type;
+    all other selections go to the wrapped database.
+    Every insert, update and delete invalidates the entries of the written keys once the write has finished.
+    The deletes of patients, studies and series cascade, so they also invalidate the subtree the deleted object
+    had before the deletion; the cached objects do not know their parents.
+    The cached objects are shared between all callers and must not be modified.
+    """
+
+    # region Construction
+    def __init__(self, database: IDicomDatabase, patient_capacity: int = 1024, study_capacity: int = 1024,
+                 series_capacity: int = 4096, instance_capacity: int = 16384):
+        """
+        Creates an instance of CachedDicomDatabase.
+        :param database: The database to wrap.
+        :param patient_capacity: The maximal number of cached patients.
+        :param study_capacity: The maximal number of cached studies.
+        :param series_capacity: The maximal number of cached series.
+        :param instance_capacity: The maximal number of cached instances.
+        """
+        super().__init__(database)
+
+        self._patients = _LruCache(patient_capacity)
+        self._studies = _LruCache(study_capacity)
+        self._seriez = _LruCache(series_capacity)
+        self._instances = _LruCache(instance_capacity)
+        self._transactions = threading.local()     # depth of the transactions of the calling thread
+    # endregion
+
+    # region Properties
+    @property
+    def statistics(self) -> dict[str, CacheStatistics]:
+        """
+        Gets the hit and miss counters of the caches.
+        :return: Dictionary of the counters. Key: 'patient', 'study', 'series' or 'instance'; Value: the counters.
+        """
+        return {
+            "patient": self._patients.statistics,
+            "study": self._studies.statistics,
+            "series": self._seriez.statistics,
+            "instance": self._instances.statistics,
+        }
+    # endregion
+
+    # region General Management
+    def close(self):
+        """
+        Closes the database and empties the caches.
+        :return: None
+        """
+        self.clear()
+        self._database.close()
+
+    def reset(self):
+        """
+        Removes all data from the database and empties the caches.
+        :return: None
+        """
+        try:
+            self._database.reset()
+        finally:
+            self.clear()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups writes into one transaction of the wrapped database (see BasicDicomDatabase.transaction).
+        While the calling thread has a transaction open, its selections bypass the caches, so that its uncommitted
+        rows never reach other threads. The caches are emptied when the block is left, since other threads may have
+        loaded rows that the commit has made stale.
+        :return: Context manager of the transaction.
+        """
+        depth = getattr(self._transactions, "depth", 0)
+        self._transactions.depth = depth + 1
+
+        try:
+            with self._database.transaction():
+                yield self
+        finally:
+            self._transactions.depth = depth
+            self.clear()
+
+    def clear(self):
+        """
+        Empties the caches. The hit and miss counters are kept.
+        :return: None
+        """
+        for cache in [self._patients, self._studies, self._seriez, self._instances]:
+            cache.clear()
+    # endregion
+
+    # region Patient Management
+    def insert_patient(self, patient: Patient):
+        try:
+            return self._database.insert_patient(patient)
+        finally:
+            self._patients.invalidate([patient.patient_id])
+
+    def insert_patients(self, patients: Iterable[Patient]) -> list[str]:
+        patients = list(patients)
+
+        try:
+            return self._database.insert_patients(patients)
+        finally:
+            self._patients.invalidate([patient.patient_id for patient in patients])
+
+    def update_patient(self, patient: Patient):
+        try:
+            return self._database.update_patient(patient)
+        finally:
+            self._patients.invalidate([patient.patient_id])
+
+    def upsert_patients(self, patients: Iterable[Patient]) -> list[str]:
+        patients = list(patients)
+
+        try:
+            return self._database.upsert_patients(patients)
+        finally:
+            self._patients.invalidate([patient.patient_id for patient in patients])
+
+    def delete_patient(self, patient_id: str) -> DeletionCounts:
+        # the deletion cascades; the keys of the subtree are collected before
+        study_uids = [study.study_uid for study in self._database.iter_studies_to_patient(patient_id)]
+        series_uids = self._series_below(study_uids)
+        instance_uids = self._instances_below(series_uids)
+
+        try:
+            return self._database.delete_patient(patient_id)
+        finally:
+            self._patients.invalidate([patient_id])
+            self._studies.invalidate(study_uids)
+            self._seriez.invalidate(series_uids)
+            self._instances.invalidate(instance_uids)
+
+    def select_patient(self, patient_id: str) -> Patient:
+        """
+        Selects a patient by PatientID, from the cache if possible (see IDicomDatabase.select_patient).
+        """
+        return self._select(self._patients, patient_id, self._database.select_patient)
+    # endregion
+
+    # region Study Management
+    def insert_study(self, study: Study):
+        try:
+            return self._database.insert_study(study)
+        finally:
+            self._studies.invalidate([study.study_uid])
+
+    def insert_studies(self, studies: Iterable[Study]) -> list[str]:
+        studies = list(studies)
+
+        try:
+            return self._database.insert_studies(studies)
+        finally:
+            self._studies.invalidate([study.study_uid for study in studies])
+
+    def update_study(self, study: Study):
+        try:
+            return self._database.update_study(study)
+        finally:
+            self._studies.invalidate([study.study_uid])
+
+    def upsert_studies(self, studies: Iterable[Study]) -> list[str]:
+        studies = list(studies)
+
+        try:
+            return self._database.upsert_studies(studies)
+        finally:
+            self._studies.invalidate([study.study_uid for study in studies])
+
+    def delete_study(self, study_uid: str) -> DeletionCounts:
+        series_uids = self._series_below([study_uid])
+        instance_uids = self._instances_below(series_uids)
+
+        try:
+            return self._database.delete_study(study_uid)
+        finally:
+            self._studies.invalidate([study_uid])
+            self._seriez.invalidate(series_uids)
+            self._instances.invalidate(instance_uids)
+
+    def select_study(self, study_uid: str) -> Study:
+        """
+        Selects a study by StudyUID, from the cache if possible (see IDicomDatabase.select_study).
+        """
+        return self._select(self._studies, study_uid, self._database.select_study)
+    # endregion
+
+    # region Series Management
+    def insert_series(self, series: Series):
+        try:
+            return self._database.insert_series(series)
+        finally:
+            self._seriez.invalidate([series.series_uid])
+
+    def insert_series_many(self, seriez: Iterable[Series]) -> list[str]:
+        seriez = list(seriez)
+
+        try:
+            return self._database.insert_series_many(seriez)
+        finally:
+            self._seriez.invalidate([series.series_uid for series in seriez])
+
+    def update_series(self, series: Series):
+        try:
+            return self._database.update_series(series)
+        finally:
+            self._seriez.invalidate([series.series_uid])
+
+    def upsert_series_many(self, seriez: Iterable[Series]) -> list[str]:
+        seriez = list(seriez)
+
+        try:
+            return self._database.upsert_series_many(seriez)
+        finally:
+            self._seriez.invalidate([series.series_uid for series in seriez])
+
+    def delete_series(self, series_uid: str) -> DeletionCounts:
+        instance_uids = self._instances_below([series_uid])
+
+        try:
+            return self._database.delete_series(series_uid)
+        finally:
+            self._seriez.invalidate([series_uid])
+            self._instances.invalidate(instance_uids)
+
+    def select_series(self, series_uid: str) -> Series:
+        """
+        Selects a series by SeriesUID, from the cache if possible (see IDicomDatabase.select_series).
+        """
+        return self._select(self._seriez, series_uid, self._database.select_series)
+    # endregion
+
+    # region Instance Management
+    def insert_instance(self, instance: Instance):
+        try:
+            return self._database.insert_instance(instance)
+        finally:
+            self._instances.invalidate([instance.instance_uid])
+
+    def insert_instances(self, instances: Iterable[Instance]) -> list[str]:
+        instances = list(instances)
+
+        try:
+            return self._database.insert_instances(instances)
+        finally:
+            self._instances.invalidate([instance.instance_uid for instance in instances])
+
+    def update_instance(self, instance: Instance):
+        try:
+            return self._database.update_instance(instance)
+        finally:
+            self._instances.invalidate([instance.instance_uid])
+
+    def upsert_instances(self, instances: Iterable[Instance]) -> list[str]:
+        instances = list(instances)
+
+        try:
+            return self._database.upsert_instances(instances)
+        finally:
+            self._instances.invalidate([instance.instance_uid for instance in instances])
+
+    def update_instance_file_names(self, file_names: dict[str, str]) -> list[str]:
+        try:
+            return self._database.update_instance_file_names(file_names)
+        finally:
+            self._instances.invalidate(list(file_names))
+
+    def delete_instance(self, instance_uid: str):
+        try:
+            return self._database.delete_instance(instance_uid)
+        finally:
+            self._instances.invalidate([instance_uid])
+
+    def delete_instances_of_series(self, series_uid: str):
+        # the cached instances do not know their series, so the keys are collected before the deletion
+        instance_uids = self._instances_below([series_uid])
+
+        try:
+            return self._database.delete_instances_of_series(series_uid)
+        finally:
+            self._instances.invalidate(instance_uids)
+
+    def select_instance(self, instance_uid: str) -> Instance:
+        """
+        Selects an instance by InstanceUID, from the cache if possible (see IDicomDatabase.select_instance).
+        """
+        return self._select(self._instances, instance_uid, self._database.select_instance)
+    # endregion
+
+    # region Protected Auxiliary
+    def _select(self, cache: _LruCache, key: str, load: Callable[[str], Any]) -> Any:
+        """
+        Selects an object through a cache, or directly, if the calling thread has a transaction open.
+        :param cache: The cache of the taxon type.
+        :param key: The key of the object.
+        :param load: Function selecting the object from the wrapped database.
+        :return: The object, if found, otherwise None.
+        """
+        if getattr(self._transactions, "depth", 0) > 0:
+            return load(key)
+
+        return cache.get_or_load(key, load)
+
+    def _series_below(self, study_uids: list[str]) -> list[str]:
+        return [series.series_uid for study_uid in study_uids
+                for series in self._database.iter_series_to_study(study_uid)]
+
+    def _instances_below(self, series_uids: list[str]) -> list[str]:
+        return [instance.instance_uid for series_uid in series_uids
+                for instance in self._database.iter_instances_to_series(series_uid)]
+    # endregion
@@ -0,0 +1,203 @@
+import logging
+import threading
+import time
+from sqlite3 import Error
+from typing import NamedTuple
+from Data.BasicDicomDatabase import BasicDicomDatabase
+
+# Snapshot of the maintenance: the number of runs of every task, the pages returned to the file system by
+# incremental_vacuum, the size of the WAL files at their last checkpoint, the time spent in the tasks, the polls at
+# which due tasks were deferred because the databases were being written, and the tasks that failed
+MaintenanceMetrics = NamedTuple('MaintenanceMetrics', [('optimize_runs', int), ('vacuum_runs', int),
+                                                       ('checkpoint_runs', int), ('pages_freed', int),
+                                                       ('wal_pages', int), ('seconds', float),
+                                                       ('deferred_polls', int), ('failures', int)])
+
+_logger = logging.getLogger(__name__)
+
+
+class DatabaseMaintenance:
+    """
+    Background maintenance of sqlite databases: a thread polls the databases and runs the tasks that are due, at
+    most one task per poll (the one overdue longest):
+    - "checkpoint": PASSIVE WAL checkpoint (see BasicDicomDatabase.checkpoint),
+    - "vacuum": incremental vacuum of a bounded number of pages (see BasicDicomDatabase.incremental_vacuum),
+    - "optimize": ANALYZE of the outdated planner statistics (see BasicDicomDatabase.optimize).
+    Every task runs at most once per interval and database, and only while the database is idle, i.e. its change
+    log did not grow for some seconds, so that the maintenance stays clear of ingest bursts.
+    The tasks run on the connection of the maintenance thread, so the databases must use per-thread connections
+    (the default). A ShardedDicomDatabase is maintained shard by shard; decorated databases
+    (e.g. InstrumentedDicomDatabase) are maintained through the database they wrap.
+    """
+    _tasks = ["checkpoint", "vacuum", "optimize"]
+
+    # region Construction
+    def __init__(self, database, checkpoint_interval: float = 60.0, vacuum_interval: float = 300.0,
+                 optimize_interval: float = 3600.0, vacuum_pages: int = 1024, idle_seconds: float = 5.0,
+                 poll_interval: float = 1.0):
+        """
+        Creates an instance of DatabaseMaintenance. The maintenance does not run until it is started.
+        :param database: The database to maintain: a BasicDicomDatabase, a ShardedDicomDatabase or a decorator
+                         of either; it must stay open while the maintenance runs.
+        :param checkpoint_interval: The minimum seconds between two WAL checkpoints of a database.
+        :param vacuum_interval: The minimum seconds between two incremental vacuums of a database.
+        :param optimize_interval: The minimum seconds between two optimizations of a database.
+        :param vacuum_pages: The maximum number of pages freed per incremental vacuum; 0 frees all.
+        :param idle_seconds: The seconds without writes after which a database is maintained.
+        :param poll_interval: The seconds between two polls of the maintenance thread.
+        """
+        self._databases: list[BasicDicomDatabase] = list(getattr(database, "shards", [database]))
+        self._intervals = {"checkpoint": checkpoint_interval, "vacuum": vacuum_interval,
+                           "optimize": optimize_interval}
+        self._vacuum_pages = vacuum_pages
+        self._idle_seconds = idle_seconds
+        self._poll_interval = poll_interval
+
+        now = time.monotonic()
+        # the first runs are due one interval after the creation, not at once
+        self._last_runs = {(task, index): now for task in self._tasks for index in range(len(self._databases))}
+        self._last_change_seqs: list[int] = [None] * len(self._databases)
+        self._last_change_times = [now] * len(self._databases)
+
+        self._runs = {task: 0 for task in self._tasks}
+        self._pages_freed = 0
+        self._wal_pages = [0] * len(self._databases)
+        self._seconds = 0.0
+        self._deferred_polls = 0
+        self._failures = 0
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread = None
+    # endregion
+
+    # region Properties
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def metrics(self) -> MaintenanceMetrics:
+        """
+        Gets a snapshot of the metrics recorded so far.
+        :return: The metrics, summed over all databases.
+        """
+        with self._lock:
+            return MaintenanceMetrics(self._runs["optimize"], self._runs["vacuum"], self._runs["checkpoint"],
+                                      self._pages_freed, sum(self._wal_pages), self._seconds,
+                                      self._deferred_polls, self._failures)
+    # endregion
+
+    # region Management
+    def start(self):
+        """
+        Starts the maintenance thread, if not yet running.
+        :return: None
+        """
+        if self.running:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="DatabaseMaintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the maintenance thread, waiting for the task it is running, if any.
+        :return: None
+        """
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def run_pending(self) -> str:
+        """
+        Polls the databases once and runs the task that is overdue longest on an idle database
+        (called by the maintenance thread; may also be called directly, e.g. by a scheduler of the application).
+        :return: The name of the task run; None, if no task was due or the databases were being written.
+        """
+        now = time.monotonic()
+        candidates = []     # (seconds overdue, task, index of the database)
+        deferred = False
+
+        for index, database in enumerate(self._databases):
+            due = [(now - self._last_runs[(task, index)] - self._intervals[task], task) for task in self._tasks
+                   if now - self._last_runs[(task, index)] >= self._intervals[task]]
+
+            if len(due) == 0:
+                continue
+
+            if not self._is_idle(index, database, now):
+                deferred = True
+                continue
+
+            candidates.extend((overdue, task, index) for overdue, task in due)
+
+        if len(candidates) == 0:
+            if deferred:
+                with self._lock:
+                    self._deferred_polls += 1
+
+            return None
+
+        overdue, task, index = max(candidates, key=lambda candidate: candidate[0])
+        self._last_runs[(task, index)] = now
+        self._run_task(task, index, self._databases[index])
+        return task
+    # endregion
+
+    # region Protected Auxiliary
+    def _run(self):
+        while not self._stop.wait(self._poll_interval):
+            self.run_pending()
+
+    def _is_idle(self, index: int, database: BasicDicomDatabase, now: float) -> bool:
+        """
+        Tells whether a database was not written for the idle seconds, by the growth of its change log.
+        :return: True, if the database is idle.
+        """
+        try:
+            change_seq = database.last_change_seq
+        except Error:
+            return False
+
+        if change_seq != self._last_change_seqs[index]:
+            self._last_change_seqs[index] = change_seq
+            self._last_change_times[index] = now
+
+        return now - self._last_change_times[index] >= self._idle_seconds
+
+    def _run_task(self, task: str, index: int, database: BasicDicomDatabase):
+        start = time.perf_counter()
+        pages_freed = 0
+        wal_pages = None
+
+        try:
+            if task == "checkpoint":
+                wal_pages, checkpointed_pages = database.checkpoint()
+            elif task == "vacuum":
+                pages_freed = database.incremental_vacuum(self._vacuum_pages)
+            else:
+                database.optimize()
+        except Error as e:
+            _logger.warning("maintenance task %s failed: %s", task, e)
+
+            with self._lock:
+                self._failures += 1
+            return
+
+        seconds = time.perf_counter() - start
+
+        with self._lock:
+            self._runs[task] += 1
+            self._pages_freed += pages_freed
+            self._seconds += seconds
+
+            if wal_pages is not None:
+                self._wal_pages[index] = wal_pages
+
+        _logger.debug("maintenance task %s took %.3f s", task, seconds)
+    # endregion
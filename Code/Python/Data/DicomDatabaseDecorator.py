@@ -0,0 +1,374 @@
+from datetime import date
+from typing import Iterable, Iterator
+from Data.IDicomDatabase import IDicomDatabase, DeletionCounts, StudySummary, StudyFilter, SeriesFilter
+from Taxons.Patient import Patient, Study
+from Taxons.Series import Series, Instance
+
+
+class DicomDatabaseDecorator(IDicomDatabase):
+    """
+    Base class of the layers wrapping another IDicomDatabase (e.g. caching).
+    Every method of IDicomDatabase is forwarded to the wrapped database; subclasses override the methods they add
+    behaviour to. Other attributes (e.g. BasicDicomDatabase.vacuum) are looked up on the wrapped database.
+    """
+
+    # region Construction
+    def __init__(self, database: IDicomDatabase):
+        """
+        Creates an instance of DicomDatabaseDecorator.
+        :param database: The database to wrap.
+        """
+        self._database = database
+    # endregion
+
+    # region Properties
+    @property
+    def database(self) -> IDicomDatabase:
+        """
+        Gets the wrapped database.
+        :return: The wrapped database.
+        """
+        return self._database
+    # endregion
+
+    def __getattr__(self, name):
+        if name == "_database":
+            raise AttributeError(name)
+
+        return getattr(self._database, name)
+
+    # region General Management
+    def open(self, database_file_name: str):
+        """
+        Opens the database (see IDicomDatabase.open).
+        """
+        return self._database.open(database_file_name)
+
+    def close(self):
+        """
+        Closes the database (see IDicomDatabase.close).
+        """
+        return self._database.close()
+
+    def reset(self):
+        """
+        Removes all data from the database (see IDicomDatabase.reset).
+        """
+        return self._database.reset()
+    # endregion
+
+    # region Patient Management
+    def insert_patient(self, patient: Patient):
+        """
+        Tries to insert a patient (see IDicomDatabase.insert_patient).
+        """
+        return self._database.insert_patient(patient)
+
+    def insert_patients(self, patients: Iterable[Patient]) -> list[str]:
+        """
+        Tries to insert a number of patients within one transaction (see IDicomDatabase.insert_patients).
+        """
+        return self._database.insert_patients(patients)
+
+    def update_patient(self, patient: Patient):
+        """
+        Tries to update a patient (see IDicomDatabase.update_patient).
+        """
+        return self._database.update_patient(patient)
+
+    def upsert_patients(self, patients: Iterable[Patient]) -> list[str]:
+        """
+        Inserts or updates a number of patients within one transaction (see IDicomDatabase.upsert_patients).
+        """
+        return self._database.upsert_patients(patients)
+
+    def delete_patient(self, patient_id: str) -> DeletionCounts:
+        """
+        Tries to delete a patient (see IDicomDatabase.delete_patient).
+        """
+        return self._database.delete_patient(patient_id)
+
+    def select_patient(self, patient_id: str) -> Patient:
+        """
+        Selects a patient by PatientID (see IDicomDatabase.select_patient).
+        """
+        return self._database.select_patient(patient_id)
+
+    def select_patients_by_name_pattern(self, name_pattern: str) -> list[Patient]:
+        """
+        Selects a set of patients by name pattern (see IDicomDatabase.select_patients_by_name_pattern).
+        """
+        return self._database.select_patients_by_name_pattern(name_pattern)
+
+    def select_patients_by_date_of_birth(self, dob_from: date, dob_to: date) -> list[Patient]:
+        """
+        Selects a set of patients by date of birth (see IDicomDatabase.select_patients_by_date_of_birth).
+        """
+        return self._database.select_patients_by_date_of_birth(dob_from, dob_to)
+
+    def select_all_patients(self) -> list[Patient]:
+        """
+        Selects all patients (see IDicomDatabase.select_all_patients).
+        """
+        return self._database.select_all_patients()
+
+    def select_patients_by_limit(self, limit: int) -> list[Patient]:
+        """
+        Selects a limited number of patients (see IDicomDatabase.select_patients_by_limit).
+        """
+        return self._database.select_patients_by_limit(limit)
+
+    def iter_patients_by_name_pattern(self, name_pattern: str, batch_size: int = 256) -> Iterator[Patient]:
+        """
+        Iterates lazily over the patients by name pattern (see IDicomDatabase.iter_patients_by_name_pattern).
+        """
+        return self._database.iter_patients_by_name_pattern(name_pattern, batch_size)
+
+    def iter_patients_by_date_of_birth(self, dob_from: date, dob_to: date, batch_size: int = 256) -> Iterator[Patient]:
+        """
+        Iterates lazily over the patients by date of birth (see IDicomDatabase.iter_patients_by_date_of_birth).
+        """
+        return self._database.iter_patients_by_date_of_birth(dob_from, dob_to, batch_size)
+
+    def iter_all_patients(self, batch_size: int = 256) -> Iterator[Patient]:
+        """
+        Iterates lazily over all patients (see IDicomDatabase.iter_all_patients).
+        """
+        return self._database.iter_all_patients(batch_size)
+
+    def select_patients_page(self, after_key: str = None, page_size: int = 50,
+                             order_by: str = "patient_id") -> tuple[list[Patient], str]:
+        """
+        Selects a page of patients using keyset pagination (see IDicomDatabase.select_patients_page).
+        """
+        return self._database.select_patients_page(after_key, page_size, order_by)
+    # endregion
+
+    # region Study Management
+    def insert_study(self, study: Study):
+        """
+        Tries to insert a study (see IDicomDatabase.insert_study).
+        """
+        return self._database.insert_study(study)
+
+    def insert_studies(self, studies: Iterable[Study]) -> list[str]:
+        """
+        Tries to insert a number of studies within one transaction (see IDicomDatabase.insert_studies).
+        """
+        return self._database.insert_studies(studies)
+
+    def update_study(self, study: Study):
+        """
+        Tries to update a study (see IDicomDatabase.update_study).
+        """
+        return self._database.update_study(study)
+
+    def upsert_studies(self, studies: Iterable[Study]) -> list[str]:
+        """
+        Inserts or updates a number of studies within one transaction (see IDicomDatabase.upsert_studies).
+        """
+        return self._database.upsert_studies(studies)
+
+    def delete_study(self, study_uid: str) -> DeletionCounts:
+        """
+        Tries to delete a study (see IDicomDatabase.delete_study).
+        """
+        return self._database.delete_study(study_uid)
+
+    def select_study(self, study_uid: str) -> Study:
+        """
+        Selects a study by StudyUID (see IDicomDatabase.select_study).
+        """
+        return self._database.select_study(study_uid)
+
+    def select_studies_to_patient(self, patient_id: str) -> list[Study]:
+        """
+        Selects the studies of a patient (see IDicomDatabase.select_studies_to_patient).
+        """
+        return self._database.select_studies_to_patient(patient_id)
+
+    def iter_studies_to_patient(self, patient_id: str, batch_size: int = 256) -> Iterator[Study]:
+        """
+        Iterates lazily over the studies of a patient (see IDicomDatabase.iter_studies_to_patient).
+        """
+        return self._database.iter_studies_to_patient(patient_id, batch_size)
+
+    def select_studies(self, study_filter: StudyFilter, limit: int = None) -> list[Study]:
+        """
+        Selects the studies meeting a filter (see IDicomDatabase.select_studies).
+        """
+        return self._database.select_studies(study_filter, limit)
+
+    def select_studies_page(self, after_key: str = None, page_size: int = 50,
+                            order_by: str = "study_uid") -> tuple[list[Study], str]:
+        """
+        Selects a page of studies using keyset pagination (see IDicomDatabase.select_studies_page).
+        """
+        return self._database.select_studies_page(after_key, page_size, order_by)
+    # endregion
+
+    # region Series Management
+    def insert_series(self, series: Series):
+        """
+        Tries to insert a series (see IDicomDatabase.insert_series).
+        """
+        return self._database.insert_series(series)
+
+    def insert_series_many(self, seriez: Iterable[Series]) -> list[str]:
+        """
+        Tries to insert a number of series within one transaction (see IDicomDatabase.insert_series_many).
+        """
+        return self._database.insert_series_many(seriez)
+
+    def update_series(self, series: Series):
+        """
+        Tries to update a study (see IDicomDatabase.update_series).
+        """
+        return self._database.update_series(series)
+
+    def upsert_series_many(self, seriez: Iterable[Series]) -> list[str]:
+        """
+        Inserts or updates a number of series within one transaction (see IDicomDatabase.upsert_series_many).
+        """
+        return self._database.upsert_series_many(seriez)
+
+    def delete_series(self, series_uid: str) -> DeletionCounts:
+        """
+        Tries to delete a series (see IDicomDatabase.delete_series).
+        """
+        return self._database.delete_series(series_uid)
+
+    def select_series(self, series_uid: str) -> Series:
+        """
+        Selects a series by SeriesUID (see IDicomDatabase.select_series).
+        """
+        return self._database.select_series(series_uid)
+
+    def select_series_to_study(self, study_uid: str) -> list[Series]:
+        """
+        Selects the series of a study (see IDicomDatabase.select_series_to_study).
+        """
+        return self._database.select_series_to_study(study_uid)
+
+    def iter_series_to_study(self, study_uid: str, batch_size: int = 256) -> Iterator[Series]:
+        """
+        Iterates lazily over the series of a study (see IDicomDatabase.iter_series_to_study).
+        """
+        return self._database.iter_series_to_study(study_uid, batch_size)
+
+    def select_series_by_filter(self, series_filter: SeriesFilter, limit: int = None) -> list[Series]:
+        """
+        Selects the series meeting a filter (see IDicomDatabase.select_series_by_filter).
+        """
+        return self._database.select_series_by_filter(series_filter, limit)
+
+    def select_series_page(self, after_key: str = None, page_size: int = 50,
+                           order_by: str = "series_uid") -> tuple[list[Series], str]:
+        """
+        Selects a page of series using keyset pagination (see IDicomDatabase.select_series_page).
+        """
+        return self._database.select_series_page(after_key, page_size, order_by)
+    # endregion
+
+    # region Instance Management
+    def insert_instance(self, instance: Instance):
+        """
+        Tries to insert an instance (see IDicomDatabase.insert_instance).
+        """
+        return self._database.insert_instance(instance)
+
+    def insert_instances(self, instances: Iterable[Instance]) -> list[str]:
+        """
+        Tries to insert a number of instances within one transaction (see IDicomDatabase.insert_instances).
+        """
+        return self._database.insert_instances(instances)
+
+    def update_instance(self, instance: Instance):
+        """
+        Tries to update an instance (see IDicomDatabase.update_instance).
+        """
+        return self._database.update_instance(instance)
+
+    def upsert_instances(self, instances: Iterable[Instance]) -> list[str]:
+        """
+        Inserts or updates a number of instances within one transaction (see IDicomDatabase.upsert_instances).
+        """
+        return self._database.upsert_instances(instances)
+
+    def update_instance_file_names(self, file_names: dict[str, str]) -> list[str]:
+        """
+        Records the files of a number of instances within one transaction
+        (see IDicomDatabase.update_instance_file_names).
+        """
+        return self._database.update_instance_file_names(file_names)
+
+    def delete_instance(self, instance_uid: str):
+        """
+        Tries to delete an instance (see IDicomDatabase.delete_instance).
+        """
+        return self._database.delete_instance(instance_uid)
+
+    def delete_instances_of_series(self, series_uid: str):
+        """
+        Deletes all instances of a series (see IDicomDatabase.delete_instances_of_series).
+        """
+        return self._database.delete_instances_of_series(series_uid)
+
+    def select_instance(self, instance_uid: str) -> Instance:
+        """
+        Selects an instance by InstanceUID (see IDicomDatabase.select_instance).
+        """
+        return self._database.select_instance(instance_uid)
+
+    def select_instances_to_series(self, series_uid: str) -> list[Instance]:
+        """
+        Selects the instances of a series (see IDicomDatabase.select_instances_to_series).
+        """
+        return self._database.select_instances_to_series(series_uid)
+
+    def iter_instances_to_series(self, series_uid: str, batch_size: int = 256) -> Iterator[Instance]:
+        """
+        Iterates lazily over the instances of a series (see IDicomDatabase.iter_instances_to_series).
+        """
+        return self._database.iter_instances_to_series(series_uid, batch_size)
+    # endregion
+
+    # region Hierarchy Selection
+    def select_patient_tree(self, patient_id: str) -> Patient:
+        """
+        Selects a patient with all its studies, series and instances (see IDicomDatabase.select_patient_tree).
+        """
+        return self._database.select_patient_tree(patient_id)
+
+    def select_study_tree(self, study_uid: str) -> Study:
+        """
+        Selects a study with its patient, series and instances (see IDicomDatabase.select_study_tree).
+        """
+        return self._database.select_study_tree(study_uid)
+    # endregion
+
+    # region Aggregation
+    def count_studies_to_patient(self, patient_id: str) -> int:
+        """
+        Counts the studies of a patient (see IDicomDatabase.count_studies_to_patient).
+        """
+        return self._database.count_studies_to_patient(patient_id)
+
+    def count_series_to_study(self, study_uid: str) -> int:
+        """
+        Counts the series of a study (see IDicomDatabase.count_series_to_study).
+        """
+        return self._database.count_series_to_study(study_uid)
+
+    def count_instances_to_series(self, series_uid: str) -> int:
+        """
+        Counts the instances of a series (see IDicomDatabase.count_instances_to_series).
+        """
+        return self._database.count_instances_to_series(series_uid)
+
+    def study_summary(self, study_uid: str) -> StudySummary:
+        """
+        Summarizes the series and instances of a study (see IDicomDatabase.study_summary).
+        """
+        return self._database.study_summary(study_uid)
+    # endregion
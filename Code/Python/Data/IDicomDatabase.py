@@ -1,6 +1,41 @@
-from datetime import date
+from datetime import date, datetime
+from typing import Iterable, Iterator, NamedTuple
 from Taxons.Patient import Patient, Study
 from Taxons.Series import Series, Instance
+from enumerations import Modality, AnatomicRegion
+
+# Numbers of rows removed by a deletion, including the deleted subtree
+DeletionCounts = NamedTuple('DeletionCounts', [('patients', int), ('studies', int), ('series', int),
+                                               ('instances', int)])
+
+# Aggregates of a study: numbers of series and instances, modalities of the series and bounds of their datetimes
+StudySummary = NamedTuple('StudySummary', [('number_of_series', int), ('number_of_instances', int),
+                                           ('modalities', frozenset[Modality]), ('first_series_datetime', datetime),
+                                           ('last_series_datetime', datetime)])
+
+
+class StudyFilter(NamedTuple):
+    """
+    Criteria of select_studies; all given criteria must be met, a criterion of None does not restrict.
+    """
+    patient_id: str = None
+    datetime_from: datetime = None          # inclusive
+    datetime_to: datetime = None            # inclusive
+    anatomic_region: AnatomicRegion = None
+    institution_name: str = None
+    accession_number: str = None
+    modality: Modality = None               # the study has at least one series of the modality
+
+
+class SeriesFilter(NamedTuple):
+    """
+    Criteria of select_series_by_filter; all given criteria must be met, a criterion of None does not restrict.
+    """
+    study_uid: str = None
+    datetime_from: datetime = None          # inclusive
+    datetime_to: datetime = None            # inclusive
+    modality: Modality = None
+
 
 class IDicomDatabase:
     """
@@ -17,7 +52,14 @@ class IDicomDatabase:
 
     def close(self):
         """
-        Closes the database.
+        Closes the database. The data are kept.
+        :return: None
+        """
+        pass
+
+    def reset(self):
+        """
+        Removes all data from the database.
         :return: None
         """
         pass
@@ -33,6 +75,15 @@ class IDicomDatabase:
         """
         pass
 
+    def insert_patients(self, patients: Iterable[Patient]) -> list[str]:
+        """
+        Tries to insert a number of patients within one transaction.
+        :param patients: The patients to insert.
+        :return: List of PatientID's of the patients that could not be inserted.
+                 If this list was empty, the operation completely succeeded.
+        """
+        pass
+
     def update_patient(self, patient: Patient):
         """
         Tries to update a patient.
@@ -42,11 +93,20 @@ class IDicomDatabase:
         """
         pass
 
-    def delete_patient(self, patient_id: str):
+    def upsert_patients(self, patients: Iterable[Patient]) -> list[str]:
         """
-        Tries to delete a patient.
+        Inserts or updates a number of patients within one transaction.
+        :param patients: The patients to insert or update.
+        :return: List of PatientID's of the patients that could not be written.
+                 If this list was empty, the operation completely succeeded.
+        """
+        pass
+
+    def delete_patient(self, patient_id: str) -> DeletionCounts:
+        """
+        Tries to delete a patient together with its studies, series and instances.
         :param patient_id: The PatientID of the patient to delete.
-        :return: None.
+        :return: The numbers of rows removed.
         :exception: KeyError, if the PatientID was not present.
         """
         pass
@@ -90,6 +150,47 @@ class IDicomDatabase:
         :return: The list of all patients selected.
         """
         pass
+
+    def iter_patients_by_name_pattern(self, name_pattern: str, batch_size: int = 256) -> Iterator[Patient]:
+        """
+        Iterates lazily over the patients with the names fulfilling a pattern.
+        :param name_pattern: The name pattern to select by.
+        :param batch_size: The number of rows fetched from the database at once.
+        :return: An iterator over the patients.
+        """
+        pass
+
+    def iter_patients_by_date_of_birth(self, dob_from: date, dob_to: date, batch_size: int = 256) -> Iterator[Patient]:
+        """
+        Iterates lazily over the patients with the dates of birth within an interval.
+        :param dob_from:  The starting date (inclusive).
+        :param dob_to: The finishing date (inclusive).
+        :param batch_size: The number of rows fetched from the database at once.
+        :return: An iterator over the patients.
+        """
+        pass
+
+    def iter_all_patients(self, batch_size: int = 256) -> Iterator[Patient]:
+        """
+        Iterates lazily over all patients.
+        :param batch_size: The number of rows fetched from the database at once.
+        :return: An iterator over the patients.
+        """
+        pass
+
+    def select_patients_page(self, after_key: str = None, page_size: int = 50,
+                             order_by: str = "patient_id") -> tuple[list[Patient], str]:
+        """
+        Selects a page of patients using keyset pagination.
+        :param after_key: The continuation token returned with the previous page, or None for the first page.
+        :param page_size: The maximal number of patients in the page.
+        :param order_by: The column to order by: 'patient_id', 'patient_name' or 'patient_date_of_birth'.
+        :return: The patients of the page and the continuation token for the next page
+                 (None, if there are no more patients).
+        :exception: ValueError, if the page size is less than 1, the ordering is not supported
+                    or the token does not belong to it.
+        """
+        pass
     # endregion
 
     # region Study Management
@@ -102,6 +203,15 @@ class IDicomDatabase:
         """
         pass
 
+    def insert_studies(self, studies: Iterable[Study]) -> list[str]:
+        """
+        Tries to insert a number of studies within one transaction.
+        :param studies: The studies to insert. Each must be valid (i.e. have a valid Patient reference).
+        :return: List of StudyUID's of the studies that could not be inserted.
+                 If this list was empty, the operation completely succeeded.
+        """
+        pass
+
     def update_study(self, study: Study):
         """
         Tries to update a study.
@@ -111,11 +221,20 @@ class IDicomDatabase:
         """
         pass
 
-    def delete_study(self, study_uid: str):
+    def upsert_studies(self, studies: Iterable[Study]) -> list[str]:
+        """
+        Inserts or updates a number of studies within one transaction.
+        :param studies: The studies to insert or update.
+        :return: List of StudyUID's of the studies that could not be written.
+                 If this list was empty, the operation completely succeeded.
+        """
+        pass
+
+    def delete_study(self, study_uid: str) -> DeletionCounts:
         """
-        Tries to delete a study.
+        Tries to delete a study together with its series and instances.
         :param study_uid: Tue UID of the study to delete.
-        :return: None.
+        :return: The numbers of rows removed.
         :exception: KeyError, if the StudyUID was not present.
         """
         pass
@@ -136,6 +255,38 @@ class IDicomDatabase:
         :exception: KeyError, if the PatientID was not present.
         """
         pass
+
+    def iter_studies_to_patient(self, patient_id: str, batch_size: int = 256) -> Iterator[Study]:
+        """
+        Iterates lazily over the studies of a patient.
+        :param patient_id: The PatientID of the patient.
+        :param batch_size: The number of rows fetched from the database at once.
+        :return: An iterator over the studies.
+        """
+        pass
+
+    def select_studies(self, study_filter: StudyFilter, limit: int = None) -> list[Study]:
+        """
+        Selects the studies meeting a filter, ordered by StudyDateTime.
+        :param study_filter: The criteria of the studies.
+        :param limit: The maximal number of studies to select, or None for all.
+        :return: A list of the studies. An empty list if none were found.
+        """
+        pass
+
+    def select_studies_page(self, after_key: str = None, page_size: int = 50,
+                            order_by: str = "study_uid") -> tuple[list[Study], str]:
+        """
+        Selects a page of studies using keyset pagination.
+        :param after_key: The continuation token returned with the previous page, or None for the first page.
+        :param page_size: The maximal number of studies in the page.
+        :param order_by: The column to order by: 'study_uid' or 'study_datetime'.
+        :return: The studies of the page and the continuation token for the next page
+                 (None, if there are no more studies).
+        :exception: ValueError, if the page size is less than 1, the ordering is not supported
+                    or the token does not belong to it.
+        """
+        pass
     # endregion
 
     # region Series Management
@@ -148,6 +299,15 @@ class IDicomDatabase:
         """
         pass
 
+    def insert_series_many(self, seriez: Iterable[Series]) -> list[str]:
+        """
+        Tries to insert a number of series within one transaction.
+        :param seriez: The series to insert. Each must be valid (i.e. have a valid Study reference).
+        :return: List of SeriesUID's of the series that could not be inserted.
+                 If this list was empty, the operation completely succeeded.
+        """
+        pass
+
     def update_series(self, series: Series):
         """
         Tries to update a study.
@@ -157,11 +317,20 @@ class IDicomDatabase:
         """
         pass
 
-    def delete_series(self, series_uid: str):
+    def upsert_series_many(self, seriez: Iterable[Series]) -> list[str]:
+        """
+        Inserts or updates a number of series within one transaction.
+        :param seriez: The series to insert or update.
+        :return: List of SeriesUID's of the series that could not be written.
+                 If this list was empty, the operation completely succeeded.
+        """
+        pass
+
+    def delete_series(self, series_uid: str) -> DeletionCounts:
         """
-        Tries to delete a series.
+        Tries to delete a series together with its instances.
         :param series_uid: Tue UID of the series to delete.
-        :return: None.
+        :return: The numbers of rows removed.
         :exception: KeyError, if the SeriesUID was not present.
         """
         pass
@@ -182,6 +351,38 @@ class IDicomDatabase:
         :exception: KeyError, if the StudyUID was not present.
         """
         pass
+
+    def iter_series_to_study(self, study_uid: str, batch_size: int = 256) -> Iterator[Series]:
+        """
+        Iterates lazily over the series of a study.
+        :param study_uid: The StudyUID of the study.
+        :param batch_size: The number of rows fetched from the database at once.
+        :return: An iterator over the series.
+        """
+        pass
+
+    def select_series_by_filter(self, series_filter: SeriesFilter, limit: int = None) -> list[Series]:
+        """
+        Selects the series meeting a filter, ordered by SeriesDateTime.
+        :param series_filter: The criteria of the series.
+        :param limit: The maximal number of series to select, or None for all.
+        :return: A list of the series. An empty list if none were found.
+        """
+        pass
+
+    def select_series_page(self, after_key: str = None, page_size: int = 50,
+                           order_by: str = "series_uid") -> tuple[list[Series], str]:
+        """
+        Selects a page of series using keyset pagination.
+        :param after_key: The continuation token returned with the previous page, or None for the first page.
+        :param page_size: The maximal number of series in the page.
+        :param order_by: The column to order by: 'series_uid' or 'series_datetime'.
+        :return: The series of the page and the continuation token for the next page
+                 (None, if there are no more series).
+        :exception: ValueError, if the page size is less than 1, the ordering is not supported
+                    or the token does not belong to it.
+        """
+        pass
     # endregion
 
     # region Instance Management
@@ -194,6 +395,15 @@ class IDicomDatabase:
         """
         pass
 
+    def insert_instances(self, instances: Iterable[Instance]) -> list[str]:
+        """
+        Tries to insert a number of instances within one transaction.
+        :param instances: The instances to insert. Each must be valid (i.e. have a valid Series reference).
+        :return: List of InstanceUID's of the instances that could not be inserted.
+                 If this list was empty, the operation completely succeeded.
+        """
+        pass
+
     def update_instance(self, instance: Instance):
         """
         Tries to update an instance.
@@ -203,6 +413,24 @@ class IDicomDatabase:
         """
         pass
 
+    def upsert_instances(self, instances: Iterable[Instance]) -> list[str]:
+        """
+        Inserts or updates a number of instances within one transaction.
+        :param instances: The instances to insert or update.
+        :return: List of InstanceUID's of the instances that could not be written.
+                 If this list was empty, the operation completely succeeded.
+        """
+        pass
+
+    def update_instance_file_names(self, file_names: dict[str, str]) -> list[str]:
+        """
+        Records the files of a number of instances (e.g. after storing their datasets) within one transaction.
+        :param file_names: Key: the InstanceUID; Value: the file name of the instance.
+        :return: List of InstanceUID's of the instances that are not present.
+                 If this list was empty, the operation completely succeeded.
+        """
+        pass
+
     def delete_instance(self, instance_uid: str):
         """
         Tries to delete an instance.
@@ -237,4 +465,65 @@ class IDicomDatabase:
         :exception: KeyError, if the SeriesUID was not present.
         """
         pass
+
+    def iter_instances_to_series(self, series_uid: str, batch_size: int = 256) -> Iterator[Instance]:
+        """
+        Iterates lazily over the instances of a series.
+        :param series_uid: The SeriesUID of the series.
+        :param batch_size: The number of rows fetched from the database at once.
+        :return: An iterator over the instances.
+        """
+        pass
+    # endregion
+
+    # region Hierarchy Selection
+    def select_patient_tree(self, patient_id: str) -> Patient:
+        """
+        Selects a patient together with all its studies, series and instances.
+        :param patient_id: The PatientID of the patient to select.
+        :return: The patient with its studies, series and instances linked, if found, otherwise None.
+        """
+        pass
+
+    def select_study_tree(self, study_uid: str) -> Study:
+        """
+        Selects a study together with its patient and all its series and instances.
+        :param study_uid: The StudyUID of the study to select.
+        :return: The study with its patient, series and instances linked, if found, otherwise None.
+        """
+        pass
+    # endregion
+
+    # region Aggregation
+    def count_studies_to_patient(self, patient_id: str) -> int:
+        """
+        Counts the studies of a patient.
+        :param patient_id: The PatientID of the patient.
+        :return: The number of studies of the patient; 0, if the PatientID is not present.
+        """
+        pass
+
+    def count_series_to_study(self, study_uid: str) -> int:
+        """
+        Counts the series of a study.
+        :param study_uid: The StudyUID of the study.
+        :return: The number of series of the study; 0, if the StudyUID is not present.
+        """
+        pass
+
+    def count_instances_to_series(self, series_uid: str) -> int:
+        """
+        Counts the instances of a series.
+        :param series_uid: The SeriesUID of the series.
+        :return: The number of instances of the series; 0, if the SeriesUID is not present.
+        """
+        pass
+
+    def study_summary(self, study_uid: str) -> StudySummary:
+        """
+        Summarizes the series and instances of a study.
+        :param study_uid: The StudyUID of the study.
+        :return: The summary of the study, if found, otherwise None.
+        """
+        pass
     # endregion
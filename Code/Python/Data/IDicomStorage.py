@@ -1,6 +1,11 @@
 import pydicom as dicom
+from typing import Iterable, NamedTuple
 from Taxons.Series import Series, Instance
 
+# Outcome of storing one dataset: the file name, if the file was written, and the exception, if the storage or its
+# entry into the database failed (the InstanceUID is None, if the dataset has none)
+StoreResult = NamedTuple('StoreResult', [('instance_uid', str), ('file_name', str), ('error', Exception)])
+
 
 class IDicomStorage:
     """
@@ -54,6 +59,16 @@ class IDicomStorage:
         """
         pass
 
+    def store_datasets(self, datasets: Iterable[dicom.Dataset], workers: int = 4) -> list[StoreResult]:
+        """
+        Stores a number of DICOM datasets in the file system in parallel (see store_dataset), and makes the
+        entries into the database ('file_name') at once.
+        :param datasets: The datasets to store.
+        :param workers: The number of datasets stored at the same time.
+        :return: The results, in the order of the datasets.
+        """
+        pass
+
     def get_dataset(self, file_path: str) -> dicom.dataset:
         """
         Tries to retrieve a dataset from the file system.
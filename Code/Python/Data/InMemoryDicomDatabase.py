@@ -0,0 +1,923 @@
+import bisect
+import re
+import threading
+from datetime import date
+from enum import Enum
+from typing import Iterable, Iterator, Callable, Any, NamedTuple
+from Data.BasicDicomDatabase import BasicDicomDatabase, _encode_date, _encode_datetime, _decode_datetime
+from Data.IDicomDatabase import IDicomDatabase, DeletionCounts, StudySummary, StudyFilter, SeriesFilter
+from Taxons.Patient import Patient, Study
+from Taxons.Series import Series, Instance
+
+
+class _SortedIndex:
+    """
+    Secondary index keeping (value, key) entries in ascending order; entries with a value of None come first,
+    as sqlite orders NULL. Lookups are binary searches, insertions and removals shift the entries behind.
+    """
+    def __init__(self):
+        self._entries: list[tuple] = []
+
+    @staticmethod
+    def entry(value: Any, key: str) -> tuple:
+        return (False, 0, key) if value is None else (True, value, key)
+
+    def add(self, value: Any, key: str):
+        bisect.insort(self._entries, self.entry(value, key))
+
+    def remove(self, value: Any, key: str):
+        entry = self.entry(value, key)
+        index = bisect.bisect_left(self._entries, entry)
+
+        if index < len(self._entries) and self._entries[index] == entry:
+            del self._entries[index]
+
+    def clear(self):
+        self._entries.clear()
+
+    def keys_after(self, value: Any, key: str, count: int) -> list[str]:
+        """
+        Gets the keys of the entries following an entry.
+        :param value: The value of the entry.
+        :param key: The key of the entry, or None to start with the first entry.
+        :param count: The maximal number of keys.
+        :return: The keys in the order of the index.
+        """
+        start = 0 if key is None else bisect.bisect_right(self._entries, self.entry(value, key))
+        return [entry[2] for entry in self._entries[start:start + count]]
+
+    def keys_between(self, low: Any, high: Any) -> list[str]:
+        """
+        Gets the keys of the entries with values within an interval; entries with a value of None are only
+        included if the interval is unbounded.
+        :param low: The lower bound (inclusive), or None.
+        :param high: The upper bound (inclusive), or None.
+        :return: The keys in the order of the index.
+        """
+        if low is None and high is None:
+            return [entry[2] for entry in self._entries]
+
+        start = bisect.bisect_left(self._entries, (True,)) if low is None else \
+            bisect.bisect_left(self._entries, (True, low))
+        stop = len(self._entries) if high is None else \
+            bisect.bisect_right(self._entries, (True, high), key=lambda entry: entry[:2])
+
+        return [entry[2] for entry in self._entries[start:stop]]
+
+
+class _Table:
+    """
+    Rows of one taxon type with a hash index on the primary key, a hash index on the parent key
+    and sorted indexes on the columns the pages are ordered by.
+    The rows are dictionaries in the format of the rows fetched by BasicDicomDatabase; a stored row is never modified.
+    """
+    def __init__(self, name: str, columns: list[str], parent: "_Table" = None):
+        key, orderings = BasicDicomDatabase._page_orderings.get(name, (columns[0], []))
+
+        self.name = name
+        self.columns = columns
+        self.key = key
+        self.parent = parent
+        self.parent_key = None if parent is None else parent.key
+        self.rows: dict[str, dict] = {}
+        self.children: dict[str, dict[str, None]] = {}      # Key: parent key; Value: the keys, in insertion order
+        self.sorted = {column: _SortedIndex() for column in orderings}
+
+    def put(self, row: dict, replace: bool):
+        """
+        Inserts a row or replaces the row with its key.
+        :param row: The row.
+        :param replace: If False, a row with the key must not be present.
+        :return: None
+        :exception: KeyError, if the key is already present (and replace is False) or the parent is not present.
+        """
+        key = row[self.key]
+        old = self.rows.get(key)
+
+        if old is not None and not replace:
+            raise KeyError(f"{self.name} {key} is already present")
+
+        if self.parent is not None and row[self.parent_key] not in self.parent.rows:
+            raise KeyError(f"{self.parent.name} {row[self.parent_key]} of {self.name} {key} is not present")
+
+        if old == row:
+            return
+
+        if old is not None:
+            self._unindex(old)
+
+        self.rows[key] = row
+        self._index(row)
+
+    def remove(self, key: str) -> bool:
+        row = self.rows.pop(key, None)
+
+        if row is not None:
+            self._unindex(row)
+
+        return row is not None
+
+    def keys_of(self, parent_key: str) -> list[str]:
+        return list(self.children.get(parent_key, ()))
+
+    def clear(self):
+        self.rows.clear()
+        self.children.clear()
+
+        for index in self.sorted.values():
+            index.clear()
+
+    def _index(self, row: dict):
+        key = row[self.key]
+
+        if self.parent is not None:
+            self.children.setdefault(row[self.parent_key], {})[key] = None
+
+        for column, index in self.sorted.items():
+            index.add(row[column], key)
+
+    def _unindex(self, row: dict):
+        key = row[self.key]
+
+        if self.parent is not None:
+            keys = self.children.get(row[self.parent_key])
+
+            if keys is not None:
+                keys.pop(key, None)
+
+                if len(keys) == 0:
+                    del self.children[row[self.parent_key]]
+
+        for column, index in self.sorted.items():
+            index.remove(row[column], key)
+
+
+def _like_expression(pattern: str) -> re.Pattern:
+    """
+    Translates an SQL LIKE pattern into a regular expression: % matches any text, _ any character,
+    and only ASCII letters are compared case-insensitively.
+    """
+    parts = [".*" if c == "%" else "." if c == "_" else re.escape(c) for c in pattern]
+    return re.compile("".join(parts), re.IGNORECASE | re.ASCII | re.DOTALL)
+
+
+class InMemoryDicomDatabase(IDicomDatabase):
+    """
+    IDicomDatabase keeping all data in memory, for tests and short-lived batch conversions that need no persistence.
+    Rows are stored in the encoding of BasicDicomDatabase and decoded by its methods, so both implementations
+    return the same objects:
+    - hash indexes on the primary keys and on the parent keys answer the selections by key and the hierarchy;
+    - sorted indexes on the date of birth, the patient name and the datetimes answer the range queries and pages.
+    Name patterns have the semantics of LIKE '%pattern%' and scan the patient names.
+    The data can be written into a sqlite database file when the database is closed (snapshot).
+    All methods may be called from several threads; each call is atomic.
+    """
+
+    # region Construction
+    def __init__(self, snapshot: bool = False):
+        """
+        Creates an instance of InMemoryDicomDatabase.
+        :param snapshot: If True, close() writes the data into the database file passed to open(),
+                         replacing its contents.
+        """
+        self._snapshot = snapshot
+        self._database_file_name: str = None
+        self._lock = threading.RLock()
+
+        self._patients = _Table("patient", BasicDicomDatabase._columns_patient)
+        self._studies = _Table("study", BasicDicomDatabase._columns_study, self._patients)
+        self._seriez = _Table("series", BasicDicomDatabase._columns_series, self._studies)
+        self._instances = _Table("instance", BasicDicomDatabase._columns_instance, self._seriez)
+    # endregion
+
+    # region General Management
+    def open(self, database_file_name: str):
+        """
+        Opens the database. The database file is not read; it is only written by snapshots.
+        :param database_file_name: The path to the database file the snapshots are written to.
+        :return None:
+        """
+        self._database_file_name = database_file_name
+
+    def close(self):
+        """
+        Closes the database, writing a snapshot if requested on construction. The data are kept in memory.
+        :return: None
+        """
+        if self._snapshot and self._database_file_name is not None:
+            self.snapshot(self._database_file_name)
+
+    def reset(self):
+        """
+        Removes all data.
+        :return: None
+        """
+        with self._lock:
+            for table in [self._instances, self._seriez, self._studies, self._patients]:
+                table.clear()
+
+    def snapshot(self, database_file_name: str):
+        """
+        Writes all data into a sqlite database file (see BasicDicomDatabase) within one transaction.
+        The previous contents of the file are removed.
+        :param database_file_name: The path to the database file.
+        :return: None
+        :exception: ValueError, if rows could not be written.
+        """
+        with self._lock:
+            tables = [(table, list(table.rows.values()))
+                      for table in [self._patients, self._studies, self._seriez, self._instances]]
+
+        database = BasicDicomDatabase(profile="throughput")
+        database.open(database_file_name)
+
+        try:
+            database.reset()
+
+            with database.transaction():
+                for table, rows in tables:
+                    # parents are written before their children, so the foreign keys are met
+                    failures = database._write_many(f"insert_{table.name}", rows,
+                                                    lambda row: row[table.key], lambda row: tuple(row.values()))
+
+                    if len(failures) > 0:
+                        raise ValueError(f"snapshot failed: {len(failures)} rows of {table.name} not written")
+        finally:
+            database.close()
+    # endregion
+
+    # region Patient Management
+    def insert_patient(self, patient: Patient):
+        """
+        Tries to insert a patient.
+        :param patient: The patient to insert.
+        :return: None.
+        :exception: KeyError, if the PatientID is already present in the DB.
+        """
+        self._put(self._patients, BasicDicomDatabase._patient_row(patient), False)
+
+    def insert_patients(self, patients: Iterable[Patient]) -> list[str]:
+        """
+        Tries to insert a number of patients.
+        :param patients: The patients to insert.
+        :return: List of PatientID's of the patients that could not be inserted.
+                 If this list was empty, the operation completely succeeded.
+        """
+        return self._put_many(self._patients, patients, lambda patient: patient.patient_id,
+                              BasicDicomDatabase._patient_row, False)
+
+    def update_patient(self, patient: Patient):
+        """
+        Updates a patient; if the PatientID is not yet present, the patient is inserted.
+        :param patient: An instance of the Patient class with the PatientID of the patient to update (and some new data).
+        :return: None.
+        """
+        self._put(self._patients, BasicDicomDatabase._patient_row(patient), True)
+
+    def upsert_patients(self, patients: Iterable[Patient]) -> list[str]:
+        """
+        Inserts or updates a number of patients.
+        :param patients: The patients to insert or update.
+        :return: List of PatientID's of the patients that could not be written.
+                 If this list was empty, the operation completely succeeded.
+        """
+        return self._put_many(self._patients, patients, lambda patient: patient.patient_id,
+                              BasicDicomDatabase._patient_row, True)
+
+    def delete_patient(self, patient_id: str) -> DeletionCounts:
+        """
+        Tries to delete a patient together with its studies, series and instances.
+        :param patient_id: The PatientID of the patient to delete.
+        :return: The numbers of rows removed.
+        """
+        with self._lock:
+            study_uids = self._studies.keys_of(patient_id)
+            counts = self._delete_studies(study_uids)
+
+            return DeletionCounts(int(self._patients.remove(patient_id)), *counts[1:])
+
+    def select_patient(self, patient_id: str) -> Patient:
+        """
+        Selects a patient by PatientID.
+        :param patient_id: The PatientID of the patient to select.
+        :return: The patient, if found, otherwise None
+        """
+        return BasicDicomDatabase._get_patient(self._patients.rows.get(patient_id))
+
+    def select_patients_by_name_pattern(self, name_pattern: str) -> list[Patient]:
+        """
+        Selects a set of patients by name pattern.
+        :param name_pattern: The name pattern to select by.
+        :return: A list of patients with the names fulfilling the pattern. An empty list if none were found.
+        """
+        return list(self.iter_patients_by_name_pattern(name_pattern))
+
+    def select_patients_by_date_of_birth(self, dob_from: date, dob_to: date) -> list[Patient]:
+        """
+        Selects a set of patients by date of birth.
+        :param dob_from:  The starting date (inclusive).
+        :param dob_to: The finishing date (inclusive).
+        :return: A list of patients with the dates of birth within the interval.
+        """
+        return list(self.iter_patients_by_date_of_birth(dob_from, dob_to))
+
+    def select_all_patients(self) -> list[Patient]:
+        """
+        Selects all patients.
+        :return: The list of all patients.
+        """
+        return list(self.iter_all_patients())
+
+    def select_patients_by_limit(self, limit: int) -> list[Patient]:
+        """
+        Selects a limited number of patients.
+        :param limit: The number of patients to select.
+        :return: The list of all patients selected.
+        """
+        with self._lock:
+            rows = list(self._patients.rows.values())
+
+        return self._decode(rows if limit < 0 else rows[:limit], BasicDicomDatabase._get_patient)
+
+    def iter_patients_by_name_pattern(self, name_pattern: str, batch_size: int = 256) -> Iterator[Patient]:
+        """
+        Iterates over the patients with the names fulfilling a pattern. The patients are selected when the iteration
+        starts and decoded lazily.
+        :param name_pattern: The name pattern to select by.
+        :param batch_size: Not used; kept for the compatibility with IDicomDatabase.
+        :return: An iterator over the patients.
+        """
+        expression = _like_expression(name_pattern)
+
+        with self._lock:
+            rows = [row for row in self._patients.rows.values()
+                    if row["patient_name"] is not None and expression.search(row["patient_name"]) is not None]
+
+        return self._iterate(rows, BasicDicomDatabase._get_patient)
+
+    def iter_patients_by_date_of_birth(self, dob_from: date, dob_to: date, batch_size: int = 256) -> Iterator[Patient]:
+        """
+        Iterates over the patients with the dates of birth within an interval, in the order of the dates of birth.
+        The patients are selected from the sorted index when the iteration starts and decoded lazily.
+        :param dob_from:  The starting date (inclusive).
+        :param dob_to: The finishing date (inclusive).
+        :param batch_size: Not used; kept for the compatibility with IDicomDatabase.
+        :return: An iterator over the patients.
+        """
+        if dob_from is None or dob_to is None:
+            return iter([])
+
+        with self._lock:
+            keys = self._patients.sorted["patient_date_of_birth"].keys_between(_encode_date(dob_from),
+                                                                               _encode_date(dob_to))
+            rows = [self._patients.rows[key] for key in keys]
+
+        return self._iterate(rows, BasicDicomDatabase._get_patient)
+
+    def iter_all_patients(self, batch_size: int = 256) -> Iterator[Patient]:
+        """
+        Iterates over all patients. The patients are selected when the iteration starts and decoded lazily.
+        :param batch_size: Not used; kept for the compatibility with IDicomDatabase.
+        :return: An iterator over the patients.
+        """
+        with self._lock:
+            rows = list(self._patients.rows.values())
+
+        return self._iterate(rows, BasicDicomDatabase._get_patient)
+
+    def select_patients_page(self, after_key: str = None, page_size: int = 50,
+                             order_by: str = "patient_id") -> tuple[list[Patient], str]:
+        """
+        Selects a page of patients from a sorted index (see IDicomDatabase.select_patients_page).
+        The continuation tokens are those of BasicDicomDatabase.
+        """
+        return self._select_page(self._patients, after_key, page_size, order_by, BasicDicomDatabase._get_patient)
+    # endregion
+
+    # region Study Management
+    def insert_study(self, study: Study):
+        """
+        Tries to insert a study.
+        :param study: The study to insert. Must be valid (i.e. have a valid Patient reference).
+        :return: None.
+        :exception: KeyError if the studyUID was already present or if the patient is not yet in the DB.
+        """
+        self._put(self._studies, BasicDicomDatabase._study_row(study), False)
+
+    def insert_studies(self, studies: Iterable[Study]) -> list[str]:
+        """
+        Tries to insert a number of studies.
+        :param studies: The studies to insert. Each must be valid (i.e. have a valid Patient reference).
+        :return: List of StudyUID's of the studies that could not be inserted.
+                 If this list was empty, the operation completely succeeded.
+        """
+        return self._put_many(self._studies, studies, lambda study: study.study_uid,
+                              BasicDicomDatabase._study_row, False)
+
+    def update_study(self, study: Study):
+        """
+        Updates a study; if the StudyUID is not yet present, the study is inserted.
+        :param study: An instance of the Study class with the StudyUID of the study to update (and some new data).
+        :return: None.
+        :exception: KeyError, if the patient is not in the DB.
+        """
+        self._put(self._studies, BasicDicomDatabase._study_row(study), True)
+
+    def upsert_studies(self, studies: Iterable[Study]) -> list[str]:
+        """
+        Inserts or updates a number of studies.
+        :param studies: The studies to insert or update.
+        :return: List of StudyUID's of the studies that could not be written.
+                 If this list was empty, the operation completely succeeded.
+        """
+        return self._put_many(self._studies, studies, lambda study: study.study_uid,
+                              BasicDicomDatabase._study_row, True)
+
+    def delete_study(self, study_uid: str) -> DeletionCounts:
+        """
+        Tries to delete a study together with its series and instances.
+        :param study_uid: Tue UID of the study to delete.
+        :return: The numbers of rows removed.
+        """
+        with self._lock:
+            return self._delete_studies([study_uid])
+
+    def select_study(self, study_uid: str) -> Study:
+        """
+        Selects a study by StudyUID.
+        :param study_uid: The StudyUID of the study to select.
+        :return: The study, if found, otherwise None
+        """
+        return BasicDicomDatabase._get_study(self._studies.rows.get(study_uid))
+
+    def select_studies_to_patient(self, patient_id: str) -> list[Study]:
+        """
+        Selects the studies of a patient.
+        :param patient_id: The PatientID of the patient.
+        :return: A list of studies of the patient.
+        """
+        return list(self.iter_studies_to_patient(patient_id))
+
+    def iter_studies_to_patient(self, patient_id: str, batch_size: int = 256) -> Iterator[Study]:
+        """
+        Iterates over the studies of a patient. The studies are selected when the iteration starts and decoded lazily.
+        :param patient_id: The PatientID of the patient.
+        :param batch_size: Not used; kept for the compatibility with IDicomDatabase.
+        :return: An iterator over the studies.
+        """
+        return self._iterate(self._children(self._studies, patient_id), BasicDicomDatabase._get_study)
+
+    def select_studies(self, study_filter: StudyFilter, limit: int = None) -> list[Study]:
+        """
+        Selects the studies meeting a filter, ordered by StudyDateTime (see IDicomDatabase.select_studies).
+        """
+        return self._select_filtered(self._studies, "study_datetime", study_filter, limit,
+                                     BasicDicomDatabase._get_study)
+
+    def select_studies_page(self, after_key: str = None, page_size: int = 50,
+                            order_by: str = "study_uid") -> tuple[list[Study], str]:
+        """
+        Selects a page of studies from a sorted index (see IDicomDatabase.select_studies_page).
+        """
+        return self._select_page(self._studies, after_key, page_size, order_by, BasicDicomDatabase._get_study)
+    # endregion
+
+    # region Series Management
+    def insert_series(self, series: Series):
+        """
+        Tries to insert a series.
+        :param series: The series to insert. Must be valid (i.e. have a valid Study reference).
+        :return: None.
+        :exception: KeyError if the SeriesUID was already present or if the study is not yet in the DB.
+        """
+        self._put(self._seriez, BasicDicomDatabase._series_row(series), False)
+
+    def insert_series_many(self, seriez: Iterable[Series]) -> list[str]:
+        """
+        Tries to insert a number of series.
+        :param seriez: The series to insert. Each must be valid (i.e. have a valid Study reference).
+        :return: List of SeriesUID's of the series that could not be inserted.
+                 If this list was empty, the operation completely succeeded.
+        """
+        return self._put_many(self._seriez, seriez, lambda series: series.series_uid,
+                              BasicDicomDatabase._series_row, False)
+
+    def update_series(self, series: Series):
+        """
+        Updates a series; if the SeriesUID is not yet present, the series is inserted.
+        :param series: An instance of the Series class with the SeriesUID of the series to update (and some new data).
+        :return: None.
+        :exception: KeyError, if the study is not in the DB.
+        """
+        self._put(self._seriez, BasicDicomDatabase._series_row(series), True)
+
+    def upsert_series_many(self, seriez: Iterable[Series]) -> list[str]:
+        """
+        Inserts or updates a number of series.
+        :param seriez: The series to insert or update.
+        :return: List of SeriesUID's of the series that could not be written.
+                 If this list was empty, the operation completely succeeded.
+        """
+        return self._put_many(self._seriez, seriez, lambda series: series.series_uid,
+                              BasicDicomDatabase._series_row, True)
+
+    def delete_series(self, series_uid: str) -> DeletionCounts:
+        """
+        Tries to delete a series together with its instances.
+        :param series_uid: Tue UID of the series to delete.
+        :return: The numbers of rows removed.
+        """
+        with self._lock:
+            return self._delete_seriez([series_uid])
+
+    def select_series(self, series_uid: str) -> Series:
+        """
+        Selects a series by SeriesUID.
+        :param series_uid: The SeriesUID of the series to select.
+        :return: The series, if found, otherwise None.
+        """
+        return BasicDicomDatabase._get_series(self._seriez.rows.get(series_uid))
+
+    def select_series_to_study(self, study_uid: str) -> list[Series]:
+        """
+        Selects the series of a study.
+        :param study_uid: The StudyUID of the study.
+        :return: A list of series of the study.
+        """
+        return list(self.iter_series_to_study(study_uid))
+
+    def iter_series_to_study(self, study_uid: str, batch_size: int = 256) -> Iterator[Series]:
+        """
+        Iterates over the series of a study. The series are selected when the iteration starts and decoded lazily.
+        :param study_uid: The StudyUID of the study.
+        :param batch_size: Not used; kept for the compatibility with IDicomDatabase.
+        :return: An iterator over the series.
+        """
+        return self._iterate(self._children(self._seriez, study_uid), BasicDicomDatabase._get_series)
+
+    def select_series_by_filter(self, series_filter: SeriesFilter, limit: int = None) -> list[Series]:
+        """
+        Selects the series meeting a filter, ordered by SeriesDateTime (see IDicomDatabase.select_series_by_filter).
+        """
+        return self._select_filtered(self._seriez, "series_datetime", series_filter, limit,
+                                     BasicDicomDatabase._get_series)
+
+    def select_series_page(self, after_key: str = None, page_size: int = 50,
+                           order_by: str = "series_uid") -> tuple[list[Series], str]:
+        """
+        Selects a page of series from a sorted index (see IDicomDatabase.select_series_page).
+        """
+        return self._select_page(self._seriez, after_key, page_size, order_by, BasicDicomDatabase._get_series)
+    # endregion
+
+    # region Instance Management
+    def insert_instance(self, instance: Instance):
+        """
+        Tries to insert an instance.
+        :param instance: The instance to insert. Must be valid (i.e. have a valid Series reference).
+        :return: None.
+        :exception: KeyError if the InstanceUID was already present or if the series is not yet in the DB.
+        """
+        self._put(self._instances, BasicDicomDatabase._instance_row(instance), False)
+
+    def insert_instances(self, instances: Iterable[Instance]) -> list[str]:
+        """
+        Tries to insert a number of instances.
+        :param instances: The instances to insert. Each must be valid (i.e. have a valid Series reference).
+        :return: List of InstanceUID's of the instances that could not be inserted.
+                 If this list was empty, the operation completely succeeded.
+        """
+        return self._put_many(self._instances, instances, lambda instance: instance.instance_uid,
+                              BasicDicomDatabase._instance_row, False)
+
+    def update_instance(self, instance: Instance):
+        """
+        Updates an instance; if the InstanceUID is not yet present, the instance is inserted.
+        :param instance: An instance of the Instance class with the InstanceUID of the instance to update (and some new data).
+        :return: None.
+        :exception: KeyError, if the series is not in the DB.
+        """
+        self._put(self._instances, BasicDicomDatabase._instance_row(instance), True)
+
+    def upsert_instances(self, instances: Iterable[Instance]) -> list[str]:
+        """
+        Inserts or updates a number of instances.
+        :param instances: The instances to insert or update.
+        :return: List of InstanceUID's of the instances that could not be written.
+                 If this list was empty, the operation completely succeeded.
+        """
+        return self._put_many(self._instances, instances, lambda instance: instance.instance_uid,
+                              BasicDicomDatabase._instance_row, True)
+
+    def update_instance_file_names(self, file_names: dict[str, str]) -> list[str]:
+        """
+        Records the files of a number of instances.
+        :param file_names: Key: the InstanceUID; Value: the file name of the instance.
+        :return: List of InstanceUID's of the instances that are not present.
+                 If this list was empty, the operation completely succeeded.
+        """
+        failures = []
+
+        with self._lock:
+            for instance_uid, file_name in file_names.items():
+                row = self._instances.rows.get(instance_uid)
+
+                if row is None:
+                    failures.append(instance_uid)
+                else:
+                    self._instances.put({**row, "file_name": file_name}, True)
+
+        return failures
+
+    def delete_instance(self, instance_uid: str):
+        """
+        Tries to delete an instance.
+        :param instance_uid: Tue UID of the instance to delete.
+        :return: None.
+        """
+        with self._lock:
+            self._instances.remove(instance_uid)
+
+    def delete_instances_of_series(self, series_uid: str):
+        """
+        Deletes all instances of a series.
+        :param series_uid: The UID of the series whose instances to delete.
+        :return: None.
+        """
+        with self._lock:
+            for instance_uid in self._instances.keys_of(series_uid):
+                self._instances.remove(instance_uid)
+
+    def select_instance(self, instance_uid: str) -> Instance:
+        """
+        Selects an instance by InstanceUID.
+        :param instance_uid: The InstanceUID of the instance to select.
+        :return: The instance, if found, otherwise None.
+        """
+        return BasicDicomDatabase._get_instance(self._instances.rows.get(instance_uid))
+
+    def select_instances_to_series(self, series_uid: str) -> list[Instance]:
+        """
+        Selects the instances of a series.
+        :param series_uid: The SeriesUID of the series.
+        :return: A list of instance of the series.
+        """
+        return list(self.iter_instances_to_series(series_uid))
+
+    def iter_instances_to_series(self, series_uid: str, batch_size: int = 256) -> Iterator[Instance]:
+        """
+        Iterates over the instances of a series. The instances are selected when the iteration starts
+        and decoded lazily.
+        :param series_uid: The SeriesUID of the series.
+        :param batch_size: Not used; kept for the compatibility with IDicomDatabase.
+        :return: An iterator over the instances.
+        """
+        return self._iterate(self._children(self._instances, series_uid), BasicDicomDatabase._get_instance)
+    # endregion
+
+    # region Hierarchy Selection
+    def select_patient_tree(self, patient_id: str) -> Patient:
+        """
+        Selects a patient together with all its studies, series and instances.
+        :param patient_id: The PatientID of the patient to select.
+        :return: The patient with its studies, series and instances linked, if found, otherwise None.
+        """
+        with self._lock:
+            patient_row = self._patients.rows.get(patient_id)
+
+            if patient_row is None:
+                return None
+
+            study_rows, series_rows, instance_rows = self._subtree(self._studies.keys_of(patient_id))
+
+        patient = BasicDicomDatabase._get_patient(patient_row)
+
+        for study in BasicDicomDatabase._link_tree(study_rows, series_rows, instance_rows):
+            patient.add_study(study)
+
+        return patient
+
+    def select_study_tree(self, study_uid: str) -> Study:
+        """
+        Selects a study together with its patient and all its series and instances.
+        :param study_uid: The StudyUID of the study to select.
+        :return: The study with its patient, series and instances linked, if found, otherwise None.
+        """
+        with self._lock:
+            study_rows, series_rows, instance_rows = self._subtree([study_uid])
+
+            if len(study_rows) == 0:
+                return None
+
+            patient_row = self._patients.rows.get(study_rows[0]["patient_id"])
+
+        study = BasicDicomDatabase._link_tree(study_rows, series_rows, instance_rows)[0]
+        patient = BasicDicomDatabase._get_patient(patient_row)
+
+        if patient is not None:
+            patient.add_study(study)
+
+        return study
+    # endregion
+
+    # region Aggregation
+    def count_studies_to_patient(self, patient_id: str) -> int:
+        """
+        Counts the studies of a patient.
+        :param patient_id: The PatientID of the patient.
+        :return: The number of studies of the patient; 0, if the PatientID is not present.
+        """
+        return len(self._studies.children.get(patient_id, ()))
+
+    def count_series_to_study(self, study_uid: str) -> int:
+        """
+        Counts the series of a study.
+        :param study_uid: The StudyUID of the study.
+        :return: The number of series of the study; 0, if the StudyUID is not present.
+        """
+        return len(self._seriez.children.get(study_uid, ()))
+
+    def count_instances_to_series(self, series_uid: str) -> int:
+        """
+        Counts the instances of a series.
+        :param series_uid: The SeriesUID of the series.
+        :return: The number of instances of the series; 0, if the SeriesUID is not present.
+        """
+        return len(self._instances.children.get(series_uid, ()))
+
+    def study_summary(self, study_uid: str) -> StudySummary:
+        """
+        Summarizes the series and instances of a study.
+        :param study_uid: The StudyUID of the study.
+        :return: The summary of the study, if found, otherwise None.
+        """
+        with self._lock:
+            if study_uid not in self._studies.rows:
+                return None
+
+            series_rows = [self._seriez.rows[key] for key in self._seriez.keys_of(study_uid)]
+            number_of_instances = sum(len(self._instances.children.get(row["series_uid"], ()))
+                                      for row in series_rows)
+
+        modalities = frozenset(BasicDicomDatabase._modalities[row["modality"]] for row in series_rows
+                               if row["modality"] in BasicDicomDatabase._modalities)
+        datetimes = [row["series_datetime"] for row in series_rows if row["series_datetime"] is not None]
+
+        return StudySummary(len(series_rows), number_of_instances, modalities,
+                            _decode_datetime(min(datetimes, default=None)),
+                            _decode_datetime(max(datetimes, default=None)))
+    # endregion
+
+    # region Protected Auxiliary
+    def _put(self, table: _Table, row: tuple, replace: bool):
+        with self._lock:
+            table.put(dict(zip(table.columns, row)), replace)
+
+    def _put_many(self, table: _Table, items: Iterable[Any], key_of: Callable[[Any], str],
+                  row_of: Callable[[Any], tuple], replace: bool) -> list[str]:
+        """
+        Writes a number of rows; the rows that cannot be written are skipped.
+        :param table: The table to write to.
+        :param items: The taxon objects to write.
+        :param key_of: Function returning the primary key of a taxon object.
+        :param row_of: Function converting a taxon object into a row (see BasicDicomDatabase).
+        :param replace: If True, present rows are replaced; otherwise, they make the write of the object fail.
+        :return: List of keys of the objects that could not be written.
+        """
+        failures = []
+
+        with self._lock:
+            for item in items:
+                try:
+                    table.put(dict(zip(table.columns, row_of(item))), replace)
+                except (AttributeError, TypeError, IndexError, KeyError):
+                    failures.append(key_of(item))
+
+        return failures
+
+    def _delete_studies(self, study_uids: list[str]) -> DeletionCounts:
+        series_uids = [series_uid for study_uid in study_uids for series_uid in self._seriez.keys_of(study_uid)]
+        counts = self._delete_seriez(series_uids)
+        number_of_studies = sum(int(self._studies.remove(study_uid)) for study_uid in study_uids)
+
+        return DeletionCounts(0, number_of_studies, counts.series, counts.instances)
+
+    def _delete_seriez(self, series_uids: list[str]) -> DeletionCounts:
+        instance_uids = [instance_uid for series_uid in series_uids
+                         for instance_uid in self._instances.keys_of(series_uid)]
+        number_of_instances = sum(int(self._instances.remove(instance_uid)) for instance_uid in instance_uids)
+        number_of_series = sum(int(self._seriez.remove(series_uid)) for series_uid in series_uids)
+
+        return DeletionCounts(0, 0, number_of_series, number_of_instances)
+
+    def _subtree(self, study_uids: list[str]) -> tuple[list[dict], list[dict], list[dict]]:
+        study_rows = [self._studies.rows[key] for key in study_uids if key in self._studies.rows]
+        series_rows = [self._seriez.rows[key] for row in study_rows
+                       for key in self._seriez.keys_of(row["study_uid"])]
+        instance_rows = [self._instances.rows[key] for row in series_rows
+                         for key in self._instances.keys_of(row["series_uid"])]
+
+        return study_rows, series_rows, instance_rows
+
+    def _children(self, table: _Table, parent_key: str) -> list[dict]:
+        with self._lock:
+            return [table.rows[key] for key in table.keys_of(parent_key)]
+
+    @staticmethod
+    def _iterate(rows: list[dict], decode: Callable[[dict], Any]) -> Iterator[Any]:
+        for row in rows:
+            item = decode(row)
+
+            if item is not None:
+                yield item
+
+    @staticmethod
+    def _decode(rows: list[dict], decode: Callable[[dict], Any]) -> list[Any]:
+        return list(InMemoryDicomDatabase._iterate(rows, decode))
+
+    def _select_filtered(self, table: _Table, datetime_column: str, criteria: NamedTuple, limit: int,
+                         decode: Callable[[dict], Any]) -> list[Any]:
+        """
+        Selects the rows meeting a filter (StudyFilter or SeriesFilter), ordered by their datetimes.
+        The candidates are the children of the parent given, otherwise the datetime range of the sorted index.
+        :param table: The table to select from.
+        :param datetime_column: The datetime column the rows are ordered by.
+        :param criteria: The filter; criteria of None do not restrict.
+        :param limit: The maximal number of rows, or None for all.
+        :param decode: Function creating a taxon object from a row.
+        :return: The decoded objects.
+        """
+        values = {field: value for field, value in criteria._asdict().items() if value is not None}
+        low = _encode_datetime(values.pop("datetime_from", None))
+        high = _encode_datetime(values.pop("datetime_to", None))
+        modality = values.pop("modality", None) if table is self._studies else None
+        conditions = {field: BasicDicomDatabase._enum_filter_codes[value] if isinstance(value, Enum) else value
+                      for field, value in values.items()}
+        rows = []
+
+        with self._lock:
+            if table.parent_key in conditions:
+                keys = sorted(table.keys_of(conditions[table.parent_key]),
+                              key=lambda key: _SortedIndex.entry(table.rows[key][datetime_column], key))
+            else:
+                keys = table.sorted[datetime_column].keys_between(low, high)
+
+            for key in keys:
+                row = table.rows[key]
+                value = row[datetime_column]
+
+                if (low is not None or high is not None) and value is None:
+                    continue
+
+                if (low is not None and value < low) or (high is not None and value > high):
+                    continue
+
+                if any(row[field] != condition for field, condition in conditions.items()):
+                    continue
+
+                if modality is not None and not self._has_modality(row["study_uid"], modality):
+                    continue
+
+                rows.append(row)
+
+                if limit is not None and len(rows) >= limit:
+                    break
+
+        return self._decode(rows, decode)
+
+    def _has_modality(self, study_uid: str, modality: Enum) -> bool:
+        code = BasicDicomDatabase._modality_codes.get(modality)
+        return any(self._seriez.rows[key]["modality"] == code for key in self._seriez.keys_of(study_uid))
+
+    def _select_page(self, table: _Table, after_key: str, page_size: int, order_by: str,
+                     decode: Callable[[dict], Any]) -> tuple[list[Any], str]:
+        """
+        Selects a page of a table from the sorted index of the ordering, with the same results and continuation
+        tokens as BasicDicomDatabase._select_page.
+        """
+        if order_by not in table.sorted:
+            raise ValueError(f"{table.name} cannot be paged by '{order_by}'")
+
+        if page_size < 1:
+            raise ValueError(f"page size must be at least 1, not {page_size}")
+
+        last_value, last_key = None, None
+
+        if after_key is not None:
+            token_order_by, last_value, last_key = BasicDicomDatabase._decode_page_token(after_key)
+
+            if token_order_by != order_by:
+                raise ValueError(f"continuation token does not belong to ordering '{order_by}'")
+
+        with self._lock:
+            keys = table.sorted[order_by].keys_after(last_value, last_key, page_size + 1)
+            rows = [table.rows[key] for key in keys]
+
+        page = rows[:page_size]
+        token = None
+
+        if len(rows) > page_size:
+            token = BasicDicomDatabase._encode_page_token(order_by, page[-1][order_by], page[-1][table.key])
+
+        return self._decode(page, decode), token
+    # endregion
@@ -0,0 +1,434 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from datetime import date
+from sqlite3 import Error
+from typing import Iterable, Iterator, Any, NamedTuple
+from Data.DicomDatabaseDecorator import DicomDatabaseDecorator
+from Data.IDicomDatabase import IDicomDatabase, DeletionCounts, StudySummary, StudyFilter, SeriesFilter
+from Taxons.Patient import Patient, Study
+from Taxons.Series import Series, Instance
+
+# Latencies of the calls of one method: number of calls, objects returned (or rows removed), time spent,
+# percentiles (upper bounds of their histogram buckets), the histogram as (upper bound, count) pairs
+# and the texts of the statements executed
+MethodStatistics = NamedTuple('MethodStatistics', [('calls', int), ('rows', int), ('total_seconds', float),
+                                                   ('max_seconds', float), ('p50_seconds', float),
+                                                   ('p95_seconds', float), ('p99_seconds', float),
+                                                   ('histogram', tuple[tuple[float, int], ...]),
+                                                   ('statements', tuple[str, ...])])
+
+# A call slower than the threshold, with the query plans of its statements
+SlowQuery = NamedTuple('SlowQuery', [('method', str), ('seconds', float), ('rows', int),
+                                     ('statements', tuple[str, ...]), ('query_plans', tuple[str, ...])])
+
+# Snapshot of the instrumentation. methods: Key: the name of the method; Value: its statistics
+QueryStatistics = NamedTuple('QueryStatistics', [('methods', dict[str, MethodStatistics]),
+                                                 ('slow_queries', list[SlowQuery])])
+
+_logger = logging.getLogger(__name__)
+_end = object()
+
+
+class _LatencyHistogram:
+    """
+    Latencies of one method, counted in buckets of powers of two microseconds:
+    bucket b holds the latencies below 2^b microseconds (and at least 2^(b-1)).
+    """
+    _number_of_buckets = 32         # the last bucket holds everything from about 18 minutes on
+
+    def __init__(self):
+        self._counts = [0] * self._number_of_buckets
+        self._calls = 0
+        self._rows = 0
+        self._total_seconds = 0.0
+        self._max_seconds = 0.0
+        self._statements: dict[str, None] = {}      # ordered set of the statement texts
+
+    def add(self, seconds: float, rows: int, statements: Iterable[str]):
+        bucket = min(int(seconds * 1e6).bit_length(), self._number_of_buckets - 1)
+        self._counts[bucket] += 1
+        self._calls += 1
+        self._rows += rows
+        self._total_seconds += seconds
+        self._max_seconds = max(self._max_seconds, seconds)
+
+        for statement in statements:
+            self._statements[statement] = None
+
+    def percentile(self, fraction: float) -> float:
+        threshold = fraction * self._calls
+        cumulative = 0
+
+        for bucket, count in enumerate(self._counts):
+            cumulative += count
+
+            if cumulative >= threshold:
+                return min((1 << bucket) / 1e6, self._max_seconds)
+
+        return self._max_seconds
+
+    def snapshot(self) -> MethodStatistics:
+        histogram = tuple(((1 << bucket) / 1e6, count) for bucket, count in enumerate(self._counts) if count > 0)
+
+        return MethodStatistics(self._calls, self._rows, self._total_seconds, self._max_seconds,
+                                self.percentile(0.5), self.percentile(0.95), self.percentile(0.99),
+                                histogram, tuple(self._statements))
+
+
+class InstrumentedDicomDatabase(DicomDatabaseDecorator):
+    """
+    Opt-in instrumentation of another IDicomDatabase: every method call is timed and recorded into a latency
+    histogram per method, together with the number of objects returned and the texts of the statements executed
+    (if the wrapped database can trace them, see BasicDicomDatabase.trace_statements).
+    Calls slower than a threshold are kept in a bounded slow-query log with the EXPLAIN QUERY PLAN output of their
+    statements, and logged as warnings. Lazy iterations are timed while fetching, and recorded when they end.
+    While disabled, every call is forwarded after a single flag test.
+    """
+
+    # region Construction
+    def __init__(self, database: IDicomDatabase, enabled: bool = True, slow_query_threshold: float = 0.1,
+                 max_slow_queries: int = 100):
+        """
+        Creates an instance of InstrumentedDicomDatabase.
+        :param database: The database to wrap.
+        :param enabled: If False, the calls are not recorded until the instrumentation is enabled.
+        :param slow_query_threshold: The duration in seconds from which a call is logged as slow.
+        :param max_slow_queries: The number of slow calls kept; older ones are dropped.
+        """
+        super().__init__(database)
+
+        self._enabled = enabled
+        self._slow_query_threshold = slow_query_threshold
+        self._histograms: dict[str, _LatencyHistogram] = {}
+        self._slow_queries = deque(maxlen=max_slow_queries)
+        self._lock = threading.Lock()
+    # endregion
+
+    # region Properties
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value: bool):
+        self._enabled = value
+
+    @property
+    def slow_query_threshold(self) -> float:
+        return self._slow_query_threshold
+
+    @slow_query_threshold.setter
+    def slow_query_threshold(self, value: float):
+        self._slow_query_threshold = value
+
+    @property
+    def statistics(self) -> QueryStatistics:
+        """
+        Gets a snapshot of the statistics recorded so far.
+        :return: The statistics per method and the slow-query log, oldest first.
+        """
+        with self._lock:
+            methods = {method: histogram.snapshot() for method, histogram in self._histograms.items()}
+            return QueryStatistics(methods, list(self._slow_queries))
+    # endregion
+
+    # region General Management
+    def clear_statistics(self):
+        """
+        Discards the statistics and the slow-query log.
+        :return: None
+        """
+        with self._lock:
+            self._histograms.clear()
+            self._slow_queries.clear()
+    # endregion
+
+    # region Patient Management
+    def insert_patient(self, patient: Patient):
+        return self._call("insert_patient", patient)
+
+    def insert_patients(self, patients: Iterable[Patient]) -> list[str]:
+        return self._call("insert_patients", patients)
+
+    def update_patient(self, patient: Patient):
+        return self._call("update_patient", patient)
+
+    def upsert_patients(self, patients: Iterable[Patient]) -> list[str]:
+        return self._call("upsert_patients", patients)
+
+    def delete_patient(self, patient_id: str) -> DeletionCounts:
+        return self._call("delete_patient", patient_id)
+
+    def select_patient(self, patient_id: str) -> Patient:
+        return self._call("select_patient", patient_id)
+
+    def select_patients_by_name_pattern(self, name_pattern: str) -> list[Patient]:
+        return self._call("select_patients_by_name_pattern", name_pattern)
+
+    def select_patients_by_date_of_birth(self, dob_from: date, dob_to: date) -> list[Patient]:
+        return self._call("select_patients_by_date_of_birth", dob_from, dob_to)
+
+    def select_all_patients(self) -> list[Patient]:
+        return self._call("select_all_patients")
+
+    def select_patients_by_limit(self, limit: int) -> list[Patient]:
+        return self._call("select_patients_by_limit", limit)
+
+    def iter_patients_by_name_pattern(self, name_pattern: str, batch_size: int = 256) -> Iterator[Patient]:
+        return self._iterate("iter_patients_by_name_pattern", name_pattern, batch_size)
+
+    def iter_patients_by_date_of_birth(self, dob_from: date, dob_to: date, batch_size: int = 256) -> Iterator[Patient]:
+        return self._iterate("iter_patients_by_date_of_birth", dob_from, dob_to, batch_size)
+
+    def iter_all_patients(self, batch_size: int = 256) -> Iterator[Patient]:
+        return self._iterate("iter_all_patients", batch_size)
+
+    def select_patients_page(self, after_key: str = None, page_size: int = 50,
+                             order_by: str = "patient_id") -> tuple[list[Patient], str]:
+        return self._call("select_patients_page", after_key, page_size, order_by)
+    # endregion
+
+    # region Study Management
+    def insert_study(self, study: Study):
+        return self._call("insert_study", study)
+
+    def insert_studies(self, studies: Iterable[Study]) -> list[str]:
+        return self._call("insert_studies", studies)
+
+    def update_study(self, study: Study):
+        return self._call("update_study", study)
+
+    def upsert_studies(self, studies: Iterable[Study]) -> list[str]:
+        return self._call("upsert_studies", studies)
+
+    def delete_study(self, study_uid: str) -> DeletionCounts:
+        return self._call("delete_study", study_uid)
+
+    def select_study(self, study_uid: str) -> Study:
+        return self._call("select_study", study_uid)
+
+    def select_studies_to_patient(self, patient_id: str) -> list[Study]:
+        return self._call("select_studies_to_patient", patient_id)
+
+    def iter_studies_to_patient(self, patient_id: str, batch_size: int = 256) -> Iterator[Study]:
+        return self._iterate("iter_studies_to_patient", patient_id, batch_size)
+
+    def select_studies(self, study_filter: StudyFilter, limit: int = None) -> list[Study]:
+        return self._call("select_studies", study_filter, limit)
+
+    def select_studies_page(self, after_key: str = None, page_size: int = 50,
+                            order_by: str = "study_uid") -> tuple[list[Study], str]:
+        return self._call("select_studies_page", after_key, page_size, order_by)
+    # endregion
+
+    # region Series Management
+    def insert_series(self, series: Series):
+        return self._call("insert_series", series)
+
+    def insert_series_many(self, seriez: Iterable[Series]) -> list[str]:
+        return self._call("insert_series_many", seriez)
+
+    def update_series(self, series: Series):
+        return self._call("update_series", series)
+
+    def upsert_series_many(self, seriez: Iterable[Series]) -> list[str]:
+        return self._call("upsert_series_many", seriez)
+
+    def delete_series(self, series_uid: str) -> DeletionCounts:
+        return self._call("delete_series", series_uid)
+
+    def select_series(self, series_uid: str) -> Series:
+        return self._call("select_series", series_uid)
+
+    def select_series_to_study(self, study_uid: str) -> list[Series]:
+        return self._call("select_series_to_study", study_uid)
+
+    def iter_series_to_study(self, study_uid: str, batch_size: int = 256) -> Iterator[Series]:
+        return self._iterate("iter_series_to_study", study_uid, batch_size)
+
+    def select_series_by_filter(self, series_filter: SeriesFilter, limit: int = None) -> list[Series]:
+        return self._call("select_series_by_filter", series_filter, limit)
+
+    def select_series_page(self, after_key: str = None, page_size: int = 50,
+                           order_by: str = "series_uid") -> tuple[list[Series], str]:
+        return self._call("select_series_page", after_key, page_size, order_by)
+    # endregion
+
+    # region Instance Management
+    def insert_instance(self, instance: Instance):
+        return self._call("insert_instance", instance)
+
+    def insert_instances(self, instances: Iterable[Instance]) -> list[str]:
+        return self._call("insert_instances", instances)
+
+    def update_instance(self, instance: Instance):
+        return self._call("update_instance", instance)
+
+    def upsert_instances(self, instances: Iterable[Instance]) -> list[str]:
+        return self._call("upsert_instances", instances)
+
+    def update_instance_file_names(self, file_names: dict[str, str]) -> list[str]:
+        return self._call("update_instance_file_names", file_names)
+
+    def delete_instance(self, instance_uid: str):
+        return self._call("delete_instance", instance_uid)
+
+    def delete_instances_of_series(self, series_uid: str):
+        return self._call("delete_instances_of_series", series_uid)
+
+    def select_instance(self, instance_uid: str) -> Instance:
+        return self._call("select_instance", instance_uid)
+
+    def select_instances_to_series(self, series_uid: str) -> list[Instance]:
+        return self._call("select_instances_to_series", series_uid)
+
+    def iter_instances_to_series(self, series_uid: str, batch_size: int = 256) -> Iterator[Instance]:
+        return self._iterate("iter_instances_to_series", series_uid, batch_size)
+    # endregion
+
+    # region Hierarchy Selection
+    def select_patient_tree(self, patient_id: str) -> Patient:
+        return self._call("select_patient_tree", patient_id)
+
+    def select_study_tree(self, study_uid: str) -> Study:
+        return self._call("select_study_tree", study_uid)
+    # endregion
+
+    # region Aggregation
+    def count_studies_to_patient(self, patient_id: str) -> int:
+        return self._call("count_studies_to_patient", patient_id)
+
+    def count_series_to_study(self, study_uid: str) -> int:
+        return self._call("count_series_to_study", study_uid)
+
+    def count_instances_to_series(self, series_uid: str) -> int:
+        return self._call("count_instances_to_series", series_uid)
+
+    def study_summary(self, study_uid: str) -> StudySummary:
+        return self._call("study_summary", study_uid)
+    # endregion
+
+    # region Protected Auxiliary
+    def _call(self, method: str, *args) -> Any:
+        """
+        Calls a method of the wrapped database and records it, if the instrumentation is enabled.
+        :param method: The name of the method.
+        :param args: The arguments of the method.
+        :return: The result of the method.
+        """
+        function = getattr(self._database, method)
+
+        if not self._enabled:
+            return function(*args)
+
+        result = None
+
+        with self._trace() as statements:
+            started = time.perf_counter()
+
+            try:
+                result = function(*args)
+                return result
+            finally:
+                seconds = time.perf_counter() - started
+                self._record(method, seconds, self._count_rows(method, result), statements)
+
+    def _iterate(self, method: str, *args) -> Iterator[Any]:
+        iterator = getattr(self._database, method)(*args)
+
+        if not self._enabled:
+            return iterator
+
+        return self._timed_iteration(method, iterator)
+
+    def _timed_iteration(self, method: str, iterator: Iterator[Any]) -> Iterator[Any]:
+        """
+        Yields the items of an iteration, timing only the fetching of the items.
+        The iteration is recorded when it is exhausted or abandoned.
+        """
+        seconds = 0.0
+        rows = 0
+        statements = []
+
+        try:
+            while True:
+                with self._trace() as traced:
+                    started = time.perf_counter()
+                    item = next(iterator, _end)
+                    seconds += time.perf_counter() - started
+
+                statements += traced
+
+                if item is _end:
+                    return
+
+                rows += 1
+                yield item
+        finally:
+            self._record(method, seconds, rows, statements)
+
+    def _trace(self):
+        trace_statements = getattr(self._database, "trace_statements", None)
+        return nullcontext([]) if trace_statements is None else trace_statements()
+
+    def _record(self, method: str, seconds: float, rows: int, statements: list[tuple[str, tuple]]):
+        texts = list(dict.fromkeys(sql for sql, parameters in statements))
+
+        with self._lock:
+            histogram = self._histograms.get(method)
+
+            if histogram is None:
+                histogram = self._histograms[method] = _LatencyHistogram()
+
+            histogram.add(seconds, rows, texts)
+
+        if seconds >= self._slow_query_threshold:
+            self._log_slow_query(method, seconds, rows, statements)
+
+    def _log_slow_query(self, method: str, seconds: float, rows: int, statements: list[tuple[str, tuple]]):
+        """
+        Adds a call to the slow-query log, explaining the query plan of each of its distinct statements
+        (with the parameters of its first execution). The parameters themselves are not logged.
+        """
+        explain = getattr(self._database, "explain_query_plan", None)
+        executions = dict(reversed(statements))     # first parameters of each statement text, in execution order
+        executions = {sql: executions[sql] for sql in dict.fromkeys(sql for sql, parameters in statements)}
+        plans = []
+
+        for sql, parameters in executions.items():
+            try:
+                plans.append("" if explain is None else explain(sql, parameters))
+            except Error as e:
+                plans.append(f"not available: {e}")
+
+        slow_query = SlowQuery(method, seconds, rows, tuple(executions.keys()), tuple(plans))
+
+        with self._lock:
+            self._slow_queries.append(slow_query)
+
+        details = "".join(f"\n  {sql}\n    {plan.replace(chr(10), chr(10) + '    ')}"
+                          for sql, plan in zip(slow_query.statements, slow_query.query_plans))
+        _logger.warning("slow query: %s took %.1f ms (%d rows)%s", method, seconds * 1e3, rows, details)
+
+    @staticmethod
+    def _count_rows(method: str, result: Any) -> int:
+        """
+        Counts the objects returned by a selection, or the rows removed by a deletion; writes count none.
+        """
+        if method.startswith(("insert_", "update_", "upsert_")) or result is None:
+            return 0
+
+        if isinstance(result, DeletionCounts):
+            return sum(result)
+
+        if isinstance(result, list):
+            return len(result)
+
+        if isinstance(result, tuple) and len(result) == 2 and isinstance(result[0], list):
+            return len(result[0])       # page and continuation token
+
+        return 1
+    # endregion
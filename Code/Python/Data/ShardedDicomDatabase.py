@@ -0,0 +1,739 @@
+import itertools
+import os
+import sqlite3
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Iterable, Iterator, Callable, Any
+from Data.BasicDicomDatabase import BasicDicomDatabase, _encode_date, _encode_datetime
+from Data.IDicomDatabase import IDicomDatabase, DeletionCounts, StudySummary, StudyFilter, SeriesFilter
+from Data.SqliteConnectionManager import SqliteConnectionManager
+from Taxons.Patient import Patient, Study
+from Taxons.Series import Series, Instance
+
+
+class _RoutingIndex:
+    """
+    Persistent mapping of the StudyUIDs, SeriesUIDs and InstanceUIDs to the numbers of the shards holding them,
+    kept in a sqlite file of its own. DICOM UIDs are unique across the taxon types, so one table holds all of them.
+    The file also records the number of shards, which must never change for a database.
+    Changed routes are buffered in memory and written in bulk (write-behind), so that the writers of the shards
+    do not serialize on the lock of the routing file; the routes of the buffer are lost on a crash.
+    """
+    _sql_create = [
+        "CREATE TABLE IF NOT EXISTS `routing` (`uid` VARCHAR(64) PRIMARY KEY, `shard` INTEGER) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS `shard_configuration` (`number_of_shards` INTEGER NOT NULL)",
+    ]
+
+    # Number of UIDs looked up per statement, below the limit of host parameters of old sqlite versions
+    _lookup_chunk_size = 500
+
+    def __init__(self, database_file_name: str, number_of_shards: int, profile: str, flush_size: int = 4096):
+        # the routes can be restored from the shards, so a commit need not wait for the disk
+        self._connections = SqliteConnectionManager(database_file_name, profile=profile, synchronous="NORMAL")
+        self._flush_size = flush_size
+        self._pending: dict[str, int] = {}          # buffered routes; None marks a removed one
+        self._lock = threading.Lock()               # guards the buffer
+        self._flush_lock = threading.Lock()         # serializes the flushes
+        connection = self._connections.connection
+
+        for sql in self._sql_create:
+            connection.execute(sql)
+
+        stored = connection.execute("SELECT `number_of_shards` FROM `shard_configuration`").fetchone()
+
+        if stored is None:
+            connection.execute("INSERT INTO `shard_configuration` VALUES (?)", (number_of_shards,))
+        elif stored[0] != number_of_shards:
+            self._connections.close()
+            raise UserWarning(f"the database has {stored[0]} shards, not {number_of_shards}")
+
+        connection.commit()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._connections.close()
+
+    def get(self, uid: str) -> int:
+        return self.lookup([uid]).get(uid)
+
+    def lookup(self, uids: Iterable[str]) -> dict[str, int]:
+        """
+        Looks up a number of UIDs, in the buffer and then with one statement per chunk.
+        :return: Dictionary of the UIDs found. Key: the UID; Value: the number of its shard.
+        """
+        uids = list(dict.fromkeys(uids))
+        routes = {}
+
+        with self._lock:
+            buffered = {uid: self._pending[uid] for uid in uids if uid in self._pending}
+
+        stored = [uid for uid in uids if uid not in buffered]
+
+        for start in range(0, len(stored), self._lookup_chunk_size):
+            chunk = stored[start:start + self._lookup_chunk_size]
+            sql = f"SELECT `uid`, `shard` FROM `routing` WHERE `uid` IN ({', '.join('?' for uid in chunk)})"
+            routes.update(self._connections.connection.execute(sql, chunk).fetchall())
+
+        routes.update((uid, shard) for uid, shard in buffered.items() if shard is not None)
+        return routes
+
+    def put(self, routes: Iterable[tuple[str, int]]):
+        self._buffer(routes)
+
+    def remove(self, uids: Iterable[str]):
+        self._buffer((uid, None) for uid in uids)
+
+    def clear(self):
+        with self._flush_lock:
+            with self._lock:
+                self._pending.clear()
+
+            self._write([("DELETE FROM `routing`", [()])])
+
+    def flush(self):
+        """
+        Writes the buffered routes in one transaction.
+        :return: None
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending = dict(self._pending)
+
+            if len(pending) == 0:
+                return
+
+            self._write([
+                ("INSERT OR REPLACE INTO `routing` VALUES (?, ?)",
+                 [(uid, shard) for uid, shard in pending.items() if shard is not None]),
+                ("DELETE FROM `routing` WHERE `uid` = ?", [(uid,) for uid, shard in pending.items() if shard is None]),
+            ])
+
+            with self._lock:
+                for uid, shard in pending.items():
+                    # routes changed during the flush stay buffered
+                    if uid in self._pending and self._pending[uid] == shard:
+                        del self._pending[uid]
+
+    def _buffer(self, routes: Iterable[tuple[str, int]]):
+        with self._lock:
+            self._pending.update(routes)
+            full = len(self._pending) >= self._flush_size
+
+        if full:
+            self.flush()
+
+    def _write(self, statements: list[tuple[str, list[tuple]]]):
+        connection = self._connections.connection
+
+        try:
+            for sql, parameters in statements:
+                connection.executemany(sql, parameters)
+
+            connection.commit()
+        except sqlite3.Error as e:
+            connection.rollback()
+            raise e
+
+
+class ShardedDicomDatabase(IDicomDatabase):
+    """
+    IDicomDatabase spreading the data over several sqlite files (shards), each one a BasicDicomDatabase,
+    so that writers of different patients do not serialize on one file lock and every file stays small enough
+    to be vacuumed:
+    - every patient is stored with its whole subtree in the shard given by the CRC-32 of its PatientID;
+    - a routing index (a sqlite file of its own) maps the StudyUIDs, SeriesUIDs and InstanceUIDs to their shards;
+    - queries that are not bound to a patient or a routed UID run on all shards in parallel and merge the results.
+    The shards are stored next to the routing index: archive.db3 has the shards archive.shard0.db3, ...
+    A write records the routes of its objects before it writes the shard, so that an interrupted write at worst
+    leaves a route to an object that does not exist, which selects nothing. Routes lost in a crash are restored
+    when their objects are looked up, by asking all shards. A study, series or instance cannot move to a patient
+    of another shard; such writes fail.
+    Transactions span one shard only, so there is no transaction() over the whole database.
+    """
+
+    # region Protected Data
+    # Functions of the ordering values of the pages and filter results, in the encoding of BasicDicomDatabase,
+    # so that the continuation tokens are those of BasicDicomDatabase
+    _ordering_values: dict[str, Callable[[Any], Any]] = {
+        "patient_id": lambda patient: patient.patient_id,
+        "patient_name": lambda patient: patient.name,
+        "patient_date_of_birth": lambda patient: _encode_date(patient.date_of_birth),
+        "study_uid": lambda study: study.study_uid,
+        "study_datetime": lambda study: _encode_datetime(study.study_date_time),
+        "series_uid": lambda series: series.series_uid,
+        "series_datetime": lambda series: _encode_datetime(series.series_datetime),
+    }
+    # endregion
+
+    # region Construction
+    def __init__(self, number_of_shards: int = 4, max_workers: int = None, profile: str = "durable"):
+        """
+        Creates an instance of ShardedDicomDatabase.
+        :param number_of_shards: The number of shard files; must be the same every time a database is opened.
+        :param max_workers: The number of threads running the queries on the shards; by default one per shard.
+        :param profile: The connection profile of the shards and of the routing index (see SqliteConnectionManager).
+        :exception: ValueError, if the number of shards is less than 1.
+        """
+        if number_of_shards < 1:
+            raise ValueError(f"number of shards must be at least 1, not {number_of_shards}")
+
+        self._number_of_shards = number_of_shards
+        self._max_workers = max_workers or number_of_shards
+        self._profile = profile
+        self._shards: list[BasicDicomDatabase] = []
+        self._routing: _RoutingIndex = None
+        self._executor: ThreadPoolExecutor = None
+    # endregion
+
+    # region Properties
+    @property
+    def number_of_shards(self) -> int:
+        return self._number_of_shards
+
+    @property
+    def shards(self) -> list[BasicDicomDatabase]:
+        """
+        Gets the shards, e.g. for their maintenance. They must not be written directly.
+        :return: The list of the shards; the position in the list is the number of the shard.
+        """
+        return list(self._shards)
+    # endregion
+
+    # region General Management
+    def open(self, database_file_name: str):
+        """
+        Opens the routing index and the shards, creating them if necessary.
+        :param database_file_name: The path to the routing index; the shard files are stored next to it.
+        :return None:
+        :exception: UserWarning, if the database was created with another number of shards.
+        """
+        self._routing = _RoutingIndex(database_file_name, self._number_of_shards, self._profile)
+        root, extension = os.path.splitext(database_file_name)
+        self._shards = [BasicDicomDatabase(profile=self._profile) for i in range(self._number_of_shards)]
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="shard")
+
+        try:
+            self._fan_out(lambda i, shard: shard.open(f"{root}.shard{i}{extension}"))
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        """
+        Closes the shards and the routing index. The data are kept.
+        :return: None
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+        for shard in self._shards:
+            if shard._connections is not None:
+                shard.close()
+
+        if self._routing is not None:
+            self._routing.close()
+            self._routing = None
+
+    def reset(self):
+        """
+        Removes all data from the shards and the routing index.
+        :return: None
+        """
+        self._fan_out(lambda i, shard: shard.reset())
+        self._routing.clear()
+
+    def shard_of_patient(self, patient_id: str) -> int:
+        """
+        Gets the number of the shard a patient is stored in.
+        :param patient_id: The PatientID of the patient.
+        :return: The number of the shard.
+        """
+        return zlib.crc32(patient_id.encode("utf-8")) % self._number_of_shards
+    # endregion
+
+    # region Patient Management
+    def insert_patient(self, patient: Patient):
+        self._shard_by_patient(patient.patient_id).insert_patient(patient)
+
+    def insert_patients(self, patients: Iterable[Patient]) -> list[str]:
+        return self._write_patients(patients, "insert_patients")
+
+    def update_patient(self, patient: Patient):
+        self._shard_by_patient(patient.patient_id).update_patient(patient)
+
+    def upsert_patients(self, patients: Iterable[Patient]) -> list[str]:
+        return self._write_patients(patients, "upsert_patients")
+
+    def delete_patient(self, patient_id: str) -> DeletionCounts:
+        """
+        Deletes a patient together with its subtree from its shard, and the routes of the subtree.
+        """
+        shard = self._shard_by_patient(patient_id)
+        study_uids = [study.study_uid for study in shard.iter_studies_to_patient(patient_id)]
+        uids = study_uids + self._uids_below_studies(shard, study_uids)
+
+        counts = shard.delete_patient(patient_id)
+        self._routing.remove(uids)
+        return counts
+
+    def select_patient(self, patient_id: str) -> Patient:
+        return self._shard_by_patient(patient_id).select_patient(patient_id)
+
+    def select_patients_by_name_pattern(self, name_pattern: str) -> list[Patient]:
+        return self._concatenate(lambda i, shard: shard.select_patients_by_name_pattern(name_pattern))
+
+    def select_patients_by_date_of_birth(self, dob_from: date, dob_to: date) -> list[Patient]:
+        return self._concatenate(lambda i, shard: shard.select_patients_by_date_of_birth(dob_from, dob_to))
+
+    def select_all_patients(self) -> list[Patient]:
+        return self._concatenate(lambda i, shard: shard.select_all_patients())
+
+    def select_patients_by_limit(self, limit: int) -> list[Patient]:
+        return self._concatenate(lambda i, shard: shard.select_patients_by_limit(limit))[:limit]
+
+    def iter_patients_by_name_pattern(self, name_pattern: str, batch_size: int = 256) -> Iterator[Patient]:
+        return itertools.chain.from_iterable(shard.iter_patients_by_name_pattern(name_pattern, batch_size)
+                                             for shard in self._shards)
+
+    def iter_patients_by_date_of_birth(self, dob_from: date, dob_to: date, batch_size: int = 256) -> Iterator[Patient]:
+        return itertools.chain.from_iterable(shard.iter_patients_by_date_of_birth(dob_from, dob_to, batch_size)
+                                             for shard in self._shards)
+
+    def iter_all_patients(self, batch_size: int = 256) -> Iterator[Patient]:
+        return itertools.chain.from_iterable(shard.iter_all_patients(batch_size) for shard in self._shards)
+
+    def select_patients_page(self, after_key: str = None, page_size: int = 50,
+                             order_by: str = "patient_id") -> tuple[list[Patient], str]:
+        """
+        Selects a page of patients, merging the pages of all shards (see IDicomDatabase.select_patients_page).
+        The continuation tokens are those of BasicDicomDatabase.
+        """
+        return self._select_page(lambda shard: shard.select_patients_page(after_key, page_size, order_by),
+                                 page_size, order_by, "patient_id")
+    # endregion
+
+    # region Study Management
+    def insert_study(self, study: Study):
+        self._write_one(study, "insert_study", self._route_of_study)
+
+    def insert_studies(self, studies: Iterable[Study]) -> list[str]:
+        return self._write_many(studies, "insert_studies", self._route_of_study)
+
+    def update_study(self, study: Study):
+        self._write_one(study, "update_study", self._route_of_study)
+
+    def upsert_studies(self, studies: Iterable[Study]) -> list[str]:
+        return self._write_many(studies, "upsert_studies", self._route_of_study)
+
+    def delete_study(self, study_uid: str) -> DeletionCounts:
+        shard = self._shard_of_study(study_uid)
+
+        if shard is None:
+            return DeletionCounts(0, 0, 0, 0)
+
+        uids = self._uids_below_studies(shard, [study_uid])
+        counts = shard.delete_study(study_uid)
+        self._routing.remove([study_uid] + uids)
+        return counts
+
+    def select_study(self, study_uid: str) -> Study:
+        shard = self._shard_of_study(study_uid)
+        return None if shard is None else shard.select_study(study_uid)
+
+    def select_studies_to_patient(self, patient_id: str) -> list[Study]:
+        return self._shard_by_patient(patient_id).select_studies_to_patient(patient_id)
+
+    def iter_studies_to_patient(self, patient_id: str, batch_size: int = 256) -> Iterator[Study]:
+        return self._shard_by_patient(patient_id).iter_studies_to_patient(patient_id, batch_size)
+
+    def select_studies(self, study_filter: StudyFilter, limit: int = None) -> list[Study]:
+        """
+        Selects the studies meeting a filter (see IDicomDatabase.select_studies). A filter on the PatientID is
+        answered by one shard; otherwise the ordered results of all shards are merged.
+        """
+        if study_filter.patient_id is not None:
+            return self._shard_by_patient(study_filter.patient_id).select_studies(study_filter, limit)
+
+        studies = self._concatenate(lambda i, shard: shard.select_studies(study_filter, limit))
+        return self._merge(studies, "study_datetime", "study_uid")[:limit]
+
+    def select_studies_page(self, after_key: str = None, page_size: int = 50,
+                            order_by: str = "study_uid") -> tuple[list[Study], str]:
+        return self._select_page(lambda shard: shard.select_studies_page(after_key, page_size, order_by),
+                                 page_size, order_by, "study_uid")
+    # endregion
+
+    # region Series Management
+    def insert_series(self, series: Series):
+        self._write_one(series, "insert_series", self._route_of_series, BasicDicomDatabase.select_study)
+
+    def insert_series_many(self, seriez: Iterable[Series]) -> list[str]:
+        return self._write_many(seriez, "insert_series_many", self._route_of_series, BasicDicomDatabase.select_study)
+
+    def update_series(self, series: Series):
+        self._write_one(series, "update_series", self._route_of_series, BasicDicomDatabase.select_study)
+
+    def upsert_series_many(self, seriez: Iterable[Series]) -> list[str]:
+        return self._write_many(seriez, "upsert_series_many", self._route_of_series, BasicDicomDatabase.select_study)
+
+    def delete_series(self, series_uid: str) -> DeletionCounts:
+        shard = self._shard_of_series(series_uid)
+
+        if shard is None:
+            return DeletionCounts(0, 0, 0, 0)
+
+        uids = [instance.instance_uid for instance in shard.iter_instances_to_series(series_uid)]
+        counts = shard.delete_series(series_uid)
+        self._routing.remove([series_uid] + uids)
+        return counts
+
+    def select_series(self, series_uid: str) -> Series:
+        shard = self._shard_of_series(series_uid)
+        return None if shard is None else shard.select_series(series_uid)
+
+    def select_series_to_study(self, study_uid: str) -> list[Series]:
+        shard = self._shard_of_study(study_uid)
+        return [] if shard is None else shard.select_series_to_study(study_uid)
+
+    def iter_series_to_study(self, study_uid: str, batch_size: int = 256) -> Iterator[Series]:
+        shard = self._shard_of_study(study_uid)
+        return iter([]) if shard is None else shard.iter_series_to_study(study_uid, batch_size)
+
+    def select_series_by_filter(self, series_filter: SeriesFilter, limit: int = None) -> list[Series]:
+        """
+        Selects the series meeting a filter (see IDicomDatabase.select_series_by_filter). A filter on the StudyUID
+        is answered by one shard; otherwise the ordered results of all shards are merged.
+        """
+        if series_filter.study_uid is not None:
+            shard = self._shard_of_study(series_filter.study_uid)
+            return [] if shard is None else shard.select_series_by_filter(series_filter, limit)
+
+        seriez = self._concatenate(lambda i, shard: shard.select_series_by_filter(series_filter, limit))
+        return self._merge(seriez, "series_datetime", "series_uid")[:limit]
+
+    def select_series_page(self, after_key: str = None, page_size: int = 50,
+                           order_by: str = "series_uid") -> tuple[list[Series], str]:
+        return self._select_page(lambda shard: shard.select_series_page(after_key, page_size, order_by),
+                                 page_size, order_by, "series_uid")
+    # endregion
+
+    # region Instance Management
+    def insert_instance(self, instance: Instance):
+        self._write_one(instance, "insert_instance", self._route_of_instance, BasicDicomDatabase.select_series)
+
+    def insert_instances(self, instances: Iterable[Instance]) -> list[str]:
+        return self._write_many(instances, "insert_instances", self._route_of_instance,
+                                BasicDicomDatabase.select_series)
+
+    def update_instance(self, instance: Instance):
+        self._write_one(instance, "update_instance", self._route_of_instance, BasicDicomDatabase.select_series)
+
+    def upsert_instances(self, instances: Iterable[Instance]) -> list[str]:
+        return self._write_many(instances, "upsert_instances", self._route_of_instance,
+                                BasicDicomDatabase.select_series)
+
+    def update_instance_file_names(self, file_names: dict[str, str]) -> list[str]:
+        known = self._routing.lookup(file_names.keys())
+        groups = [{} for shard in self._shards]
+        failures = []
+
+        for instance_uid, file_name in file_names.items():
+            shard = known.get(instance_uid)
+
+            if shard is None:
+                shard = self._probe(instance_uid, BasicDicomDatabase.select_instance)
+
+            if shard is None:
+                failures.append(instance_uid)
+            else:
+                groups[shard][instance_uid] = file_name
+
+        failures += self._write_groups(groups, "update_instance_file_names")
+        return self._in_order(failures, list(file_names))
+
+    def delete_instance(self, instance_uid: str):
+        shard = self._shard_of_instance(instance_uid)
+
+        if shard is not None:
+            shard.delete_instance(instance_uid)
+            self._routing.remove([instance_uid])
+
+    def delete_instances_of_series(self, series_uid: str):
+        shard = self._shard_of_series(series_uid)
+
+        if shard is not None:
+            uids = [instance.instance_uid for instance in shard.iter_instances_to_series(series_uid)]
+            shard.delete_instances_of_series(series_uid)
+            self._routing.remove(uids)
+
+    def select_instance(self, instance_uid: str) -> Instance:
+        shard = self._shard_of_instance(instance_uid)
+        return None if shard is None else shard.select_instance(instance_uid)
+
+    def select_instances_to_series(self, series_uid: str) -> list[Instance]:
+        shard = self._shard_of_series(series_uid)
+        return [] if shard is None else shard.select_instances_to_series(series_uid)
+
+    def iter_instances_to_series(self, series_uid: str, batch_size: int = 256) -> Iterator[Instance]:
+        shard = self._shard_of_series(series_uid)
+        return iter([]) if shard is None else shard.iter_instances_to_series(series_uid, batch_size)
+    # endregion
+
+    # region Hierarchy Selection
+    def select_patient_tree(self, patient_id: str) -> Patient:
+        return self._shard_by_patient(patient_id).select_patient_tree(patient_id)
+
+    def select_study_tree(self, study_uid: str) -> Study:
+        shard = self._shard_of_study(study_uid)
+        return None if shard is None else shard.select_study_tree(study_uid)
+    # endregion
+
+    # region Aggregation
+    def count_studies_to_patient(self, patient_id: str) -> int:
+        return self._shard_by_patient(patient_id).count_studies_to_patient(patient_id)
+
+    def count_series_to_study(self, study_uid: str) -> int:
+        shard = self._shard_of_study(study_uid)
+        return 0 if shard is None else shard.count_series_to_study(study_uid)
+
+    def count_instances_to_series(self, series_uid: str) -> int:
+        shard = self._shard_of_series(series_uid)
+        return 0 if shard is None else shard.count_instances_to_series(series_uid)
+
+    def study_summary(self, study_uid: str) -> StudySummary:
+        shard = self._shard_of_study(study_uid)
+        return None if shard is None else shard.study_summary(study_uid)
+    # endregion
+
+    # region Protected Auxiliary
+    def _shard_by_patient(self, patient_id: str) -> BasicDicomDatabase:
+        return self._shards[self.shard_of_patient(patient_id)]
+
+    def _shard_of_study(self, study_uid: str) -> BasicDicomDatabase:
+        return self._shard_by_uid(study_uid, BasicDicomDatabase.select_study)
+
+    def _shard_of_series(self, series_uid: str) -> BasicDicomDatabase:
+        return self._shard_by_uid(series_uid, BasicDicomDatabase.select_series)
+
+    def _shard_of_instance(self, instance_uid: str) -> BasicDicomDatabase:
+        return self._shard_by_uid(instance_uid, BasicDicomDatabase.select_instance)
+
+    def _shard_by_uid(self, uid: str, select: Callable[[BasicDicomDatabase, str], Any]) -> BasicDicomDatabase:
+        shard = self._routing.get(uid)
+
+        if shard is None:
+            shard = self._probe(uid, select)
+
+        return None if shard is None else self._shards[shard]
+
+    def _probe(self, uid: str, select: Callable[[BasicDicomDatabase, str], Any]) -> int:
+        """
+        Looks for an object without route in all shards and records its route, if found.
+        Routes may be missing after a crash, since the routing index does not wait for the disk on commit.
+        :param uid: The UID of the object.
+        :param select: The method of BasicDicomDatabase selecting the object by its UID.
+        :return: The number of the shard holding the object, or None, if no shard does.
+        """
+        found = self._fan_out(lambda i, shard: select(shard, uid) is not None)
+
+        if True not in found:
+            return None
+
+        shard = found.index(True)
+        self._routing.put([(uid, shard)])
+        return shard
+
+    def _fan_out(self, function: Callable[[int, BasicDicomDatabase], Any]) -> list[Any]:
+        """
+        Calls a function for every shard in parallel.
+        :param function: Function of the number of a shard and the shard.
+        :return: The results, in the order of the shards.
+        """
+        return list(self._executor.map(function, range(len(self._shards)), self._shards))
+
+    def _concatenate(self, function: Callable[[int, BasicDicomDatabase], list[Any]]) -> list[Any]:
+        return [item for items in self._fan_out(function) for item in items]
+
+    def _sort_key(self, order_by: str, key: str) -> Callable[[Any], tuple]:
+        # NULL first, as sqlite orders
+        value_of, key_of = self._ordering_values[order_by], self._ordering_values[key]
+
+        def sort_key(item: Any) -> tuple:
+            value = value_of(item)
+            return (False, 0, key_of(item)) if value is None else (True, value, key_of(item))
+
+        return sort_key
+
+    def _merge(self, items: list[Any], order_by: str, key: str) -> list[Any]:
+        return sorted(items, key=self._sort_key(order_by, key))
+
+    def _select_page(self, select: Callable[[BasicDicomDatabase], tuple[list[Any], str]], page_size: int,
+                     order_by: str, key: str) -> tuple[list[Any], str]:
+        """
+        Selects a page from every shard, all following the same token, and takes the first rows of their union.
+        """
+        if order_by not in self._ordering_values:
+            raise ValueError(f"cannot page by '{order_by}'")
+
+        pages = self._fan_out(lambda i, shard: select(shard))
+        items = self._merge([item for page, token in pages for item in page], order_by, key)
+        more = len(items) > page_size or any(token is not None for page, token in pages)
+        page = items[:page_size]
+
+        if not more or len(page) == 0:
+            return page, None
+
+        last = page[-1]
+        return page, BasicDicomDatabase._encode_page_token(order_by, self._ordering_values[order_by](last),
+                                                           self._ordering_values[key](last))
+
+    def _write_patients(self, patients: Iterable[Patient], method: str) -> list[str]:
+        patients = list(patients)
+        groups = [[] for shard in self._shards]
+
+        for patient in patients:
+            groups[self.shard_of_patient(patient.patient_id)].append(patient)
+
+        return self._in_order(self._write_groups(groups, method), [patient.patient_id for patient in patients])
+
+    def _write_one(self, item: Any, method: str, route_of: Callable[[Any], tuple[str, str, int]],
+                   select_parent: Callable[[BasicDicomDatabase, str], Any] = None):
+        """
+        Writes one study, series or instance into its shard, after recording its route.
+        :exception: KeyError, if the parent is unknown or the object is stored in another shard.
+        """
+        routes, new_keys = self._routes([item], route_of, select_parent)
+        key, shard = routes[0]
+
+        if shard is None:
+            raise KeyError(f"{key} cannot be routed: its parent is unknown or it belongs to another shard")
+
+        try:
+            getattr(self._shards[shard], method)(item)
+        except BaseException:
+            self._routing.remove(new_keys)
+            raise
+
+    def _write_many(self, items: Iterable[Any], method: str, route_of: Callable[[Any], tuple[str, str, int]],
+                    select_parent: Callable[[BasicDicomDatabase, str], Any] = None) -> list[str]:
+        """
+        Writes a number of studies, series or instances, with one batch per shard; the batches run in parallel.
+        :return: The keys of the objects that could not be written.
+        """
+        items = list(items)
+        routes, new_keys = self._routes(items, route_of, select_parent)
+        groups = [[] for shard in self._shards]
+        failures = []
+
+        for item, (key, shard) in zip(items, routes):
+            if shard is None:
+                failures.append(key)
+            else:
+                groups[shard].append(item)
+
+        try:
+            failures += self._write_groups(groups, method)
+        except BaseException:
+            self._routing.remove(new_keys)
+            raise
+
+        self._routing.remove(set(failures) & set(new_keys))
+        return self._in_order(failures, [key for key, shard in routes])
+
+    def _write_groups(self, groups: list[list[Any]], method: str) -> list[str]:
+        """
+        Writes the groups of objects into their shards; a single group is written on the calling thread.
+        """
+        written = [i for i, group in enumerate(groups) if len(group) > 0]
+
+        if len(written) == 1:
+            return getattr(self._shards[written[0]], method)(groups[written[0]])
+
+        results = self._fan_out(lambda i, shard: getattr(shard, method)(groups[i]) if len(groups[i]) > 0 else [])
+        return [key for failures in results for key in failures]
+
+    @staticmethod
+    def _in_order(failures: list[str], keys: list[str]) -> list[str]:
+        """
+        Orders the failures of the shards by the positions of their keys in the written batch.
+        """
+        positions = {}
+
+        for position, key in enumerate(keys):
+            positions.setdefault(key, position)
+
+        return sorted(failures, key=lambda key: positions.get(key, len(keys)))
+
+    def _routes(self, items: list[Any], route_of: Callable[[Any], tuple[str, str, int]],
+                select_parent: Callable[[BasicDicomDatabase, str], Any]) -> tuple[list[tuple[str, int]], list[str]]:
+        """
+        Determines the shards of a number of objects and records their new routes; the routing index is read and
+        written once each.
+        An object is routed by the PatientID of its ancestors, if it references them up to the patient,
+        otherwise by the route of its parent. Objects that already have a route to another shard are not routed.
+        :param items: The studies, series or instances.
+        :param route_of: Function of an object returning its key, the UID of its parent and the shard by the
+                         PatientID (None, if it does not reference the patient).
+        :param select_parent: The method of BasicDicomDatabase selecting the parent, to find parents without route.
+        :return: The key and the shard of every object (None, if the object cannot be routed),
+                 and the keys of the routes recorded.
+        """
+        routes = [route_of(item) for item in items]
+        known = self._routing.lookup([key for key, parent, shard in routes] +
+                                     [parent for key, parent, shard in routes if shard is None and parent is not None])
+
+        if select_parent is not None:
+            for parent in {parent for key, parent, shard in routes if shard is None and parent is not None}:
+                if parent not in known:
+                    shard = self._probe(parent, select_parent)
+
+                    if shard is not None:
+                        known[parent] = shard
+
+        result = []
+
+        for key, parent, shard in routes:
+            if shard is None:
+                shard = known.get(parent)
+
+            if shard is not None and known.get(key, shard) != shard:
+                shard = None
+
+            result.append((key, shard))
+
+        new_routes = dict((key, shard) for key, shard in result if shard is not None and key not in known)
+        self._routing.put(new_routes.items())
+        return result, list(new_routes.keys())
+
+    def _route_of_study(self, study: Study) -> tuple[str, str, int]:
+        try:
+            return study.study_uid, None, self.shard_of_patient(study.patient.patient_id)
+        except AttributeError:
+            return study.study_uid, None, None
+
+    def _route_of_series(self, series: Series) -> tuple[str, str, int]:
+        try:
+            return series.series_uid, series.study.study_uid, self.shard_of_patient(series.study.patient.patient_id)
+        except AttributeError:
+            return series.series_uid, getattr(series.study, "study_uid", None), None
+
+    def _route_of_instance(self, instance: Instance) -> tuple[str, str, int]:
+        try:
+            return (instance.instance_uid, instance.series.series_uid,
+                    self.shard_of_patient(instance.series.study.patient.patient_id))
+        except AttributeError:
+            return instance.instance_uid, getattr(instance.series, "series_uid", None), None
+
+    @staticmethod
+    def _uids_below_studies(shard: BasicDicomDatabase, study_uids: list[str]) -> list[str]:
+        series_uids = [series.series_uid for study_uid in study_uids
+                       for series in shard.iter_series_to_study(study_uid)]
+        instance_uids = [instance.instance_uid for series_uid in series_uids
+                         for instance in shard.iter_instances_to_series(series_uid)]
+        return series_uids + instance_uids
+    # endregion
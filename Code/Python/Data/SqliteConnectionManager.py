@@ -0,0 +1,174 @@
+import pathlib
+import sqlite3
+import threading
+
+
+class SqliteConnectionManager:
+    """
+    Provides the sqlite3 connections to one database file, all configured alike.
+    By default, every thread gets its own connection, created on first use; alternatively, a single connection
+    is shared by all threads (the caller must then serialize the calls).
+    The journal mode and the pragmas of every connection are taken from a profile:
+    - "durable": WAL journal, synchronous=FULL; no transaction committed is lost, even on power failure.
+    - "throughput": WAL journal, synchronous=NORMAL, large page cache and memory-mapped I/O; the most recent
+      transactions may be rolled back after a power failure, but the database stays consistent.
+    """
+    # region Protected Data
+    _profiles: dict[str, dict[str, object]] = {
+        "durable": {
+            "synchronous": "FULL",
+            "cache_size": -16_384,          # KiB
+            "mmap_size": 0,
+        },
+        "throughput": {
+            "synchronous": "NORMAL",
+            "cache_size": -262_144,         # KiB
+            "mmap_size": 268_435_456,       # bytes
+        },
+    }
+    # endregion
+
+    # region Construction
+    def __init__(self, database_file_name: str, profile: str = "durable", per_thread: bool = True,
+                 read_only: bool = False, cached_statements: int = 128, **pragmas):
+        """
+        Creates an instance of SqliteConnectionManager. No connection is opened yet.
+        :param database_file_name: The path to the database file.
+        :param profile: The name of the pragma profile: "durable" or "throughput".
+        :param per_thread: If True, every thread gets its own connection; otherwise one connection is shared.
+                           An in-memory database always uses a shared connection.
+        :param read_only: If True, the connections are opened read-only.
+        :param cached_statements: Size of the sqlite3 statement cache of every connection.
+        :param pragmas: Pragmas overriding the values of the profile, e.g. cache_size=-65536.
+        :exception: ValueError, if the profile is unknown.
+        """
+        if profile not in self._profiles:
+            raise ValueError(f"unknown connection profile '{profile}'")
+
+        self._database_file_name = database_file_name
+        self._profile = profile
+        self._pragmas = {**self._profiles[profile], **pragmas}
+        self._per_thread = per_thread and database_file_name != ":memory:"
+        self._read_only = read_only
+        self._cached_statements = cached_statements
+
+        self._local = threading.local()
+        self._shared: sqlite3.Connection = None
+        self._connections: list[tuple[threading.Thread, sqlite3.Connection]] = []   # (owning thread, connection)
+        self._lock = threading.Lock()
+    # endregion
+
+    # region Properties
+    @property
+    def profile(self) -> str:
+        """
+        Gets the name of the pragma profile.
+        :return: The name of the profile.
+        """
+        return self._profile
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        Gets the connection of the calling thread, opening it if necessary.
+        :return: The connection.
+        """
+        if not self._per_thread:
+            with self._lock:
+                if self._shared is None:
+                    self._shared = self._connect()
+                    self._connections.append((threading.current_thread(), self._shared))
+
+                return self._shared
+
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            connection = self._connect()
+            self._local.connection = connection
+
+            with self._lock:
+                self._release_finished_threads()
+                self._connections.append((threading.current_thread(), connection))
+
+        return connection
+
+    @property
+    def number_of_connections(self) -> int:
+        """
+        Gets the number of open connections.
+        :return: The number of connections.
+        """
+        with self._lock:
+            return len(self._connections)
+    # endregion
+
+    # region Management
+    def create_connection(self) -> sqlite3.Connection:
+        """
+        Opens an additional connection, configured like the others, e.g. for a long-running backup.
+        The connection is not managed: the caller must close it.
+        :return: The connection.
+        """
+        return self._connect()
+
+    def interrupt(self):
+        """
+        Aborts the statements currently running on any of the connections.
+        :return: None
+        """
+        with self._lock:
+            for thread, connection in self._connections:
+                connection.interrupt()
+
+    def close(self):
+        """
+        Closes all connections. Threads asking for a connection afterwards get a new one.
+        :return: None
+        """
+        with self._lock:
+            for thread, connection in self._connections:
+                connection.close()
+
+            self._connections.clear()
+            self._shared = None
+            self._local = threading.local()
+    # endregion
+
+    # region Protected Auxiliary
+    def _connect(self) -> sqlite3.Connection:
+        # Connections are never used by two threads at once, but they are closed by the thread calling close().
+        if self._read_only:
+            uri = pathlib.Path(self._database_file_name).resolve().as_uri() + "?mode=ro"
+            connection = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                                         cached_statements=self._cached_statements)
+        else:
+            connection = sqlite3.connect(self._database_file_name, check_same_thread=False,
+                                         cached_statements=self._cached_statements)
+            # the journal mode is persistent, but can only be set through a writable connection
+            connection.execute("PRAGMA journal_mode = WAL")
+
+        for name, value in self._pragmas.items():
+            connection.execute(f"PRAGMA {name} = {value}")
+
+        # assure return data as dictionary:
+        connection.row_factory = sqlite3.Row
+
+        return connection
+
+    def _release_finished_threads(self):
+        """
+        Closes the per-thread connections of threads that have terminated (e.g. short-lived or recycled pool threads).
+        Must be called while holding the lock.
+        :return: None
+        """
+        alive = []
+
+        for thread, connection in self._connections:
+            if thread.is_alive():
+                alive.append((thread, connection))
+            else:
+                connection.close()
+
+        self._connections = alive
+    # endregion
@@ -67,5 +67,6 @@ def is_dataset_valid(dataset: pydicom.dataset) -> bool:
                len(str(series_uid)) > 0 and \
                len(str(instance_uid)) > 0
 
-    except ValueError:
+    except (ValueError, KeyError):
+        # newer pydicom versions raise KeyError for missing elements
         return False
@@ -3,6 +3,8 @@ import pydicom as dicom
 
 from Data.BasicDicomDatabase import BasicDicomDatabase
 from Data.BasicDicomStorage import BasicDicomStorage
+from Data.DatabaseMaintenance import DatabaseMaintenance, MaintenanceMetrics
+from Data.InstrumentedDicomDatabase import InstrumentedDicomDatabase, QueryStatistics
 from DicomStuff.DicomMetadata import DicomMetadata
 from Taxons.Patient import Patient
 from Taxons.Series import Series
@@ -61,7 +63,8 @@ class PykkamiManager:
     def __init__(self):
         self._patient_cache: list[Patient] = []
         self._database = BasicDicomDatabase()
-        self._dicomStorage = BasicDicomStorage()
+        self._dicomStorage = BasicDicomStorage(self._database)
+        self._maintenance: DatabaseMaintenance = None
 
     # endregion
 
@@ -82,6 +85,76 @@ class PykkamiManager:
     def initialize_storage(self, image_storage_root):
         self._dicomStorage.initialize(image_storage_root)
 
+    # region Instrumentation
+    @property
+    def query_statistics(self) -> QueryStatistics:
+        """
+        Gets a snapshot of the query statistics of the database (see InstrumentedDicomDatabase.statistics).
+        :return: The statistics, or None, if the instrumentation was never enabled.
+        """
+        if not isinstance(self._database, InstrumentedDicomDatabase):
+            return None
+
+        return self._database.statistics
+
+    def enable_query_instrumentation(self, slow_query_threshold: float = 0.1):
+        """
+        Starts recording the latencies of the database calls. On the first call, the database is wrapped into an
+        InstrumentedDicomDatabase; without it, the calls are not instrumented at all.
+        :param slow_query_threshold: The duration in seconds from which a call is logged as slow.
+        :return: None
+        """
+        if not isinstance(self._database, InstrumentedDicomDatabase):
+            self._database = InstrumentedDicomDatabase(self._database)
+            self._dicomStorage.database = self._database
+
+        self._database.slow_query_threshold = slow_query_threshold
+        self._database.enabled = True
+
+    def disable_query_instrumentation(self):
+        """
+        Stops recording the latencies of the database calls; the statistics recorded so far are kept.
+        :return: None
+        """
+        if isinstance(self._database, InstrumentedDicomDatabase):
+            self._database.enabled = False
+    # endregion
+
+    # region Maintenance
+    @property
+    def maintenance_metrics(self) -> MaintenanceMetrics:
+        """
+        Gets a snapshot of the metrics of the background maintenance (see DatabaseMaintenance.metrics).
+        :return: The metrics, or None, if the maintenance was never started.
+        """
+        if self._maintenance is None:
+            return None
+
+        return self._maintenance.metrics
+
+    def start_maintenance(self, **settings):
+        """
+        Starts the background maintenance of the database (WAL checkpoints, incremental vacuum, ANALYZE).
+        A maintenance running already is stopped and replaced; its metrics are discarded.
+        :param settings: The intervals and limits of the maintenance, e.g. vacuum_pages=256
+                         (see DatabaseMaintenance.__init__).
+        :return: None
+        """
+        self.stop_maintenance()
+
+        self._maintenance = DatabaseMaintenance(self._database, **settings)
+        self._maintenance.start()
+
+    def stop_maintenance(self):
+        """
+        Stops the background maintenance; must be called before the database is closed.
+        The metrics recorded so far are kept.
+        :return: None
+        """
+        if self._maintenance is not None:
+            self._maintenance.stop()
+    # endregion
+
     # region Properties
     @property
     def patientCache(self):
@@ -0,0 +1,113 @@
+"""
+Benchmark of BasicDicomDatabase.backup: throughput of the copy for several step sizes, and the rate of a concurrent
+ingest (one instance insert per commit) while the backup runs, compared with the rate without backup.
+The database is filled with series of 100 instances until it reaches the given size; use a few thousand MB
+to measure on a multi-GB archive.
+Run from the Code/Python folder:
+    python -m benchmarks.backup_benchmark [database_size_in_MB]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from Data.BasicDicomDatabase import BasicDicomDatabase
+from Taxons.Instance import Instance
+from Taxons.Patient import Patient
+from Taxons.Series import Series
+from Taxons.Study import Study
+import DataTypes
+
+
+def fill(database: BasicDicomDatabase, database_file_path: str, size_in_mb: int):
+    i = 0
+
+    while os.path.getsize(database_file_path) < size_in_mb * 2 ** 20:
+        with database.transaction():
+            for j in range(100):
+                # explicit UIDs: generated ones may collide when created in a tight loop
+                patient = Patient()
+                patient.patient_id = f"P{i}"
+                study = Study(f"1.2.{i}")
+                patient.add_study(study)
+                series = Series(f"1.2.{i}.1")
+                study.add_series(series)
+                instances = []
+
+                for k in range(100):
+                    instance = Instance(f"{series.series_uid}.{k + 1}")
+                    instance.instance_number = k
+                    instance.instance_position_patient = DataTypes.Point3D(0.0, 0.0, float(k))
+                    instance.file_name = f"{study.study_uid}/{series.series_uid}/{instance.instance_uid}.dcm"
+                    series.add_instance(instance)
+                    instances.append(instance)
+
+                database.insert_patient(patient)
+                database.insert_study(study)
+                database.insert_series(series)
+                database.insert_instances(instances)
+                i += 1
+
+        database._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def ingest(database: BasicDicomDatabase, stop: threading.Event, counts: list[int]):
+    series = Series("1.2.0.1")
+    k = 0
+
+    while not stop.is_set():
+        instance = Instance(f"9.{time.perf_counter_ns()}.{k}")
+        series.add_instance(instance)
+        database.insert_instance(instance)
+        k += 1
+
+    counts.append(k)
+
+
+def measure_ingest(database: BasicDicomDatabase, action) -> tuple[float, float]:
+    """
+    Runs an action while another thread ingests.
+    :return: The seconds the action took and the ingest rate in inserts per second meanwhile.
+    """
+    stop = threading.Event()
+    counts = []
+    thread = threading.Thread(target=ingest, args=(database, stop, counts))
+    thread.start()
+    start = time.perf_counter()
+
+    try:
+        action()
+    finally:
+        elapsed = time.perf_counter() - start
+        stop.set()
+        thread.join()
+
+    return elapsed, counts[0] / elapsed
+
+
+def run(size_in_mb: int):
+    directory = tempfile.mkdtemp()
+    database_file_path = os.path.join(directory, "benchmark.db3")
+    target_path = os.path.join(directory, "backup.db3")
+
+    database = BasicDicomDatabase(profile="throughput")
+    database.open(database_file_path)
+    print(f"filling the database to {size_in_mb} MB ...")
+    fill(database, database_file_path, size_in_mb)
+    size = os.path.getsize(database_file_path) / 2 ** 20
+
+    elapsed, rate = measure_ingest(database, lambda: time.sleep(2.0))
+    print(f"{'no backup':<28} {'':>10} {rate:10.0f} inserts/s")
+
+    for pages_per_step, sleep in [(-1, 0.0), (4096, 0.0), (1024, 0.0), (1024, 0.01)]:
+        elapsed, rate = measure_ingest(database, lambda: database.backup(target_path, pages_per_step, sleep))
+        label = f"pages {pages_per_step}, sleep {sleep}"
+        print(f"{label:<28} {size / elapsed:7.1f} MB/s {rate:10.0f} inserts/s")
+        os.remove(target_path)
+
+    database.close()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 256)
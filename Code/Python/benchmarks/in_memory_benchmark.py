@@ -0,0 +1,85 @@
+"""
+Benchmark of InMemoryDicomDatabase against BasicDicomDatabase on the workloads of the unit tests and batch converters:
+single-object inserts (one commit each), selections by key, hierarchy selections and deletions.
+Run from the Code/Python folder:
+    python -m benchmarks.in_memory_benchmark [number_of_series]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from Data.BasicDicomDatabase import BasicDicomDatabase
+from Data.IDicomDatabase import IDicomDatabase
+from Data.InMemoryDicomDatabase import InMemoryDicomDatabase
+from Taxons.Instance import Instance
+from Taxons.Patient import Patient
+from Taxons.Series import Series
+from Taxons.Study import Study
+import DataTypes
+
+
+def create_patients(number_of_series: int) -> list[Patient]:
+    patients = []
+
+    for i in range(number_of_series):
+        # explicit UIDs: generated ones may collide when created in a tight loop
+        patient = Patient()
+        patient.patient_id = f"P{i}"
+        study = Study(f"1.2.{i}")
+        patient.add_study(study)
+        series = Series(f"1.2.{i}.1")
+        study.add_series(series)
+
+        for j in range(10):
+            instance = Instance(f"{series.series_uid}.{j + 1}")
+            instance.instance_number = j
+            instance.instance_position_patient = DataTypes.Point3D(0.0, 0.0, float(j))
+            series.add_instance(instance)
+
+        patients.append(patient)
+
+    return patients
+
+
+def run_workload(database: IDicomDatabase, patients: list[Patient]) -> float:
+    start = time.perf_counter()
+
+    for patient in patients:
+        study = list(patient._studies.values())[0]
+        series = list(study._seriez.values())[0]
+
+        database.insert_patient(patient)
+        database.insert_study(study)
+        database.insert_series(series)
+
+        for instance in series.instances.values():
+            database.insert_instance(instance)
+
+    for patient in patients:
+        database.select_patient(patient.patient_id)
+        database.select_patient_tree(patient.patient_id)
+
+    for patient in patients:
+        database.delete_patient(patient.patient_id)
+
+    return time.perf_counter() - start
+
+
+def run(number_of_series: int):
+    patients = create_patients(number_of_series)
+    elapsed = {}
+
+    for label, database in [("BasicDicomDatabase", BasicDicomDatabase()),
+                            ("InMemoryDicomDatabase", InMemoryDicomDatabase())]:
+        database.open(os.path.join(tempfile.mkdtemp(), "benchmark.db3"))
+        elapsed[label] = run_workload(database, patients)
+        database.close()
+
+        print(f"{label:<24} {elapsed[label] * 1e3:10.1f} ms")
+
+    print(f"speed-up: {elapsed['BasicDicomDatabase'] / elapsed['InMemoryDicomDatabase']:.1f}x")
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,55 @@
+"""
+Benchmark of the patient name search (type-ahead) with and without the FTS5 trigram name index.
+Run from the Code/Python folder:
+    python -m benchmarks.name_search_benchmark [number_of_patients]
+"""
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+from Data.BasicDicomDatabase import BasicDicomDatabase
+from Taxons.Patient import Patient
+
+
+def random_name() -> str:
+    family_name = "".join(random.choices(string.ascii_lowercase, k=random.randint(4, 10))).capitalize()
+    given_name = "".join(random.choices(string.ascii_lowercase, k=random.randint(3, 8))).capitalize()
+    return f"{family_name}^{given_name}"
+
+
+def create_patients(number_of_patients: int) -> list[Patient]:
+    patients = []
+
+    for i in range(number_of_patients):
+        patient = Patient(str(i + 1))
+        patient.name = random_name()
+        patients.append(patient)
+
+    return patients
+
+
+def run(number_of_patients: int, number_of_queries: int = 100):
+    patients = create_patients(number_of_patients)
+    patterns = [patient.name[1:5] for patient in random.sample(patients, number_of_queries)]
+
+    for name_index in [False, True]:
+        database = BasicDicomDatabase(name_index=name_index)
+        database.open(os.path.join(tempfile.mkdtemp(), "benchmark.db3"))
+        database.insert_patients(patients)
+
+        start = time.perf_counter()
+        for pattern in patterns:
+            database.select_patients_by_name_pattern(pattern)
+        elapsed = time.perf_counter() - start
+
+        print(f"name_index={name_index!s:<5} {number_of_patients} patients: "
+              f"{elapsed / number_of_queries * 1e3:8.3f} ms/query")
+
+        database.close()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
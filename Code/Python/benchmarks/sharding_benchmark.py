@@ -0,0 +1,85 @@
+"""
+Benchmark of the write throughput of ShardedDicomDatabase against BasicDicomDatabase: several threads ingest
+patients with one study, one series and ten instances each (one batch per series), concurrently.
+Run from the Code/Python folder:
+    python -m benchmarks.sharding_benchmark [number_of_threads] [number_of_series_per_thread]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from Data.BasicDicomDatabase import BasicDicomDatabase
+from Data.IDicomDatabase import IDicomDatabase
+from Data.ShardedDicomDatabase import ShardedDicomDatabase
+from Taxons.Instance import Instance
+from Taxons.Patient import Patient
+from Taxons.Series import Series
+from Taxons.Study import Study
+import DataTypes
+
+
+def create_patients(thread: int, number_of_series: int) -> list[Patient]:
+    patients = []
+
+    for i in range(number_of_series):
+        # explicit UIDs: generated ones may collide when created in a tight loop
+        patient = Patient()
+        patient.patient_id = f"P{thread}.{i}"
+        study = Study(f"1.{thread}.{i}")
+        patient.add_study(study)
+        series = Series(f"1.{thread}.{i}.1")
+        study.add_series(series)
+
+        for j in range(10):
+            instance = Instance(f"{series.series_uid}.{j + 1}")
+            instance.instance_number = j
+            instance.instance_position_patient = DataTypes.Point3D(0.0, 0.0, float(j))
+            series.add_instance(instance)
+
+        patients.append(patient)
+
+    return patients
+
+
+def ingest(database: IDicomDatabase, patients: list[Patient]):
+    for patient in patients:
+        study = list(patient._studies.values())[0]
+        series = list(study._seriez.values())[0]
+
+        database.insert_patient(patient)
+        database.insert_study(study)
+        database.insert_series(series)
+        database.insert_instances(list(series.instances.values()))
+
+
+def run_workload(database: IDicomDatabase, work: list[list[Patient]]) -> float:
+    threads = [threading.Thread(target=ingest, args=(database, patients)) for patients in work]
+    start = time.perf_counter()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    return time.perf_counter() - start
+
+
+def run(number_of_threads: int, number_of_series: int):
+    work = [create_patients(thread, number_of_series) for thread in range(number_of_threads)]
+    total = number_of_threads * number_of_series
+
+    for label, database in [("BasicDicomDatabase", BasicDicomDatabase()),
+                            ("ShardedDicomDatabase(2)", ShardedDicomDatabase(2)),
+                            (f"ShardedDicomDatabase({number_of_threads})", ShardedDicomDatabase(number_of_threads))]:
+        database.open(os.path.join(tempfile.mkdtemp(), "benchmark.db3"))
+        elapsed = run_workload(database, work)
+        database.close()
+
+        print(f"{label:<28} {total / elapsed:10.0f} series/s")
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 4, int(sys.argv[2]) if len(sys.argv) > 2 else 250)
@@ -0,0 +1,100 @@
+"""
+Microbenchmark of the per-call time of select_instance and insert_instance.
+Compares the former f-string statements (a new statement text per call) with the parameterized
+statements of the registry, executed without and with the sqlite3 statement cache.
+Run from the Code/Python folder:
+    python -m benchmarks.statement_cache_benchmark [number_of_calls]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from Data.BasicDicomDatabase import BasicDicomDatabase
+from Taxons.Instance import Instance
+from Taxons.Patient import Patient
+from Taxons.Series import Series
+from Taxons.Study import Study
+import DataTypes
+
+
+def create_database(cached_statements: int) -> tuple[BasicDicomDatabase, Series]:
+    database = BasicDicomDatabase(cached_statements=cached_statements)
+    database.open(os.path.join(tempfile.mkdtemp(), "benchmark.db3"))
+
+    patient = Patient()
+    study = Study()
+    patient.add_study(study)
+    series = Series()
+    study.add_series(series)
+
+    database.insert_patient(patient)
+    database.insert_study(study)
+    database.insert_series(series)
+
+    return database, series
+
+
+def create_instances(series: Series, number_of_calls: int) -> list[Instance]:
+    instances = []
+
+    for i in range(number_of_calls):
+        # explicit UIDs: generated ones may collide when created in a tight loop
+        instance = Instance(f"{series.series_uid}.{i + 1}")
+        instance.instance_number = i
+        instance.instance_position_patient = DataTypes.Point3D(0.0, 0.0, float(i))
+        instance.file_name = f"/tmp/{instance.instance_uid}.dcm"
+        series.add_instance(instance)
+        instances.append(instance)
+
+    return instances
+
+
+def legacy_insert_instance(database: BasicDicomDatabase, instance: Instance):
+    position = instance.instance_position_patient
+    sql = f"INSERT INTO instance VALUES('{instance.instance_uid}', '{instance.series.series_uid}', " \
+          f"{instance.instance_number}, {position[0]}, {position[1]}, {position[2]}, '{instance.file_name}')"
+    database._connection.execute(sql)
+    database._connection.commit()
+
+
+def legacy_select_instance(database: BasicDicomDatabase, instance_uid: str):
+    sql = f"SELECT * FROM instance WHERE `instance_uid` = '{instance_uid}'"
+    return database._get_instance(database._connection.execute(sql).fetchone())
+
+
+def measure(label: str, function, arguments: list) -> float:
+    start = time.perf_counter()
+    for argument in arguments:
+        function(argument)
+    elapsed = time.perf_counter() - start
+
+    per_call = elapsed / len(arguments) * 1e6
+    print(f"{label:<54} {per_call:9.2f} us/call")
+    return per_call
+
+
+def run(number_of_calls: int):
+    variants = [
+        ("f-string statements", 0, True),
+        ("parameterized, cached_statements=0", 0, False),
+        ("parameterized, cached_statements=128", 128, False),
+    ]
+
+    for label, cached_statements, legacy in variants:
+        database, series = create_database(cached_statements)
+        instances = create_instances(series, number_of_calls)
+        uids = [instance.instance_uid for instance in instances]
+
+        if legacy:
+            measure(f"insert_instance: {label}", lambda i: legacy_insert_instance(database, i), instances)
+            measure(f"select_instance: {label}", lambda u: legacy_select_instance(database, u), uids)
+        else:
+            measure(f"insert_instance: {label}", database.insert_instance, instances)
+            measure(f"select_instance: {label}", database.select_instance, uids)
+
+        database.close()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
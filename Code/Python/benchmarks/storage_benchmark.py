@@ -0,0 +1,100 @@
+"""
+Benchmark of BasicDicomStorage.store_datasets: throughput of storing a study of synthetic 16 bit images one by one
+with store_dataset, compared with store_datasets for several numbers of workers. The file names are entered into
+the database in both cases. Run it on the disk to measure by passing a folder on that disk.
+Run from the Code/Python folder:
+    python -m benchmarks.storage_benchmark [number_of_images] [storage_folder]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, MRImageStorage
+
+from Data.BasicDicomDatabase import BasicDicomDatabase
+from Data.BasicDicomStorage import BasicDicomStorage
+from Taxons.Instance import Instance
+from Taxons.Patient import Patient
+from Taxons.Series import Series
+from Taxons.Study import Study
+
+_rows = 512
+_columns = 512
+
+
+def create_datasets(database: BasicDicomDatabase, run: int, number_of_images: int) -> list[Dataset]:
+    patient = Patient()
+    patient.patient_id = f"P{run}"
+    study = Study(f"1.2.{run}")
+    patient.add_study(study)
+    series = Series(f"1.2.{run}.1")
+    study.add_series(series)
+    pixels = bytes(2 * _rows * _columns)
+    datasets = []
+
+    for i in range(number_of_images):
+        series.add_instance(Instance(f"{series.series_uid}.{i + 1}"))
+
+        dataset = Dataset()
+        dataset.file_meta = FileMetaDataset()
+        dataset.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        dataset.file_meta.MediaStorageSOPClassUID = MRImageStorage
+        dataset.file_meta.MediaStorageSOPInstanceUID = f"{series.series_uid}.{i + 1}"
+        dataset.PatientID = patient.patient_id
+        dataset.StudyInstanceUID = study.study_uid
+        dataset.SeriesInstanceUID = series.series_uid
+        dataset.SOPClassUID = MRImageStorage
+        dataset.SOPInstanceUID = f"{series.series_uid}.{i + 1}"
+        dataset.InstanceNumber = i + 1
+        dataset.Rows = _rows
+        dataset.Columns = _columns
+        dataset.BitsAllocated = 16
+        dataset.BitsStored = 16
+        dataset.HighBit = 15
+        dataset.PixelRepresentation = 0
+        dataset.SamplesPerPixel = 1
+        dataset.PhotometricInterpretation = "MONOCHROME2"
+        dataset.PixelData = pixels
+        datasets.append(dataset)
+
+    database.insert_patient(patient)
+    database.insert_study(study)
+    database.insert_series(series)
+    database.insert_instances(series.instances.values())
+    return datasets
+
+
+def run(number_of_images: int, folder: str):
+    directory = tempfile.mkdtemp(dir=folder)
+    database = BasicDicomDatabase()
+    database.open(os.path.join(directory, "benchmark.db3"))
+    storage = BasicDicomStorage(database)
+    size = number_of_images * 2 * _rows * _columns / 2 ** 20
+
+    try:
+        for run_number, workers in enumerate([None, 1, 2, 4, 8]):
+            storage.initialize(os.path.join(directory, f"run{run_number}"))
+            datasets = create_datasets(database, run_number, number_of_images)
+            start = time.perf_counter()
+
+            if workers is None:
+                for dataset in datasets:
+                    storage.store_dataset(dataset)
+            else:
+                results = storage.store_datasets(datasets, workers=workers)
+                assert all(result.error is None for result in results)
+
+            elapsed = time.perf_counter() - start
+            label = "store_dataset" if workers is None else f"store_datasets, {workers} workers"
+            print(f"{label:<28} {number_of_images / elapsed:8.0f} images/s {size / elapsed:8.1f} MB/s")
+            shutil.rmtree(storage.root_folder)
+    finally:
+        database.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000, sys.argv[2] if len(sys.argv) > 2 else None)
@@ -391,4 +391,13 @@ class Modality(Enum):
     US = 58,
     VA = 59,
     XA = 60,
-    XC = 61
\ No newline at end of file
+    XC = 61
+
+
+class ChangeOperation(Enum):
+    """
+    Kind of a change recorded in the change log of a database.
+    """
+    Insert = 1,
+    Update = 2,
+    Delete = 3
@@ -0,0 +1,87 @@
+import asyncio
+import inspect
+import unittest
+from unit_tests import dicom_database_tests
+from unit_tests.taxon_creation import create_patient
+from Data.AsyncDicomDatabase import AsyncDicomDatabase
+
+
+class SynchronousAdapter:
+    """
+    Runs the coroutines of an AsyncDicomDatabase to completion on a private event loop,
+    so that the synchronous database tests can be run against it.
+    """
+    def __init__(self, database: AsyncDicomDatabase):
+        self._database = database
+        self._loop = asyncio.new_event_loop()
+
+    def __getattr__(self, name):
+        method = getattr(self._database, name)
+
+        def call(*args, **kwargs):
+            result = method(*args, **kwargs)
+
+            if inspect.isasyncgen(result):
+                return iter(self._loop.run_until_complete(self._collect(result)))
+
+            result = self._loop.run_until_complete(result)
+
+            if name == "close":
+                self._loop.close()
+
+            return result
+
+        return call
+
+    @staticmethod
+    async def _collect(iterator) -> list:
+        return [item async for item in iterator]
+
+
+class AsyncDicomDatabaseTests(dicom_database_tests.DicomDataBaseTests):
+    def _create_database(self, **kwargs):
+        return SynchronousAdapter(AsyncDicomDatabase(**kwargs))
+
+    @unittest.skip("needs direct access to the sqlite connection")
+    def test_batch_upsert_of_instances_rewrites_only_changed_rows(self):
+        pass
+
+
+class AsyncDicomDatabaseCancellationTests(unittest.IsolatedAsyncioTestCase):
+    _database_file_path = dicom_database_tests.DicomDataBaseTests._database_file_path
+
+    async def asyncSetUp(self):
+        self._database = AsyncDicomDatabase(number_of_readers=2)
+        await self._database.open(self._database_file_path)
+        await self._database.insert_patients([create_patient() for i in range(200)])
+
+    async def asyncTearDown(self):
+        await self._database.reset()
+        await self._database.close()
+
+    async def test_concurrent_reads_succeed(self):
+        results = await asyncio.gather(*[self._database.select_all_patients() for i in range(8)])
+
+        self.assertEqual([200] * 8, [len(result) for result in results])
+
+    async def test_cancelled_reads_return_readers_to_pool(self):
+        tasks = [asyncio.create_task(self._database.select_all_patients()) for i in range(6)]
+        await asyncio.sleep(0)
+
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.assertEqual(200, len(await self._database.select_all_patients()))
+
+    async def test_abandoned_iteration_returns_reader_to_pool(self):
+        iterator = self._database.iter_all_patients(batch_size=10)
+        await anext(iterator)
+        await iterator.aclose()
+
+        for i in range(3):
+            self.assertEqual(200, len(await self._database.select_all_patients()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import threading
+import unittest
+from unit_tests import dicom_database_tests
+from unit_tests.taxon_creation import create_patient
+from Data.BasicDicomDatabase import BasicDicomDatabase
+from Data.CachedDicomDatabase import CachedDicomDatabase
+
+
+class CachedDicomDatabaseTests(dicom_database_tests.DicomDataBaseTests):
+    def _create_database(self, **kwargs):
+        return CachedDicomDatabase(BasicDicomDatabase(**kwargs))
+
+    # region Cache tests
+    def test_repeated_selection_of_patient_hits_cache(self):
+        patient = create_patient()
+        self._database.insert_patient(patient)
+
+        for i in range(3):
+            self.assertEqual(patient.patient_id, self._database.select_patient(patient.patient_id).patient_id)
+
+        statistics = self._database.statistics["patient"]
+        self.assertEqual((2, 1, 1), (statistics.hits, statistics.misses, statistics.size))
+
+    def test_selection_of_missing_patient_is_not_cached(self):
+        patient = create_patient()
+
+        self.assertIsNone(self._database.select_patient(patient.patient_id))
+        self._database.insert_patient(patient)
+
+        self.assertIsNotNone(self._database.select_patient(patient.patient_id))
+
+    def test_update_of_patient_invalidates_entry(self):
+        patient = create_patient()
+        patient.name = "Before^Update"
+        self._database.insert_patient(patient)
+        self._database.select_patient(patient.patient_id)
+
+        patient.name = "After^Update"
+        self._database.upsert_patients([patient])
+
+        self.assertEqual("After^Update", self._database.select_patient(patient.patient_id).name)
+
+    def test_least_recently_used_patient_is_evicted(self):
+        self._database.close()
+        self._database = CachedDicomDatabase(BasicDicomDatabase(), patient_capacity=2)
+        self._database.open(self._database_file_path)
+
+        patients = [create_patient() for i in range(3)]
+        self._database.insert_patients(patients)
+
+        for patient in [patients[0], patients[1], patients[0], patients[2], patients[0]]:
+            self._database.select_patient(patient.patient_id)
+
+        statistics = self._database.statistics["patient"]
+        self.assertEqual((2, 3, 2), (statistics.hits, statistics.misses, statistics.size))
+
+    def test_deletion_of_instances_of_series_invalidates_instances(self):
+        patient = self._insert_hierarchy(1, 1, 3)
+        series = list(list(patient._studies.values())[0]._seriez.values())[0]
+
+        for instance_uid in series.instances.keys():
+            self.assertIsNotNone(self._database.select_instance(instance_uid))
+
+        self._database.delete_instances_of_series(series.series_uid)
+
+        for instance_uid in series.instances.keys():
+            self.assertIsNone(self._database.select_instance(instance_uid))
+
+    def test_deletion_of_instances_of_series_keeps_other_instances(self):
+        patient = self._insert_hierarchy(1, 2, 2)
+        seriez = list(list(patient._studies.values())[0]._seriez.values())
+
+        for series in seriez:
+            for instance_uid in series.instances.keys():
+                self._database.select_instance(instance_uid)
+
+        self._database.delete_instances_of_series(seriez[0].series_uid)
+
+        self.assertEqual(2, self._database.statistics["instance"].size)
+
+    def test_deletion_of_patient_keeps_cached_studies(self):
+        patient = self._insert_hierarchy(1, 1, 0)
+        other = self._insert_hierarchy(1, 1, 0)
+        study_uid = list(other._studies.keys())[0]
+        self._database.select_study(study_uid)
+
+        self._database.delete_patient(patient.patient_id)
+
+        self.assertEqual(1, self._database.statistics["study"].size)
+
+    def test_deletion_of_patient_invalidates_subtree(self):
+        patient = self._insert_hierarchy(1, 1, 2)
+        study = list(patient._studies.values())[0]
+        series = list(study._seriez.values())[0]
+        self._database.select_study(study.study_uid)
+        self._database.select_series(series.series_uid)
+
+        for instance_uid in series.instances.keys():
+            self._database.select_instance(instance_uid)
+
+        self._database.delete_patient(patient.patient_id)
+
+        self.assertIsNone(self._database.select_study(study.study_uid))
+        self.assertIsNone(self._database.select_series(series.series_uid))
+
+        for instance_uid in series.instances.keys():
+            self.assertIsNone(self._database.select_instance(instance_uid))
+
+    def test_rolled_back_transaction_leaves_no_cached_entry(self):
+        patient = create_patient()
+
+        with self.assertRaises(RuntimeError):
+            with self._database.transaction():
+                self._database.insert_patient(patient)
+                self.assertIsNotNone(self._database.select_patient(patient.patient_id))
+                raise RuntimeError()
+
+        self.assertIsNone(self._database.select_patient(patient.patient_id))
+
+    def test_uncommitted_patient_is_not_visible_to_other_threads(self):
+        patient = create_patient()
+        selected = []
+
+        def select_from_other_thread():
+            selected.append(self._database.select_patient(patient.patient_id))
+
+        with self.assertRaises(RuntimeError):
+            with self._database.transaction():
+                self._database.insert_patient(patient)
+                self.assertIsNotNone(self._database.select_patient(patient.patient_id))
+
+                thread = threading.Thread(target=select_from_other_thread)
+                thread.start()
+                thread.join()
+                raise RuntimeError()
+
+        self.assertEqual([None], selected)
+        self.assertEqual(0, self._database.statistics["patient"].size)
+    # endregion
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import os
+import tempfile
+import time
+import unittest
+from unit_tests.taxon_creation import create_patient
+from Data.BasicDicomDatabase import BasicDicomDatabase
+from Data.DatabaseMaintenance import DatabaseMaintenance
+from Data.InstrumentedDicomDatabase import InstrumentedDicomDatabase
+from Data.ShardedDicomDatabase import ShardedDicomDatabase
+from Management.PykkamiManager import PykkamiManager
+
+
+class DatabaseMaintenanceTests(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._database_file_path = os.path.join(self._directory.name, "maintenance_test.db3")
+        self._database = BasicDicomDatabase()
+        self._database.open(self._database_file_path)
+
+    def tearDown(self):
+        self._database.close()
+        self._directory.cleanup()
+
+    def _insert_and_delete_patients(self, count: int):
+        patients = [create_patient() for i in range(count)]
+
+        for patient in patients:
+            patient.name = patient.name + "x" * 2000
+
+        self._database.insert_patients(patients)
+
+        with self._database.transaction():
+            for patient in patients:
+                self._database.delete_patient(patient.patient_id)
+
+    # region Database tests
+    def test_incremental_vacuum_frees_pages_of_deleted_rows(self):
+        self._insert_and_delete_patients(200)
+        size = os.path.getsize(self._database_file_path)
+        self._database.checkpoint()
+
+        self.assertEqual(10, self._database.incremental_vacuum(10))
+        freed = self._database.incremental_vacuum()
+
+        self.assertGreater(freed, 50)
+        self.assertEqual(0, self._database.incremental_vacuum())
+        self._database.checkpoint()
+        self.assertLess(os.path.getsize(self._database_file_path), size)
+
+    def test_name_pattern_search_AFTER_INCREMENTAL_VACUUM_succeeds(self):
+        self._insert_and_delete_patients(50)
+        patient = create_patient()
+        self._database.insert_patient(patient)
+
+        self._database.incremental_vacuum()
+
+        self.assertEqual(1, len(self._database.select_patients_by_name_pattern(patient.name[:3])))
+
+    def test_incremental_vacuum_WITHIN_TRANSACTION_raises(self):
+        with self._database.transaction():
+            with self.assertRaises(UserWarning):
+                self._database.incremental_vacuum()
+
+    def test_optimize_analyzes_tables(self):
+        self._database.insert_patients([create_patient() for i in range(20)])
+
+        self._database.optimize()
+
+        sql = "SELECT COUNT(*) FROM `sqlite_master` WHERE `name` = 'sqlite_stat1'"
+        self.assertEqual(1, self._database._connection.execute(sql).fetchone()[0])
+
+    def test_checkpoint_copies_wal_pages(self):
+        self._database.insert_patients([create_patient() for i in range(20)])
+
+        log_pages, checkpointed_pages = self._database.checkpoint()
+
+        self.assertGreater(log_pages, 0)
+        self.assertEqual(log_pages, checkpointed_pages)
+    # endregion
+
+    # region Scheduler tests
+    def test_due_tasks_are_run_one_per_poll(self):
+        self._insert_and_delete_patients(100)
+        maintenance = DatabaseMaintenance(self._database, checkpoint_interval=0.0, vacuum_interval=0.0,
+                                          optimize_interval=0.0, idle_seconds=0.0)
+
+        self.assertEqual(["checkpoint", "vacuum", "optimize"], [maintenance.run_pending() for i in range(3)])
+
+        metrics = maintenance.metrics
+        self.assertEqual((1, 1, 1), (metrics.optimize_runs, metrics.vacuum_runs, metrics.checkpoint_runs))
+        self.assertGreater(metrics.pages_freed, 0)
+        self.assertGreater(metrics.wal_pages, 0)
+        self.assertGreater(metrics.seconds, 0.0)
+        self.assertEqual((0, 0), (metrics.deferred_polls, metrics.failures))
+
+    def test_tasks_are_not_run_before_their_interval(self):
+        maintenance = DatabaseMaintenance(self._database, checkpoint_interval=0.0, idle_seconds=0.0)
+
+        self.assertEqual("checkpoint", maintenance.run_pending())
+        self.assertEqual("checkpoint", maintenance.run_pending())
+        self.assertEqual(0, maintenance.metrics.vacuum_runs + maintenance.metrics.optimize_runs)
+
+        maintenance = DatabaseMaintenance(self._database)
+
+        self.assertIsNone(maintenance.run_pending())
+
+    def test_tasks_are_deferred_while_database_is_written(self):
+        maintenance = DatabaseMaintenance(self._database, checkpoint_interval=0.0, idle_seconds=0.2)
+
+        self.assertIsNone(maintenance.run_pending())
+        self._database.insert_patient(create_patient())
+        time.sleep(0.15)
+        self.assertIsNone(maintenance.run_pending())
+        time.sleep(0.25)
+        self.assertEqual("checkpoint", maintenance.run_pending())
+        self.assertEqual(2, maintenance.metrics.deferred_polls)
+
+    def test_maintenance_thread_runs_tasks(self):
+        maintenance = DatabaseMaintenance(InstrumentedDicomDatabase(self._database), checkpoint_interval=0.0,
+                                          idle_seconds=0.0, poll_interval=0.01)
+
+        maintenance.start()
+        self.assertTrue(maintenance.running)
+        time.sleep(0.2)
+        maintenance.stop()
+
+        self.assertFalse(maintenance.running)
+        self.assertGreater(maintenance.metrics.checkpoint_runs, 0)
+
+    def test_shards_are_maintained_one_by_one(self):
+        database = ShardedDicomDatabase(number_of_shards=2)
+        database.open(os.path.join(self._directory.name, "sharded_maintenance_test.db3"))
+        self.addCleanup(database.close)
+        maintenance = DatabaseMaintenance(database, checkpoint_interval=0.0, vacuum_interval=0.0,
+                                          optimize_interval=0.0, idle_seconds=0.0)
+
+        for i in range(6):
+            maintenance.run_pending()
+
+        metrics = maintenance.metrics
+        self.assertEqual((2, 2, 2), (metrics.optimize_runs, metrics.vacuum_runs, metrics.checkpoint_runs))
+    # endregion
+
+    # region Manager tests
+    def test_manager_maintenance_metrics(self):
+        manager = PykkamiManager()
+        manager.initialize_database(os.path.join(self._directory.name, "manager_test.db3"))
+        self.addCleanup(manager.database.close)
+        self.assertIsNone(manager.maintenance_metrics)
+
+        manager.start_maintenance(checkpoint_interval=0.0, idle_seconds=0.0, poll_interval=0.01)
+        time.sleep(0.2)
+        manager.stop_maintenance()
+
+        self.assertGreater(manager.maintenance_metrics.checkpoint_runs, 0)
+    # endregion
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,14 @@
+import os
+import re
+import sqlite3
+import tempfile
+import threading
 import unittest
 from unit_tests.taxon_creation import *
 from DicomStuff.DicomUidProvider import DicomUidProvider
-from Data.BasicDicomDatabase import BasicDicomDatabase
+from Data.BasicDicomDatabase import BasicDicomDatabase, Change
+from Data.IDicomDatabase import DeletionCounts, StudySummary, StudyFilter, SeriesFilter
+from enumerations import ChangeOperation
 
 
 class DicomDataBaseTests(unittest.TestCase):
@@ -9,12 +16,16 @@ class DicomDataBaseTests(unittest.TestCase):
     _database: BasicDicomDatabase = None
 
     def setUp(self):
-        self._database = BasicDicomDatabase()
+        self._database = self._create_database()
         self._database.open(self._database_file_path)
 
     def tearDown(self):
+        self._database.reset()
         self._database.close()
 
+    def _create_database(self, **kwargs):
+        return BasicDicomDatabase(**kwargs)
+
     # region Patient Management Tests
     def test_insertion_of_patient_NEW_PATIENT_succeeds(self):
         patient = create_patient()
@@ -105,6 +116,80 @@ class DicomDataBaseTests(unittest.TestCase):
         self.assertEqual(patient1.name, "Aardvark^Aaron")
         self.assertEqual(patient1.date_of_birth, date(1999, 9, 19))
         self.assertEqual(patient1.gender, Gender.Other)
+
+    def test_insertion_of_patient_QUOTE_IN_NAME_succeeds(self):
+        patient = create_patient()
+        patient.name = "O'Brien^Conan"
+
+        self._database.insert_patient(patient)
+
+        patient1 = self._database.select_patient(patient.patient_id)
+        self.assertEqual("O'Brien^Conan", patient1.name)
+        self.assertEqual(1, len(self._database.select_patients_by_name_pattern("O'Bri")))
+
+    def test_name_pattern_search_follows_updates_and_deletions(self):
+        patients = [create_patient() for i in range(5)]
+        for i, patient in enumerate(patients):
+            patient.name = f"Patient{i}^Test"
+        patients[1].name = "Aardvark^Aaron"
+        patients[2].name = "Aardvark^Berta"
+        self._database.insert_patients(patients)
+
+        patients[2].name = "Zebra^Berta"
+        self._database.update_patient(patients[2])
+        self._database.delete_patient(patients[1].patient_id)
+        patients[3].name = "aardvark^Carl"
+        self._database.update_patient(patients[3])
+
+        fetched = self._database.select_patients_by_name_pattern("Aardv")
+
+        self.assertEqual([patients[3].patient_id], [patient.patient_id for patient in fetched])
+        self.assertEqual(1, len(self._database.select_patients_by_name_pattern("a^B")))
+        self.assertEqual(1, len(self._database.select_patients_by_name_pattern("Ze")))
+
+    def test_name_pattern_search_AFTER_VACUUM_succeeds(self):
+        patients = [create_patient() for i in range(10)]
+        for i, patient in enumerate(patients):
+            patient.name = f"Patient{i}^Test"
+        self._database.insert_patients(patients)
+
+        for patient in patients[:5]:
+            self._database.delete_patient(patient.patient_id)
+
+        self._database.vacuum()
+
+        fetched = self._database.select_patients_by_name_pattern("Patient7^")
+
+        self.assertEqual([patients[7].patient_id], [patient.patient_id for patient in fetched])
+        self.assertEqual(0, len(self._database.select_patients_by_name_pattern("Patient2^")))
+
+    def test_name_pattern_search_WITHOUT_NAME_INDEX_succeeds(self):
+        self._database.close()
+        self._database = self._create_database(name_index=False)
+        self._database.open(self._database_file_path)
+
+        patients = [create_patient() for i in range(5)]
+        patients[1].name = "Aardvark^Aaron"
+        self._database.insert_patients(patients)
+
+        self.assertEqual(1, len(self._database.select_patients_by_name_pattern("ardvark^A")))
+
+    def test_bulk_insertion_of_patients_succeeds(self):
+        patients = [create_patient() for i in range(20)]
+
+        failures = self._database.insert_patients(patients)
+
+        self.assertEqual(0, len(failures))
+        self.assertEqual(20, len(self._database.select_all_patients()))
+
+    def test_bulk_insertion_of_patients_DUPLICATES_reports_failures(self):
+        patients = [create_patient() for i in range(10)]
+        self._database.insert_patient(patients[3])
+
+        failures = self._database.insert_patients(patients + [patients[7]])
+
+        self.assertEqual([patients[3].patient_id, patients[7].patient_id], failures)
+        self.assertEqual(10, len(self._database.select_all_patients()))
     # endregion
 
     # region Study management tests
@@ -148,6 +233,8 @@ class DicomDataBaseTests(unittest.TestCase):
         number_of_studies = 4
         studies = [patient.add_study(create_study()) for i in range(number_of_studies)]
 
+        self._database.insert_patient(patient)
+
         for study_uid in patient._studies:
             study = patient._studies[study_uid]
             patient.add_study(study)
@@ -163,6 +250,8 @@ class DicomDataBaseTests(unittest.TestCase):
         number_of_studies = 4
         studies = [patient.add_study(create_study()) for i in range(number_of_studies)]
 
+        self._database.insert_patient(patient)
+
         for study_uid in patient._studies:
             study = patient._studies[study_uid]
             patient.add_study(study)
@@ -180,6 +269,8 @@ class DicomDataBaseTests(unittest.TestCase):
         number_of_studies = 4
         studies = [patient.add_study(create_study()) for i in range(number_of_studies)]
 
+        self._database.insert_patient(patient)
+
         for study_uid in patient._studies:
             study = patient._studies[study_uid]
             patient.add_study(study)
@@ -199,6 +290,8 @@ class DicomDataBaseTests(unittest.TestCase):
         number_of_studies = 4
         studies = [patient.add_study(create_study()) for i in range(number_of_studies)]
 
+        self._database.insert_patient(patient)
+
         for study_uid in patient._studies:
             study = patient._studies[study_uid]
             patient.add_study(study)
@@ -216,6 +309,8 @@ class DicomDataBaseTests(unittest.TestCase):
         patient = create_patient()
         study = create_study()
         patient.add_study(study)
+        self._database.insert_patient(patient)
+        self._database.insert_study(study)
 
         physician = study.referring_physician_name
 
@@ -460,4 +555,895 @@ class DicomDataBaseTests(unittest.TestCase):
         self.assertIsNotNone(instances)
 
         self.assertEqual(0, len(instances))
+
+    def test_bulk_insertion_of_hierarchy_succeeds(self):
+        patient = create_patient()
+        studies = [create_study() for i in range(2)]
+        seriez = [create_series() for i in range(4)]
+        instances = [create_instance() for i in range(40)]
+
+        for study in studies:
+            patient.add_study(study)
+        for i, series in enumerate(seriez):
+            studies[i % 2].add_series(series)
+        for i, instance in enumerate(instances):
+            seriez[i % 4].add_instance(instance)
+
+        self.assertEqual([], self._database.insert_patients([patient]))
+        self.assertEqual([], self._database.insert_studies(studies))
+        self.assertEqual([], self._database.insert_series_many(seriez))
+        self.assertEqual([], self._database.insert_instances(instances))
+
+        self.assertEqual(2, len(self._database.select_studies_to_patient(patient.patient_id)))
+        self.assertEqual(2, len(self._database.select_series_to_study(studies[0].study_uid)))
+        self.assertEqual(10, len(self._database.select_instances_to_series(seriez[0].series_uid)))
+
+    def test_updating_instance_succeeds(self):
+        instance = create_instance()
+        series = self._insert_series()
+        series.add_instance(instance)
+        self._database.insert_instance(instance)
+
+        instance.file_name = "C:/Temp/updated.dcm"
+        self._database.update_instance(instance)
+
+        instance1 = self._database.select_instance(instance.instance_uid)
+        self.assertEqual("C:/Temp/updated.dcm", instance1.file_name)
+
+    def test_batch_upsert_of_instances_rewrites_only_changed_rows(self):
+        series = self._insert_series()
+        instances = [Instance(f"{series.series_uid}.{i + 1}") for i in range(10)]
+
+        for instance in instances:
+            series.add_instance(instance)
+
+        self.assertEqual([], self._database.upsert_instances(instances))
+
+        instances[2].instance_number = 1002
+        instances[5].file_name = "C:/Temp/resent.dcm"
+        extra = Instance(f"{series.series_uid}.11")
+        series.add_instance(extra)
+
+        seq = self._database.last_change_seq
+        self.assertEqual([], self._database.upsert_instances(instances + [extra]))
+
+        # every written row is logged once; total_changes would also count the change log rows
+        self.assertEqual(3, len(list(self._database.iter_changes(seq))))
+        self.assertEqual(1002, self._database.select_instance(instances[2].instance_uid).instance_number)
+        self.assertEqual(11, len(self._database.select_instances_to_series(series.series_uid)))
+
+    def test_batch_update_of_file_names_reports_missing_instances(self):
+        patient = self._insert_hierarchy(1, 2, 2)
+        instance_uids = [instance_uid for study in patient._studies.values() for series in study._seriez.values()
+                         for instance_uid in series.instances]
+        file_names = {instance_uid: f"C:/Temp/{instance_uid}.dcm" for instance_uid in instance_uids}
+        file_names["9.8.7.6.1"] = "C:/Temp/missing.dcm"
+
+        self.assertEqual(["9.8.7.6.1"], self._database.update_instance_file_names(file_names))
+        unchanged = {instance_uids[0]: file_names[instance_uids[0]]}
+        self.assertEqual([], self._database.update_instance_file_names(unchanged))
+
+        for instance_uid in instance_uids:
+            self.assertEqual(file_names[instance_uid], self._database.select_instance(instance_uid).file_name)
+
+    def _insert_series(self) -> Series:
+        patient = create_patient()
+        study = create_study()
+        series = create_series()
+        patient.add_study(study)
+        study.add_series(series)
+
+        self._database.insert_patient(patient)
+        self._database.insert_study(study)
+        self._database.insert_series(series)
+
+        return series
+
+    def test_bulk_insertion_of_instances_WITHOUT_SERIES_reports_failures(self):
+        instances = [create_instance() for i in range(3)]
+
+        failures = self._database.insert_instances(instances)
+
+        self.assertEqual([instance.instance_uid for instance in instances], failures)
+    # endregion
+
+    # region Aggregation tests
+    def test_counts_of_hierarchy_succeed(self):
+        patient = self._insert_hierarchy(2, 3, 4)
+        self._insert_hierarchy(1, 1, 1)
+        study = list(patient._studies.values())[0]
+        series = list(study._seriez.values())[0]
+
+        self.assertEqual(2, self._database.count_studies_to_patient(patient.patient_id))
+        self.assertEqual(3, self._database.count_series_to_study(study.study_uid))
+        self.assertEqual(4, self._database.count_instances_to_series(series.series_uid))
+
+    def test_counts_INVALID_KEYS_return_zero(self):
+        self.assertEqual(0, self._database.count_studies_to_patient("P1"))
+        self.assertEqual(0, self._database.count_series_to_study("1.2"))
+        self.assertEqual(0, self._database.count_instances_to_series("1.2.3"))
+
+    def test_summary_of_study_succeeds(self):
+        patient = self._insert_hierarchy(1, 3, 2)
+        study = list(patient._studies.values())[0]
+        seriez = list(study._seriez.values())
+
+        for series, modality, day in zip(seriez, [Modality.CT, Modality.MR, Modality.CT], [3, 1, 2]):
+            series.modality = modality
+            series.series_datetime = datetime(2021, 4, day, 12)
+
+        self._database.upsert_series_many(seriez)
+
+        summary = self._database.study_summary(study.study_uid)
+
+        self.assertEqual(StudySummary(3, 6, frozenset([Modality.CT, Modality.MR]),
+                                      datetime(2021, 4, 1, 12), datetime(2021, 4, 3, 12)), summary)
+
+    def test_summary_of_study_WITHOUT_SERIES_succeeds(self):
+        patient = self._insert_hierarchy(1, 0, 0)
+
+        summary = self._database.study_summary(list(patient._studies.keys())[0])
+
+        self.assertEqual(StudySummary(0, 0, frozenset(), None, None), summary)
+
+    def test_summary_of_study_INVALID_UID_returns_None(self):
+        self.assertIsNone(self._database.study_summary("1.2"))
     # endregion
+
+    # region Filter tests
+    def _insert_worklist(self) -> list[Study]:
+        patient = self._insert_hierarchy(4, 1, 0)
+        studies = list(patient._studies.values())
+        attributes = [("North", AnatomicRegion.BRAIN, "A1", Modality.MR),
+                      ("South", AnatomicRegion.BRAIN, "A2", Modality.CT),
+                      ("North", AnatomicRegion.KNEE, "A3", Modality.CT),
+                      ("North", AnatomicRegion.BRAIN, "A4", Modality.MR)]
+
+        for day, (study, (institution, region, accession_number, modality)) in enumerate(zip(studies, attributes)):
+            study.study_date_time = datetime(2022, 3, day + 1, 8)
+            study.institution_name = institution
+            study.anatomic_region = region
+            study.accession_number = accession_number
+
+            series = list(study._seriez.values())[0]
+            series.series_datetime = study.study_date_time
+            series.modality = modality
+
+        self._database.upsert_studies(studies)
+        self._database.upsert_series_many([series for study in studies for series in study._seriez.values()])
+
+        return studies
+
+    def test_selection_of_studies_BY_FILTER_succeeds(self):
+        studies = self._insert_worklist()
+
+        selected = self._database.select_studies(StudyFilter(institution_name="North",
+                                                             anatomic_region=AnatomicRegion.BRAIN))
+
+        self.assertEqual([studies[0].study_uid, studies[3].study_uid], [study.study_uid for study in selected])
+
+    def test_selection_of_studies_BY_DATETIME_RANGE_AND_MODALITY_succeeds(self):
+        studies = self._insert_worklist()
+
+        selected = self._database.select_studies(StudyFilter(datetime_from=datetime(2022, 3, 2),
+                                                             datetime_to=datetime(2022, 3, 3, 8),
+                                                             modality=Modality.CT))
+
+        self.assertEqual([studies[1].study_uid, studies[2].study_uid], [study.study_uid for study in selected])
+
+    def test_selection_of_studies_BY_ACCESSION_NUMBER_succeeds(self):
+        studies = self._insert_worklist()
+
+        selected = self._database.select_studies(StudyFilter(accession_number="A3"))
+
+        self.assertEqual([studies[2].study_uid], [study.study_uid for study in selected])
+
+    def test_selection_of_studies_WITHOUT_CRITERIA_AND_LIMIT_returns_first(self):
+        studies = self._insert_worklist()
+
+        selected = self._database.select_studies(StudyFilter(), limit=2)
+
+        self.assertEqual([studies[0].study_uid, studies[1].study_uid], [study.study_uid for study in selected])
+
+    def test_selection_of_series_BY_FILTER_succeeds(self):
+        studies = self._insert_worklist()
+        seriez = [list(study._seriez.values())[0] for study in studies]
+
+        selected = self._database.select_series_by_filter(SeriesFilter(modality=Modality.MR,
+                                                                       datetime_from=datetime(2022, 3, 1)))
+        selected_of_study = self._database.select_series_by_filter(SeriesFilter(study_uid=studies[1].study_uid))
+
+        self.assertEqual([seriez[0].series_uid, seriez[3].series_uid], [series.series_uid for series in selected])
+        self.assertEqual([seriez[1].series_uid], [series.series_uid for series in selected_of_study])
+    # endregion
+
+    # region Hierarchy selection tests
+    def _insert_hierarchy(self, number_of_studies: int, number_of_series: int, number_of_instances: int) -> Patient:
+        patient = create_patient()
+
+        for i in range(number_of_studies):
+            study = Study(f"{patient.patient_id}.{i + 1}")
+            patient.add_study(study)
+
+            for j in range(number_of_series):
+                series = Series(f"{study.study_uid}.{j + 1}")
+                study.add_series(series)
+
+                for k in range(number_of_instances):
+                    series.add_instance(Instance(f"{series.series_uid}.{k + 1}"))
+
+        studies = list(patient._studies.values())
+        seriez = [series for study in studies for series in study._seriez.values()]
+        instances = [instance for series in seriez for instance in series.instances.values()]
+
+        self._database.insert_patient(patient)
+        self._database.insert_studies(studies)
+        self._database.insert_series_many(seriez)
+        self._database.insert_instances(instances)
+
+        return patient
+
+    def test_selection_of_patient_tree_links_hierarchy(self):
+        patient = self._insert_hierarchy(2, 3, 4)
+        self._insert_hierarchy(1, 1, 1)
+
+        patient1 = self._database.select_patient_tree(patient.patient_id)
+
+        self.assertEqual(patient.patient_id, patient1.patient_id)
+        self.assertEqual(2, len(patient1._studies))
+
+        for study in patient1._studies.values():
+            self.assertIs(patient1, study.patient)
+            self.assertEqual(3, len(study._seriez))
+
+            for series in study._seriez.values():
+                self.assertIs(study, series.study)
+                self.assertEqual(4, len(series.instances))
+
+                for instance in series.instances.values():
+                    self.assertIs(series, instance.series)
+
+    def test_deletion_of_patient_cascades_to_hierarchy(self):
+        patient = self._insert_hierarchy(2, 3, 4)
+        other = self._insert_hierarchy(1, 1, 1)
+        study_uid = list(patient._studies.keys())[0]
+        series_uid = list(patient._studies[study_uid]._seriez.keys())[0]
+
+        counts = self._database.delete_patient(patient.patient_id)
+
+        self.assertEqual(DeletionCounts(1, 2, 6, 24), counts)
+        self.assertIsNone(self._database.select_study(study_uid))
+        self.assertIsNone(self._database.select_series(series_uid))
+        self.assertEqual(0, len(self._database.select_instances_to_series(series_uid)))
+        self.assertIsNotNone(self._database.select_patient_tree(other.patient_id))
+
+    def test_deletion_of_study_cascades_to_series_and_instances(self):
+        patient = self._insert_hierarchy(2, 3, 4)
+        study_uids = list(patient._studies.keys())
+
+        counts = self._database.delete_study(study_uids[0])
+
+        self.assertEqual(DeletionCounts(0, 1, 3, 12), counts)
+        self.assertEqual(0, len(self._database.select_series_to_study(study_uids[0])))
+        self.assertEqual(3, len(self._database.select_series_to_study(study_uids[1])))
+
+    def test_deletion_of_series_NOT_EXISTS_counts_nothing(self):
+        self._insert_hierarchy(1, 1, 1)
+
+        self.assertEqual(DeletionCounts(0, 0, 0, 0), self._database.delete_series("1.2.3"))
+
+    def test_selection_of_patient_tree_INVALID_PATIENT_returns_None(self):
+        patient = self._insert_hierarchy(1, 1, 1)
+
+        self.assertIsNone(self._database.select_patient_tree(patient.patient_id[:-1]))
+
+    def test_selection_of_study_tree_links_hierarchy(self):
+        patient = self._insert_hierarchy(2, 2, 5)
+        study_uid = list(patient._studies.keys())[1]
+
+        study = self._database.select_study_tree(study_uid)
+
+        self.assertEqual(study_uid, study.study_uid)
+        self.assertEqual(patient.patient_id, study.patient.patient_id)
+        self.assertEqual(2, len(study._seriez))
+
+        for series in study._seriez.values():
+            self.assertEqual(5, len(series.instances))
+
+    def test_selection_of_study_tree_INVALID_UID_returns_None(self):
+        patient = self._insert_hierarchy(1, 1, 1)
+        study_uid = list(patient._studies.keys())[0]
+
+        self.assertIsNone(self._database.select_study_tree(study_uid[:-1]))
+    # endregion
+
+    # region Iteration tests
+    def test_iteration_over_all_patients_yields_every_patient(self):
+        patients = [create_patient() for i in range(25)]
+        self._database.insert_patients(patients)
+
+        iterator = self._database.iter_all_patients(batch_size=4)
+        first = next(iterator)
+        rest = list(iterator)
+
+        self.assertIsInstance(first, Patient)
+        self.assertEqual({patient.patient_id for patient in patients},
+                         {patient.patient_id for patient in [first] + rest})
+
+    def test_iteration_over_patients_by_name_pattern_succeeds(self):
+        patients = [create_patient() for i in range(6)]
+        patients[0].name = "Aardvark^Aaron"
+        patients[4].name = "Aardvark^Berta"
+        self._database.insert_patients(patients)
+
+        fetched = list(self._database.iter_patients_by_name_pattern("Aardvark", batch_size=1))
+
+        self.assertEqual(2, len(fetched))
+
+    def test_iteration_over_hierarchy_succeeds(self):
+        patient = self._insert_hierarchy(3, 2, 7)
+        study = list(patient._studies.values())[0]
+        series = list(study._seriez.values())[0]
+
+        self.assertEqual(3, len(list(self._database.iter_studies_to_patient(patient.patient_id, batch_size=2))))
+        self.assertEqual(2, len(list(self._database.iter_series_to_study(study.study_uid, batch_size=2))))
+        self.assertEqual(7, len(list(self._database.iter_instances_to_series(series.series_uid, batch_size=2))))
+    # endregion
+
+    # region Pagination tests
+    def _fetch_all_pages(self, select_page, page_size: int, order_by: str) -> list:
+        fetched = []
+        token = None
+
+        while True:
+            page, token = select_page(token, page_size, order_by)
+            fetched.extend(page)
+
+            self.assertLessEqual(len(page), page_size)
+
+            if token is None:
+                return fetched
+
+    def test_paging_of_patients_BY_NAME_returns_all_in_order(self):
+        patients = [create_patient() for i in range(23)]
+        patients[3].name = patients[4].name = patients[5].name = "Doe^John"
+        self._database.insert_patients(patients)
+
+        fetched = self._fetch_all_pages(self._database.select_patients_page, 5, "patient_name")
+
+        self.assertEqual(sorted((patient.name, patient.patient_id) for patient in patients),
+                         [(patient.name, patient.patient_id) for patient in fetched])
+
+    def test_paging_of_patients_BY_ID_returns_all_in_order(self):
+        patients = [create_patient() for i in range(10)]
+        self._database.insert_patients(patients)
+
+        fetched = self._fetch_all_pages(self._database.select_patients_page, 5, "patient_id")
+
+        self.assertEqual(sorted(patient.patient_id for patient in patients),
+                         [patient.patient_id for patient in fetched])
+
+    def test_paging_of_studies_and_series_returns_all(self):
+        self._insert_hierarchy(4, 3, 0)
+
+        studies = self._fetch_all_pages(self._database.select_studies_page, 3, "study_datetime")
+        seriez = self._fetch_all_pages(self._database.select_series_page, 5, "series_datetime")
+
+        self.assertEqual(4, len(studies))
+        self.assertEqual(12, len(seriez))
+
+    def test_paging_of_patients_BY_NAME_WITH_NULL_NAMES_returns_all_in_order(self):
+        patients = [create_patient() for i in range(6)]
+        patients[0].name = patients[2].name = patients[4].name = None
+        self._database.insert_patients(patients)
+
+        for page_size in [1, 2, 4]:
+            fetched = self._fetch_all_pages(self._database.select_patients_page, page_size, "patient_name")
+
+            self.assertEqual(sorted((patient.name or "", patient.patient_id) for patient in patients),
+                             [(patient.name or "", patient.patient_id) for patient in fetched])
+
+    def test_paging_of_patients_INVALID_PAGE_SIZE_raises(self):
+        for page_size in [0, -1]:
+            with self.assertRaises(ValueError):
+                self._database.select_patients_page(None, page_size, "patient_id")
+
+    def test_paging_of_patients_INVALID_ORDERING_raises(self):
+        with self.assertRaises(ValueError):
+            self._database.select_patients_page(None, 10, "patient_gender")
+
+    def test_paging_of_patients_TOKEN_OF_OTHER_ORDERING_raises(self):
+        self._database.insert_patients([create_patient() for i in range(3)])
+        page, token = self._database.select_patients_page(None, 1, "patient_name")
+
+        with self.assertRaises(ValueError):
+            self._database.select_patients_page(token, 1, "patient_date_of_birth")
+    # endregion
+
+
+class DicomDatabaseTransactionTests(unittest.TestCase):
+    _database_file_path = DicomDataBaseTests._database_file_path
+    _database: BasicDicomDatabase = None
+
+    def setUp(self):
+        self._database = BasicDicomDatabase()
+        self._database.open(self._database_file_path)
+
+    def tearDown(self):
+        self._database.reset()
+        self._database.close()
+
+    def _count_patients_from_other_thread(self) -> int:
+        result = []
+        thread = threading.Thread(target=lambda: result.append(len(self._database.select_all_patients())))
+        thread.start()
+        thread.join()
+        return result[0]
+
+    def test_transaction_commits_once_on_exit(self):
+        statements = []
+        self._database._connection.set_trace_callback(statements.append)
+        patients = [create_patient() for i in range(4)]
+
+        with self._database.transaction():
+            self._database.insert_patient(patients[0])
+            self._database.insert_patients(patients[1:3])
+            self._database.update_patient(patients[3])
+
+            self.assertEqual(0, self._count_patients_from_other_thread())
+
+        self._database._connection.set_trace_callback(None)
+
+        self.assertEqual(1, statements.count("COMMIT"))
+        self.assertEqual(4, self._count_patients_from_other_thread())
+
+    def test_transaction_rolls_back_on_exception(self):
+        with self.assertRaises(RuntimeError):
+            with self._database.transaction():
+                self._database.insert_patients([create_patient() for i in range(3)])
+                raise RuntimeError()
+
+        self.assertEqual(0, len(self._database.select_all_patients()))
+
+    def test_nested_transaction_rolls_back_to_savepoint(self):
+        outer, inner = create_patient(), create_patient()
+
+        with self._database.transaction():
+            self._database.insert_patient(outer)
+
+            with self.assertRaises(RuntimeError):
+                with self._database.transaction():
+                    self._database.insert_patient(inner)
+                    raise RuntimeError()
+
+        self.assertIsNotNone(self._database.select_patient(outer.patient_id))
+        self.assertIsNone(self._database.select_patient(inner.patient_id))
+
+    def test_failed_write_releases_write_lock(self):
+        patient = create_patient()
+        self._database.insert_patient(patient)
+
+        with self.assertRaises(sqlite3.Error):
+            self._database.insert_patient(patient)
+
+        errors = []
+
+        def insert_from_other_thread():
+            try:
+                self._database.insert_patient(create_patient())
+            except sqlite3.Error as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=insert_from_other_thread)
+        thread.start()
+        thread.join()
+
+        self.assertEqual([], errors)
+
+        with self._database.transaction():
+            self._database.insert_patient(create_patient())
+
+        self.assertEqual(3, self._count_patients_from_other_thread())
+
+    def test_failed_batch_within_transaction_keeps_earlier_writes(self):
+        patient = create_patient()
+
+        with self._database.transaction():
+            self._database.insert_patient(patient)
+            failures = self._database.insert_patients([patient, create_patient()])
+
+        self.assertEqual([patient.patient_id], failures)
+        self.assertEqual(2, len(self._database.select_all_patients()))
+
+
+class DicomDatabaseSchemaTests(unittest.TestCase):
+    _database_file_path = DicomDataBaseTests._database_file_path
+    _database: BasicDicomDatabase = None
+
+    def setUp(self):
+        self._database = BasicDicomDatabase()
+        self._database.open(self._database_file_path)
+
+    def tearDown(self):
+        self._database.reset()
+        self._database.close()
+
+    def _reopen(self, **kwargs):
+        self._database.close()
+        self._database = BasicDicomDatabase(**kwargs)
+        self._database.open(self._database_file_path)
+
+    def test_new_database_has_current_schema_version(self):
+        self.assertEqual(len(BasicDicomDatabase._schema_migrations), self._database.schema_version)
+
+    def test_closing_keeps_data(self):
+        patient = create_patient()
+        self._database.insert_patient(patient)
+
+        self._reopen()
+
+        self.assertIsNotNone(self._database.select_patient(patient.patient_id))
+        self.assertEqual(1, len(self._database.select_patients_by_name_pattern(patient.name[:3])))
+
+    def test_reset_removes_data(self):
+        self._database.insert_patients([create_patient() for i in range(3)])
+
+        self._database.reset()
+
+        self.assertEqual(0, len(self._database.select_all_patients()))
+        self.assertEqual(len(BasicDicomDatabase._schema_migrations), self._database.schema_version)
+
+    def test_database_without_version_is_migrated(self):
+        patient = create_patient()
+        patient.date_of_birth = date(1990, 1, 2)
+        patient.gender = Gender.Female
+        self._database.insert_patient(patient)
+        self._database._connection.execute("PRAGMA user_version = 0")
+        self._database._connection.commit()
+
+        self._reopen()
+
+        patient1 = self._database.select_patient(patient.patient_id)
+        self.assertEqual(len(BasicDicomDatabase._schema_migrations), self._database.schema_version)
+        self.assertEqual((date(1990, 1, 2), Gender.Female), (patient1.date_of_birth, patient1.gender))
+
+    def test_text_encoding_of_version_1_is_migrated(self):
+        connection = self._database._connection
+        connection.execute("INSERT INTO `patient` VALUES ('P1', 'Doe^Jane', '1950-03-04', 'Gender.Female')")
+        connection.execute("INSERT INTO `study` VALUES ('1.2', 'P1', '2020-05-06 07:08:09.250000', '', '', '', '', '', "
+                           "'AnatomicRegion.BRAIN')")
+        connection.execute("INSERT INTO `series` VALUES ('1.2.3', '1.2', '', '', 'ISO_IR 100', '1969-12-31 23:59:59', "
+                           "'Modality.MR', 1, '', '', '', 1.0, 0.5, 0.5, 1.0, 0.0, 0.0, 0.0, 1.0, 0.0)")
+        connection.execute("PRAGMA user_version = 1")
+        connection.commit()
+
+        self._reopen()
+
+        patient = self._database.select_patient("P1")
+        study = self._database.select_study("1.2")
+        series = self._database.select_series("1.2.3")
+
+        self.assertEqual((date(1950, 3, 4), Gender.Female), (patient.date_of_birth, patient.gender))
+        self.assertEqual(datetime(2020, 5, 6, 7, 8, 9, 250000), study.study_date_time)
+        self.assertEqual(AnatomicRegion.BRAIN, study.anatomic_region)
+        self.assertEqual((datetime(1969, 12, 31, 23, 59, 59), Modality.MR), (series.series_datetime, series.modality))
+        self.assertEqual(1, len(self._database.select_patients_by_name_pattern("Doe^J")))
+        self.assertEqual(1, len(self._database.select_patients_by_date_of_birth(date(1950, 3, 4), date(1950, 3, 4))))
+
+    def test_opening_NEWER_SCHEMA_raises(self):
+        self._database._connection.execute("PRAGMA user_version = 1000")
+        self._database._connection.commit()
+        self._database.close()
+
+        self._database = BasicDicomDatabase()
+
+        try:
+            with self.assertRaises(UserWarning):
+                self._database.open(self._database_file_path)
+        finally:
+            self._database._connection.execute("PRAGMA user_version = 0")
+            self._database._connection.commit()
+            self._reopen()
+
+
+    def test_migration_WITH_ROWS_WITHOUT_PARENT_raises(self):
+        connection = self._database._connection
+        connection.execute("PRAGMA foreign_keys = OFF")
+        connection.execute("INSERT INTO `study` (`study_uid`, `patient_id`) VALUES ('1.2', 'P1')")
+        connection.execute("PRAGMA user_version = 2")
+        connection.commit()
+        self._database.close()
+
+        self._database = BasicDicomDatabase()
+
+        try:
+            with self.assertRaises(sqlite3.IntegrityError) as context:
+                self._database.open(self._database_file_path)
+
+            self.assertIn("1 in study", str(context.exception))
+            self.assertEqual(2, self._database.schema_version)
+        finally:
+            self._database._connection.execute("DELETE FROM `study`")
+            self._database._connection.commit()
+            self._reopen()
+
+        self.assertEqual(len(BasicDicomDatabase._schema_migrations), self._database.schema_version)
+
+    def test_new_database_uses_incremental_vacuum(self):
+        self.assertEqual(2, self._database._connection.execute("PRAGMA auto_vacuum").fetchone()[0])
+
+    def test_database_of_version_5_is_switched_to_incremental_vacuum(self):
+        patient = create_patient()
+        self._database.insert_patient(patient)
+        connection = self._database._connection
+        connection.execute("PRAGMA auto_vacuum = NONE")
+        connection.execute("VACUUM")
+        connection.execute("PRAGMA user_version = 5")
+        connection.commit()
+        self.assertEqual(0, connection.execute("PRAGMA auto_vacuum").fetchone()[0])
+
+        self._reopen()
+
+        self.assertEqual(2, self._database._connection.execute("PRAGMA auto_vacuum").fetchone()[0])
+        self.assertEqual(len(BasicDicomDatabase._schema_migrations), self._database.schema_version)
+        self.assertEqual(1, len(self._database.select_patients_by_name_pattern(patient.name[:3])))
+
+
+class DicomDatabaseQueryPlanTests(unittest.TestCase):
+    _database_file_path = DicomDataBaseTests._database_file_path
+    _database: BasicDicomDatabase = None
+
+    def setUp(self):
+        self._database = BasicDicomDatabase()
+        self._database.open(self._database_file_path)
+
+    def tearDown(self):
+        self._database.reset()
+        self._database.close()
+
+    def _query_plan(self, statement: str) -> str:
+        sql = self._database._statements[statement]
+        numbered = set(re.findall(r"\?(\d+)", sql))
+        parameters = tuple("" for i in range(len(numbered) if len(numbered) > 0 else sql.count("?")))
+        rows = self._database._connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+
+        return "\n".join(row["detail"] for row in rows)
+
+    def _assert_uses_index(self, statement: str, index_name: str):
+        plan = self._query_plan(statement)
+
+        self.assertIn(index_name, plan, plan)
+        self.assertNotRegex(plan, r"(?m)^SCAN ", plan)
+
+    def test_query_plan_of_studies_to_patient_uses_index(self):
+        self._assert_uses_index("select_studies_to_patient", "idx_study_patient_id")
+
+    def test_query_plan_of_series_to_study_uses_index(self):
+        self._assert_uses_index("select_series_to_study", "idx_series_study_uid")
+
+    def test_query_plan_of_instances_to_series_uses_index(self):
+        self._assert_uses_index("select_instances_to_series", "idx_instance_series_uid")
+
+    def test_query_plan_of_counts_uses_covering_indexes(self):
+        self._assert_uses_index("count_studies_to_patient", "COVERING INDEX idx_study_patient_id")
+        self._assert_uses_index("count_series_to_study", "COVERING INDEX idx_series_study_uid")
+        self._assert_uses_index("count_instances_to_series", "COVERING INDEX idx_instance_series_uid")
+
+    def _assert_filter_uses_index(self, table: str, criteria, index_name: str):
+        sql, parameters = self._database._filter_statement(table, criteria, 50)
+        rows = self._database._connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+        plan = "\n".join(row["detail"] for row in rows)
+
+        self.assertIn(index_name, plan, plan)
+        self.assertNotIn("TEMP B-TREE", plan, plan)
+
+    def test_query_plan_of_worklist_filter_uses_index_without_sorting(self):
+        criteria = StudyFilter(institution_name="North", datetime_from=datetime(2022, 3, 1))
+
+        self._assert_filter_uses_index("study", criteria, "idx_study_filter_institution")
+
+    def test_query_plan_of_region_filter_uses_index_without_sorting(self):
+        self._assert_filter_uses_index("study", StudyFilter(anatomic_region=AnatomicRegion.BRAIN),
+                                       "idx_study_filter_region")
+
+    def test_query_plan_of_datetime_filter_uses_index_without_sorting(self):
+        criteria = StudyFilter(datetime_from=datetime(2022, 3, 1), datetime_to=datetime(2022, 3, 2))
+
+        self._assert_filter_uses_index("study", criteria, "idx_study_page_datetime")
+
+    def test_query_plan_of_series_modality_filter_uses_index_without_sorting(self):
+        self._assert_filter_uses_index("series", SeriesFilter(modality=Modality.CT), "idx_series_filter_modality")
+
+    def test_query_plan_of_study_summary_uses_indexes(self):
+        plan = self._query_plan("summarize_study")
+
+        self.assertIn("idx_series_study_uid", plan, plan)
+        self.assertIn("idx_instance_series_uid", plan, plan)
+        self.assertNotRegex(plan, r"(?m)^SCAN ", plan)
+
+    def test_query_plan_of_deletion_of_instances_of_series_uses_index(self):
+        self._assert_uses_index("delete_instances_of_series", "idx_instance_series_uid")
+
+    def test_query_plan_of_instances_to_patient_uses_indexes(self):
+        self._assert_uses_index("select_instances_to_patient", "idx_study_patient_id")
+        self._assert_uses_index("select_instances_to_patient", "idx_series_study_uid")
+        self._assert_uses_index("select_instances_to_patient", "idx_instance_series_uid")
+
+    def test_query_plan_of_instances_to_study_uses_indexes(self):
+        self._assert_uses_index("select_instances_to_study", "idx_series_study_uid")
+        self._assert_uses_index("select_instances_to_study", "idx_instance_series_uid")
+
+    def test_query_plan_of_pages_uses_indexes_without_sorting(self):
+        database = self._database
+
+        for table, (key, orderings) in database._page_orderings.items():
+            for order_by in orderings:
+                suffixes = ["", "_after"] if order_by == key else ["", "_after", "_after_null", "_not_null"]
+
+                for suffix in suffixes:
+                    plan = self._query_plan(f"select_{table}_page_by_{order_by}{suffix}")
+
+                    self.assertNotIn("TEMP B-TREE", plan, plan)
+                    self.assertRegex(plan, "USING (COVERING )?INDEX", plan)
+
+    def test_query_plan_of_name_pattern_search_uses_name_index(self):
+        plan = self._query_plan("select_patients_by_name_pattern_indexed")
+
+        self.assertIn("VIRTUAL TABLE INDEX", plan, plan)
+        self.assertNotRegex(plan, r"(?m)^SCAN patient\b", plan)
+
+    def test_query_plan_of_patients_by_date_of_birth_uses_index(self):
+        self._assert_uses_index("select_patients_by_date_of_birth", "idx_patient_page_date_of_birth")
+
+
+class DicomDatabaseBackupTests(unittest.TestCase):
+    _database_file_path = DicomDataBaseTests._database_file_path
+    _database: BasicDicomDatabase = None
+
+    def setUp(self):
+        self._database = BasicDicomDatabase()
+        self._database.open(self._database_file_path)
+        self._directory = tempfile.TemporaryDirectory()
+        self._target_path = os.path.join(self._directory.name, "backup.db3")
+
+    def tearDown(self):
+        self._database.reset()
+        self._database.close()
+        self._directory.cleanup()
+
+    def _open_target(self) -> BasicDicomDatabase:
+        database = BasicDicomDatabase()
+        database.open(self._target_path)
+        self.addCleanup(database.close)
+        return database
+
+    def test_backup_copies_database_and_reports_progress(self):
+        patients = [create_patient() for i in range(20)]
+        self._database.insert_patients(patients)
+        steps = []
+
+        self._database.backup(self._target_path, pages_per_step=2, sleep=0.0,
+                              progress=lambda copied, total: steps.append((copied, total)))
+
+        self.assertGreater(len(steps), 1)
+        self.assertEqual(steps[-1][0], steps[-1][1])
+        self.assertEqual(20, len(self._open_target().select_all_patients()))
+
+    def test_backup_WITH_CONCURRENT_WRITES_copies_state_at_start(self):
+        self._database.insert_patients([create_patient() for i in range(20)])
+
+        def write_from_other_thread(copied: int, total: int):
+            thread = threading.Thread(target=lambda: self._database.insert_patient(create_patient()))
+            thread.start()
+            thread.join()
+
+        self._database.backup(self._target_path, pages_per_step=1, sleep=0.0, progress=write_from_other_thread)
+
+        self.assertGreater(len(self._database.select_all_patients()), 21)
+        self.assertEqual(20, len(self._open_target().select_all_patients()))
+
+    def test_snapshot_is_read_only(self):
+        patient = create_patient()
+        patient.name = "Snapshot^Sam"
+        self._database.insert_patient(patient)
+
+        snapshot = self._database.open_snapshot(self._target_path)
+        self.addCleanup(snapshot.close)
+        self._database.insert_patient(create_patient())
+
+        self.assertEqual(1, len(snapshot.select_all_patients()))
+        self.assertEqual(1, len(snapshot.select_patients_by_name_pattern("Sam")))
+
+        with self.assertRaises(sqlite3.OperationalError):
+            snapshot.insert_patient(create_patient())
+
+
+class DicomDatabaseChangeLogTests(unittest.TestCase):
+    _database_file_path = DicomDataBaseTests._database_file_path
+    _database: BasicDicomDatabase = None
+
+    def setUp(self):
+        self._database = BasicDicomDatabase()
+        self._database.open(self._database_file_path)
+
+    def tearDown(self):
+        self._database.reset()
+        self._database.close()
+
+    def _changes(self, since_seq: int = 0) -> list[tuple[ChangeOperation, str, str]]:
+        return [(change.operation, change.taxon_type, change.key) for change in self._database.iter_changes(since_seq)]
+
+    def test_writes_are_logged_in_order(self):
+        patient = create_patient()
+        self._database.insert_patient(patient)
+        patient.name = "Changed^Name"
+        self._database.update_patient(patient)
+        self._database.delete_patient(patient.patient_id)
+
+        self.assertEqual([(ChangeOperation.Insert, "patient", patient.patient_id),
+                          (ChangeOperation.Update, "patient", patient.patient_id),
+                          (ChangeOperation.Delete, "patient", patient.patient_id)], self._changes())
+
+        seqs = [change.seq for change in self._database.iter_changes()]
+        self.assertEqual(sorted(seqs), seqs)
+        self.assertEqual(seqs[-1], self._database.last_change_seq)
+
+    def test_cascading_deletion_is_logged_for_subtree(self):
+        patient = create_patient()
+        study = Study("1.2.3")
+        patient.add_study(study)
+        series = Series("1.2.3.4")
+        study.add_series(series)
+        instance = Instance("1.2.3.4.5")
+        series.add_instance(instance)
+        self._database.insert_patient(patient)
+        self._database.insert_study(study)
+        self._database.insert_series(series)
+        self._database.insert_instance(instance)
+        seq = self._database.last_change_seq
+
+        self._database.delete_patient(patient.patient_id)
+
+        self.assertEqual({(ChangeOperation.Delete, "patient", patient.patient_id),
+                          (ChangeOperation.Delete, "study", "1.2.3"),
+                          (ChangeOperation.Delete, "series", "1.2.3.4"),
+                          (ChangeOperation.Delete, "instance", "1.2.3.4.5")}, set(self._changes(seq)))
+
+    def test_unchanged_upsert_is_not_logged(self):
+        patient = create_patient()
+        self._database.upsert_patients([patient])
+        seq = self._database.last_change_seq
+
+        self._database.upsert_patients([patient])
+
+        self.assertEqual([], self._changes(seq))
+
+    def test_rolled_back_writes_are_not_logged(self):
+        with self.assertRaises(RuntimeError):
+            with self._database.transaction():
+                self._database.insert_patient(create_patient())
+                raise RuntimeError()
+
+        self.assertEqual([], self._changes())
+
+    def test_compaction_removes_old_entries(self):
+        patients = [create_patient() for i in range(4)]
+        self._database.insert_patients(patients)
+        seqs = [change.seq for change in self._database.iter_changes()]
+
+        self.assertEqual(2, self._database.compact_changes(seqs[1]))
+
+        self.assertEqual([patient.patient_id for patient in patients[2:]],
+                         [change.key for change in self._database.iter_changes(seqs[1])])
+
+        with self.assertRaises(UserWarning):
+            self._database.iter_changes(seqs[0])
+
+    def test_sequence_keeps_increasing_after_compaction(self):
+        self._database.insert_patient(create_patient())
+        seq = self._database.last_change_seq
+        self._database.compact_changes(seq + 100)
+
+        self._database.insert_patient(create_patient())
+
+        self.assertEqual([seq + 1], [change.seq for change in self._database.iter_changes(seq)])
@@ -1,8 +1,15 @@
 import os
+import tempfile
 import unittest
 import shutil
 import pydicom as dicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ImplicitVRLittleEndian
+from Data.BasicDicomDatabase import BasicDicomDatabase
 from Data.BasicDicomStorage import BasicDicomStorage
+from Data.InstrumentedDicomDatabase import InstrumentedDicomDatabase
+from Taxons.Instance import Instance
+from unit_tests.taxon_creation import create_patient, create_study, create_series
 
 
 class DicomStorageTests(unittest.TestCase):
@@ -51,3 +58,133 @@ class DicomStorageTests(unittest.TestCase):
     def test_append_images_to_series(self):
         pass
         # TODO to be added later
+
+
+class DicomStorageBatchTests(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._database = InstrumentedDicomDatabase(BasicDicomDatabase())
+        self._database.open(os.path.join(self._directory.name, "storage_test.db3"))
+        self._storage = BasicDicomStorage(self._database)
+        self._storage.initialize(os.path.join(self._directory.name, "DicomFiles"))
+
+        patient = create_patient()
+        study = create_study()
+        self._series = create_series()
+        patient.add_study(study)
+        study.add_series(self._series)
+        self._database.insert_patient(patient)
+        self._database.insert_study(study)
+        self._database.insert_series(self._series)
+
+    def tearDown(self):
+        self._database.close()
+        self._directory.cleanup()
+
+    def _create_datasets(self, count: int, insert: bool = True) -> list[Dataset]:
+        datasets = []
+
+        for i in range(count):
+            instance = Instance(f"{self._series.series_uid}.{len(self._series.instances) + 1}")
+            self._series.add_instance(instance)
+
+            if insert:
+                self._database.insert_instance(instance)
+
+            dataset = Dataset()
+            dataset.PatientID = self._series.study.patient.patient_id
+            dataset.StudyInstanceUID = self._series.study.study_uid
+            dataset.SeriesInstanceUID = self._series.series_uid
+            dataset.SOPInstanceUID = instance.instance_uid
+            dataset.file_meta = FileMetaDataset()
+            dataset.file_meta.TransferSyntaxUID = ImplicitVRLittleEndian
+            datasets.append(dataset)
+
+        return datasets
+
+    def test_batch_storage_writes_files_and_database_entries(self):
+        datasets = self._create_datasets(10)
+
+        results = self._storage.store_datasets(datasets, workers=3)
+
+        self.assertEqual([dataset.SOPInstanceUID for dataset in datasets], [result.instance_uid for result in results])
+        self.assertEqual([None] * 10, [result.error for result in results])
+
+        for result in results:
+            self.assertEqual(result.instance_uid, dicom.dcmread(result.file_name, force=True).SOPInstanceUID)
+            self.assertEqual(result.file_name, self._database.select_instance(result.instance_uid).file_name)
+
+        self.assertEqual(1, self._database.statistics.methods["update_instance_file_names"].calls)
+
+    def test_batch_storage_reports_failures_per_dataset(self):
+        datasets = self._create_datasets(3)
+        unknown = self._create_datasets(1, insert=False)[0]
+        invalid = Dataset()
+        invalid.PatientID = "P1"
+
+        results = self._storage.store_datasets([datasets[0], invalid, unknown, *datasets[1:]], workers=2)
+
+        self.assertEqual([None, IOError, KeyError, None, None],
+                         [None if result.error is None else type(result.error) for result in results])
+        self.assertIsNone(results[1].file_name)
+        self.assertTrue(os.path.isfile(results[2].file_name))
+
+    def test_batch_storage_takes_datasets_only_as_far_as_they_are_stored(self):
+        datasets = self._create_datasets(12)
+        folder = os.path.join(self._storage.root_folder, datasets[0].PatientID, datasets[0].StudyInstanceUID,
+                              datasets[0].SeriesInstanceUID)
+        ahead = []
+
+        def generate():
+            for taken, dataset in enumerate(datasets):
+                stored = len(os.listdir(folder)) if os.path.isdir(folder) else 0
+                ahead.append(taken - stored)
+                yield dataset
+
+        results = self._storage.store_datasets(generate(), workers=1, max_pending=2)
+
+        self.assertEqual(12, len([result for result in results if result.error is None]))
+        self.assertLessEqual(max(ahead), 2)
+
+    def test_batch_storage_WITHOUT_WORKERS_raises(self):
+        with self.assertRaises(ValueError):
+            self._storage.store_datasets([], workers=0)
+
+    def test_storage_of_dataset_makes_database_entry(self):
+        dataset = self._create_datasets(1)[0]
+
+        self._storage.store_dataset(dataset)
+
+        self.assertTrue(self._database.select_instance(dataset.SOPInstanceUID).file_name.endswith(".dcm"))
+
+        with self.assertRaises(KeyError):
+            self._storage.store_dataset(self._create_datasets(1, insert=False)[0])
+
+    def test_folders_are_created_once_and_remembered(self):
+        datasets = self._create_datasets(3)
+        folder = os.path.dirname(self._storage.store_datasets(datasets[:1])[0].file_name)
+
+        self.assertEqual([folder], list(self._storage._known_folders))
+        self.assertEqual([None, None], [result.error for result in self._storage.store_datasets(datasets[1:])])
+        self.assertEqual([folder], list(self._storage._known_folders))
+
+    def test_storage_recreates_folder_removed_underneath(self):
+        datasets = self._create_datasets(2)
+        self._storage.store_dataset(datasets[0])
+
+        shutil.rmtree(os.path.join(self._storage.root_folder, datasets[0].PatientID))
+        self._storage.store_dataset(datasets[1])
+
+        self.assertTrue(os.path.isfile(self._database.select_instance(datasets[1].SOPInstanceUID).file_name))
+
+    def test_known_folders_are_bounded(self):
+        storage = BasicDicomStorage(max_known_folders=2)
+        storage.initialize(self._storage.root_folder)
+        datasets = self._create_datasets(3, insert=False)
+
+        for i, dataset in enumerate(datasets):
+            dataset.SeriesInstanceUID = f"{dataset.SeriesInstanceUID}.{i}"
+
+        self.assertEqual([None] * 3, [result.error for result in storage.store_datasets(datasets, workers=1)])
+        self.assertEqual([datasets[1].SeriesInstanceUID, datasets[2].SeriesInstanceUID],
+                         [os.path.basename(folder) for folder in storage._known_folders])
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+from unit_tests import dicom_database_tests
+from Data.BasicDicomDatabase import BasicDicomDatabase
+from Data.InMemoryDicomDatabase import InMemoryDicomDatabase
+
+
+class InMemoryDicomDatabaseTests(dicom_database_tests.DicomDataBaseTests):
+    def _create_database(self, **kwargs):
+        return InMemoryDicomDatabase()
+
+    @unittest.skip("there is no database file to vacuum")
+    def test_name_pattern_search_AFTER_VACUUM_succeeds(self):
+        pass
+
+    @unittest.skip("needs direct access to the sqlite connection")
+    def test_batch_upsert_of_instances_rewrites_only_changed_rows(self):
+        pass
+
+    # region Snapshot tests
+    def test_closing_WITH_SNAPSHOT_writes_database_file(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        database_file_path = os.path.join(directory.name, "snapshot.db3")
+
+        self._database = InMemoryDicomDatabase(snapshot=True)
+        self._database.open(database_file_path)
+        patient = self._insert_hierarchy(2, 2, 3)
+        self._database.close()
+
+        database = BasicDicomDatabase()
+        database.open(database_file_path)
+        self.addCleanup(database.close)
+
+        tree = database.select_patient_tree(patient.patient_id)
+        self.assertEqual(2, len(tree._studies))
+        self.assertEqual(12, sum(len(series.instances) for study in tree._studies.values()
+                                 for series in study._seriez.values()))
+
+    def test_closing_WITHOUT_SNAPSHOT_writes_nothing(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        database_file_path = os.path.join(directory.name, "snapshot.db3")
+
+        self._database.open(database_file_path)
+        self._insert_hierarchy(1, 1, 1)
+        self._database.close()
+
+        self.assertFalse(os.path.exists(database_file_path))
+    # endregion
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+from unit_tests import dicom_database_tests
+from unit_tests.taxon_creation import create_patient
+from Data.BasicDicomDatabase import BasicDicomDatabase
+from Data.InstrumentedDicomDatabase import InstrumentedDicomDatabase
+from Management.PykkamiManager import PykkamiManager
+
+
+class InstrumentedDicomDatabaseTests(dicom_database_tests.DicomDataBaseTests):
+    def _create_database(self, **kwargs):
+        return InstrumentedDicomDatabase(BasicDicomDatabase(**kwargs), slow_query_threshold=60.0)
+
+    # region Instrumentation tests
+    def test_calls_are_recorded_per_method(self):
+        patient = self._insert_hierarchy(1, 2, 3)
+
+        for i in range(3):
+            self._database.select_patient(patient.patient_id)
+
+        statistics = self._database.statistics.methods["select_patient"]
+        self.assertEqual((3, 3), (statistics.calls, statistics.rows))
+        self.assertEqual(3, sum(count for upper_bound, count in statistics.histogram))
+        self.assertLessEqual(statistics.p50_seconds, statistics.p99_seconds)
+        self.assertLessEqual(statistics.p99_seconds, statistics.max_seconds)
+        self.assertEqual(1, len(statistics.statements))
+        self.assertIn("FROM `patient`", statistics.statements[0])
+
+    def test_rows_of_iteration_are_recorded_when_exhausted(self):
+        patient = self._insert_hierarchy(1, 1, 5)
+        series_uid = list(list(patient._studies.values())[0]._seriez.keys())[0]
+
+        iterator = self._database.iter_instances_to_series(series_uid, 2)
+        self.assertNotIn("iter_instances_to_series", self._database.statistics.methods)
+
+        self.assertEqual(5, len(list(iterator)))
+        statistics = self._database.statistics.methods["iter_instances_to_series"]
+        self.assertEqual((1, 5), (statistics.calls, statistics.rows))
+
+    def test_rows_of_deletion_are_counted(self):
+        patient = self._insert_hierarchy(1, 2, 3)
+
+        self._database.delete_patient(patient.patient_id)
+
+        self.assertEqual(1 + 1 + 2 + 6, self._database.statistics.methods["delete_patient"].rows)
+
+    def test_slow_query_is_logged_with_query_plan(self):
+        patient = self._insert_hierarchy(1, 1, 1)
+        self._database.slow_query_threshold = 0.0
+
+        with self.assertLogs("Data.InstrumentedDicomDatabase", level="WARNING") as logs:
+            self._database.select_studies_to_patient(patient.patient_id)
+
+        slow_query = self._database.statistics.slow_queries[-1]
+        self.assertEqual(("select_studies_to_patient", 1), (slow_query.method, slow_query.rows))
+        self.assertEqual(1, len(slow_query.query_plans))
+        self.assertIn("USING", slow_query.query_plans[0])
+        self.assertIn("select_studies_to_patient", logs.output[0])
+
+    def test_slow_query_log_is_bounded(self):
+        self._database = InstrumentedDicomDatabase(self._database._database, slow_query_threshold=0.0,
+                                                   max_slow_queries=2)
+
+        with self.assertLogs("Data.InstrumentedDicomDatabase", level="WARNING"):
+            for i in range(5):
+                self._database.select_patient(str(i))
+
+        self.assertEqual(2, len(self._database.statistics.slow_queries))
+
+    def test_disabled_instrumentation_records_nothing(self):
+        self._database.enabled = False
+
+        self._database.insert_patient(create_patient())
+        self._database.select_all_patients()
+
+        self.assertEqual({}, self._database.statistics.methods)
+
+    def test_clear_statistics(self):
+        self._database.select_all_patients()
+
+        self._database.clear_statistics()
+
+        self.assertEqual({}, self._database.statistics.methods)
+    # endregion
+
+    # region Manager tests
+    def test_manager_query_statistics(self):
+        manager = PykkamiManager()
+        manager.initialize_database(self._database_file_path)
+        self.addCleanup(manager.database.close)
+        self.assertIsNone(manager.query_statistics)
+
+        manager.enable_query_instrumentation()
+        manager.database.select_all_patients()
+        manager.disable_query_instrumentation()
+        manager.database.select_all_patients()
+
+        self.assertEqual(1, manager.query_statistics.methods["select_all_patients"].calls)
+    # endregion
+
+
+if __name__ == '__main__':
+    unittest.main()
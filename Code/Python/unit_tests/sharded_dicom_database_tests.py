@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+from unit_tests import dicom_database_tests
+from unit_tests.taxon_creation import create_patient
+from Data.IDicomDatabase import StudyFilter
+from Data.ShardedDicomDatabase import ShardedDicomDatabase
+from Taxons.Instance import Instance
+from Taxons.Series import Series
+
+
+class ShardedDicomDatabaseTests(dicom_database_tests.DicomDataBaseTests):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._database_file_path = os.path.join(self._directory.name, "sharded_test.db3")
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        self._directory.cleanup()
+
+    def _create_database(self, **kwargs):
+        return ShardedDicomDatabase(number_of_shards=3)
+
+    @unittest.skip("the shards are vacuumed one by one")
+    def test_name_pattern_search_AFTER_VACUUM_succeeds(self):
+        pass
+
+    @unittest.skip("needs the change log of a single sqlite file")
+    def test_batch_upsert_of_instances_rewrites_only_changed_rows(self):
+        pass
+
+    # region Sharding tests
+    def test_patients_are_spread_over_shards(self):
+        patients = [create_patient() for i in range(30)]
+
+        self.assertEqual([], self._database.insert_patients(patients))
+
+        counts = [len(shard.select_all_patients()) for shard in self._database.shards]
+        self.assertEqual(30, sum(counts))
+        self.assertTrue(all(count > 0 for count in counts), counts)
+
+        for patient in patients:
+            shard = self._database.shards[self._database.shard_of_patient(patient.patient_id)]
+            self.assertIsNotNone(shard.select_patient(patient.patient_id))
+
+    def test_subtree_is_stored_in_shard_of_patient(self):
+        patient = self._insert_hierarchy(2, 2, 2)
+        shard = self._database.shards[self._database.shard_of_patient(patient.patient_id)]
+
+        for study in patient._studies.values():
+            self.assertIsNotNone(shard.select_study_tree(study.study_uid))
+            self.assertIsNotNone(self._database.select_study(study.study_uid))
+
+    def test_instance_without_patient_reference_is_routed_by_series(self):
+        patient = self._insert_hierarchy(1, 1, 0)
+        series_uid = list(list(patient._studies.values())[0]._seriez.keys())[0]
+        instance = Instance(f"{series_uid}.1")
+        instance.series = Series(series_uid)
+
+        self._database.insert_instance(instance)
+
+        self.assertIsNotNone(self._database.select_instance(instance.instance_uid))
+
+    def test_instance_of_unknown_series_is_not_written(self):
+        instance = Instance("9.8.7.6.1")
+        instance.series = Series("9.8.7.6")
+
+        self.assertEqual([instance.instance_uid], self._database.insert_instances([instance]))
+
+        with self.assertRaises(KeyError):
+            self._database.insert_instance(instance)
+
+    def test_filter_results_of_shards_are_merged_in_order(self):
+        for i in range(6):
+            self._insert_hierarchy(2, 1, 0)
+
+        studies = self._database.select_studies(StudyFilter(), limit=5)
+        datetimes = [study.study_date_time for study in self._database.select_studies(StudyFilter())]
+
+        self.assertEqual(12, len(datetimes))
+        self.assertEqual(sorted(datetimes), datetimes)
+        self.assertEqual(datetimes[:5], [study.study_date_time for study in studies])
+
+    def test_routes_of_deleted_subtree_are_removed(self):
+        patient = self._insert_hierarchy(1, 2, 2)
+
+        self._database.delete_patient(patient.patient_id)
+
+        uids = [uid for study in patient._studies.values()
+                for uid in [study.study_uid, *study._seriez.keys(),
+                            *[instance_uid for series in study._seriez.values() for instance_uid in series.instances]]]
+        self.assertEqual(7, len(uids))
+        self.assertEqual({}, self._database._routing.lookup(uids))
+
+    def test_lost_routes_are_restored_from_shards(self):
+        patient = self._insert_hierarchy(1, 1, 2)
+        study = list(patient._studies.values())[0]
+        series = list(study._seriez.values())[0]
+        instance = Instance(f"{series.series_uid}.9")
+        instance.series = Series(series.series_uid)
+
+        self._database._routing.clear()
+
+        self.assertIsNotNone(self._database.select_study(study.study_uid))
+        self.assertEqual(2, len(self._database.select_instances_to_series(series.series_uid)))
+        self.assertEqual([], self._database.insert_instances([instance]))
+        self.assertEqual(3, self._database.count_instances_to_series(series.series_uid))
+
+    def test_reopening_WITH_OTHER_NUMBER_OF_SHARDS_raises(self):
+        self._database.close()
+
+        with self.assertRaises(UserWarning):
+            ShardedDicomDatabase(number_of_shards=2).open(self._database_file_path)
+
+        self._database = self._create_database()
+        self._database.open(self._database_file_path)
+    # endregion
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from Data.SqliteConnectionManager import SqliteConnectionManager
+
+
+class SqliteConnectionManagerTests(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._database_file_path = os.path.join(self._directory.name, "manager_test.db3")
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _create_manager(self, **kwargs) -> SqliteConnectionManager:
+        manager = SqliteConnectionManager(self._database_file_path, **kwargs)
+        self.addCleanup(manager.close)
+        return manager
+
+    @staticmethod
+    def _connection_of_new_thread(manager: SqliteConnectionManager):
+        result = []
+        thread = threading.Thread(target=lambda: result.append(manager.connection))
+        thread.start()
+        thread.join()
+        return result[0]
+
+    # region Connection tests
+    def test_per_thread_connections_are_isolated(self):
+        manager = self._create_manager()
+
+        connection = manager.connection
+
+        self.assertIs(connection, manager.connection)
+        self.assertIsNot(connection, self._connection_of_new_thread(manager))
+
+    def test_shared_connection(self):
+        manager = self._create_manager(per_thread=False)
+
+        self.assertIs(manager.connection, self._connection_of_new_thread(manager))
+        self.assertEqual(manager.number_of_connections, 1)
+
+    def test_in_memory_database_is_shared(self):
+        manager = SqliteConnectionManager(":memory:")
+        self.addCleanup(manager.close)
+
+        self.assertIs(manager.connection, self._connection_of_new_thread(manager))
+
+    def test_connections_of_finished_threads_are_released(self):
+        manager = self._create_manager()
+        manager.connection
+
+        for _ in range(8):
+            self._connection_of_new_thread(manager)
+
+        # the connection of the last finished thread is released when the next connection is opened
+        self.assertLessEqual(manager.number_of_connections, 2)
+
+    def test_close_reopens_on_demand(self):
+        manager = self._create_manager()
+        connection = manager.connection
+
+        manager.close()
+
+        self.assertEqual(manager.number_of_connections, 0)
+        self.assertIsNot(connection, manager.connection)
+    # endregion
+
+    # region Profile tests
+    def test_journal_mode_is_wal(self):
+        manager = self._create_manager()
+
+        self.assertEqual(manager.connection.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+    def test_durable_profile_pragmas(self):
+        connection = self._create_manager().connection
+
+        self.assertEqual(connection.execute("PRAGMA synchronous").fetchone()[0], 2)    # FULL
+        self.assertEqual(connection.execute("PRAGMA cache_size").fetchone()[0], -16_384)
+
+    def test_throughput_profile_pragmas(self):
+        connection = self._create_manager(profile="throughput").connection
+
+        self.assertEqual(connection.execute("PRAGMA synchronous").fetchone()[0], 1)    # NORMAL
+        self.assertEqual(connection.execute("PRAGMA cache_size").fetchone()[0], -262_144)
+
+    def test_pragma_overrides_profile(self):
+        connection = self._create_manager(cache_size=-1024).connection
+
+        self.assertEqual(connection.execute("PRAGMA cache_size").fetchone()[0], -1024)
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            SqliteConnectionManager(self._database_file_path, profile="fast")
+    # endregion
+
+    # region Concurrency tests
+    def test_readers_proceed_while_writer_holds_transaction(self):
+        writer = self._create_manager()
+        writer.connection.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, value TEXT)")
+        writer.connection.executemany("INSERT INTO items (value) VALUES (?)", [(str(i),) for i in range(100)])
+        writer.connection.commit()
+
+        readers = self._create_manager(read_only=True)
+        writing = threading.Event()
+        done = threading.Event()
+
+        def ingest():
+            # keep a write transaction open while the readers run
+            writer.connection.execute("BEGIN IMMEDIATE")
+            writer.connection.executemany("INSERT INTO items (value) VALUES (?)", [("new",)] * 1000)
+            writing.set()
+            done.wait(timeout=10)
+            writer.connection.commit()
+
+        def read(_):
+            started = time.perf_counter()
+            count = readers.connection.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+            return count, time.perf_counter() - started
+
+        ingest_thread = threading.Thread(target=ingest)
+        ingest_thread.start()
+        self.assertTrue(writing.wait(timeout=10))
+
+        try:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(read, range(16)))
+        finally:
+            done.set()
+            ingest_thread.join()
+
+        # under WAL the readers neither block on nor see the uncommitted write transaction
+        self.assertTrue(all(count == 100 for count, _ in results))
+        self.assertTrue(all(elapsed < 1.0 for _, elapsed in results))
+        self.assertEqual(readers.connection.execute("SELECT COUNT(*) FROM items").fetchone()[0], 1100)
+    # endregion
+
+
+if __name__ == '__main__':
+    unittest.main()